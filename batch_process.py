@@ -9,13 +9,23 @@ import os
 import fcntl
 import sqlite3
 import logging
+import argparse
 import sys
 
 # Import existing functions from modules
 from excel_processor.sheet_processor import load_df_to_db
 from excel_processor.sheet_gen import sheet_gen, get_excel_files, SheetContents
 from excel_processor.df_gen import df_gen, SplitDataFrame
+from excel_processor.db_schema import (
+    PAYROLL_TABLE, LOAD_LOG_TABLE,
+    create_payroll_details_table, create_load_log_table, is_scaled_table,
+    create_payroll_indexes, drop_payroll_indexes,
+)
+from excel_processor.keyword_index import drop_keyword_triggers, refresh_keyword_index
+from excel_processor.dimensions import detail_storage_table, create_fact_table
 from excel_processor.config import setup_global_logging
+from payroll_shards import resolve_shard_key, shard_db_path_for_year, shard_file_filter, update_catalog_entry
+from cleansing_watermark import clear_watermarks, invalidate_files
 
 # Set up logging using global configuration
 setup_global_logging()
@@ -29,6 +39,21 @@ logger = logging.getLogger(__name__)
 # stale lock can only occur if the OS itself is killed mid-run, which we don't guard.
 BATCH_LOCK_PATH = "/tmp/payroll_batch.lock"
 
+# Staging rebuild: the full batch is loaded into *_staging tables, verified, and
+# then renamed over the live tables in one transaction. Readers keep seeing the
+# previous payroll_details until the swap commits; a crash mid-load only leaves
+# an orphaned staging table behind. With keep_snapshot the replaced tables are
+# kept as *_prev for rollback (overwritten by the next staging rebuild).
+# In the normalized storage mode the swapped detail table is payroll_details_fact;
+# the payroll_details view and the shared dimension tables stay in place.
+STAGING_SUFFIX = "_staging"
+SNAPSHOT_SUFFIX = "_prev"
+
+# The cleansing steps only ever delete rows, so a freshly loaded file should have
+# at least as many rows as its cleansed copy in the live table. A staged file
+# with more than this fraction fewer rows than the live one means rows were lost.
+STAGING_SHRINK_TOLERANCE = 0.05
+
 
 def acquire_batch_lock():
     """Acquire a non-blocking exclusive lock on BATCH_LOCK_PATH.
@@ -66,11 +91,12 @@ def acquire_batch_lock():
 
 
 def clean_database_tables():
-    """Clean payroll_details and load_log tables in the database."""
+    """Clean payroll_details and load_log tables (and the cleansing watermarks) in the database."""
     try:
         conn = sqlite3.connect(os.environ.get("SQLITE_DB_PATH"))
-        conn.execute("DELETE FROM payroll_details")
+        conn.execute(f"DELETE FROM {detail_storage_table(conn)}")
         conn.execute("DELETE FROM load_log")
+        clear_watermarks(conn)
         conn.commit()
         conn.close()
         logger.info("Database tables cleaned successfully")
@@ -78,16 +104,151 @@ def clean_database_tables():
         logger.error(f"Error cleaning database tables: {e}")
 
 
-def _process_excel_files(excel_files, clean_db=True):
+def _table_exists(conn, table_name):
+    cursor = conn.execute(
+        "SELECT 1 FROM sqlite_master WHERE type='table' AND name=?", (table_name,)
+    )
+    return cursor.fetchone() is not None
+
+
+def _swap_tables(conn):
+    """Tables replaced by a staging rebuild: the detail storage table and load_log."""
+    return (detail_storage_table(conn), LOAD_LOG_TABLE)
+
+
+def prepare_staging_tables():
+    """
+    Drop any leftover staging tables and create empty ones for a rebuild.
+
+    Returns:
+        str: Name of the staging detail table to load into
+    """
+    conn = sqlite3.connect(os.environ.get("SQLITE_DB_PATH"))
+    detail_table, log_table = _swap_tables(conn)
+    for table_name in (detail_table, log_table):
+        conn.execute(f"DROP TABLE IF EXISTS {table_name}{STAGING_SUFFIX}")
+    # Keep the live table's storage variant (decimal, integer-scaled or normalized)
+    if detail_table != PAYROLL_TABLE:
+        create_fact_table(conn, detail_table + STAGING_SUFFIX)
+    else:
+        scaled = _table_exists(conn, PAYROLL_TABLE) and is_scaled_table(conn, PAYROLL_TABLE)
+        create_payroll_details_table(conn, PAYROLL_TABLE + STAGING_SUFFIX, scaled=scaled)
+    create_load_log_table(conn, log_table + STAGING_SUFFIX)
+    conn.commit()
+    conn.close()
+    logger.info("Staging tables prepared")
+    return detail_table + STAGING_SUFFIX
+
+
+def verify_staging_table(excel_files, expected_rows):
+    """
+    Check the staging table before it is swapped in.
+
+    Besides comparing the staging row count with the counts reported by
+    load_df_to_db, every loaded file is compared with its rows in the live
+    table: a file that has rows in the live table but none in staging, or
+    more than STAGING_SHRINK_TOLERANCE fewer rows, fails the check.
+
+    Parameters:
+        excel_files (list): The Excel files that were loaded into staging
+        expected_rows (int): Sum of the row counts returned by load_df_to_db
+
+    Returns:
+        bool: True if the staging table can be swapped in
+    """
+    conn = sqlite3.connect(os.environ.get("SQLITE_DB_PATH"))
+    detail_table = detail_storage_table(conn)
+    staging_table = detail_table + STAGING_SUFFIX
+    staged = dict(conn.execute(f"SELECT 文件名, COUNT(*) FROM {staging_table} GROUP BY 文件名").fetchall())
+    live = {}
+    if _table_exists(conn, detail_table):
+        live = dict(conn.execute(f"SELECT 文件名, COUNT(*) FROM {detail_table} GROUP BY 文件名").fetchall())
+    conn.close()
+    staging_rows = sum(staged.values())
+
+    logger.info(
+        f"Staging verification: {staging_rows} rows from {len(staged)} files "
+        f"(expected {expected_rows} rows, live table has {sum(live.values())} rows)"
+    )
+    if staging_rows == 0:
+        logger.error("Staging table is empty, refusing to swap")
+        return False
+    if staging_rows != expected_rows:
+        logger.error(
+            f"Staging row count {staging_rows} does not match loaded row count {expected_rows}, refusing to swap"
+        )
+        return False
+
+    # Files removed from the Excel folders are expected to disappear; only the loaded ones are compared
+    shrunk = []
+    for file_name in excel_files:
+        live_rows = live.get(file_name, 0)
+        staged_rows = staged.get(file_name, 0)
+        if live_rows and staged_rows < live_rows * (1 - STAGING_SHRINK_TOLERANCE):
+            shrunk.append((file_name, live_rows, staged_rows))
+    if shrunk:
+        for file_name, live_rows, staged_rows in shrunk:
+            logger.error(f"  {file_name}: {live_rows} rows in the live table, {staged_rows} in staging")
+        logger.error(f"{len(shrunk)} files lost rows compared to the live table, refusing to swap")
+        return False
+    return True
+
+
+def swap_staging_tables(keep_snapshot=False):
+    """
+    Atomically replace payroll_details/load_log with their staging tables.
+
+    Parameters:
+        keep_snapshot (bool): Keep the replaced tables as *_prev instead of dropping them
+    """
+    conn = sqlite3.connect(os.environ.get("SQLITE_DB_PATH"), isolation_level=None)
+    # Keep views/triggers pointing at the live names while tables are renamed
+    # underneath them (SQLite >= 3.26 would otherwise rewrite them to *_prev).
+    conn.execute("PRAGMA legacy_alter_table = ON")
+    try:
+        conn.execute("BEGIN IMMEDIATE")
+        detail_table, log_table = _swap_tables(conn)
+        # A kept snapshot must not carry the keyword index triggers along
+        drop_keyword_triggers(conn, detail_table)
+        for table_name in (detail_table, log_table):
+            snapshot_table = table_name + SNAPSHOT_SUFFIX
+            conn.execute(f"DROP TABLE IF EXISTS {snapshot_table}")
+            if _table_exists(conn, table_name):
+                if keep_snapshot:
+                    conn.execute(f"ALTER TABLE {table_name} RENAME TO {snapshot_table}")
+                else:
+                    conn.execute(f"DROP TABLE {table_name}")
+            conn.execute(f"ALTER TABLE {table_name}{STAGING_SUFFIX} RENAME TO {table_name}")
+        # The snapshot still owns indexes named after the live table; drop them
+        # so the managed index set can be recreated on the new live table.
+        drop_payroll_indexes(conn, detail_table + SNAPSHOT_SUFFIX)
+        create_payroll_indexes(conn, detail_table)
+        # The staging table was loaded without triggers: refill the keyword index
+        refresh_keyword_index(conn, detail_table)
+        # Every file was reloaded: the cleansing steps must process them all again
+        clear_watermarks(conn)
+        conn.execute("COMMIT")
+    except Exception:
+        conn.execute("ROLLBACK")
+        raise
+    finally:
+        conn.close()
+    snapshot_note = f", previous tables kept as *{SNAPSHOT_SUFFIX}" if keep_snapshot else ""
+    logger.info(f"Staging tables swapped in{snapshot_note}")
+
+
+def _process_excel_files(excel_files, clean_db=True, table_name=PAYROLL_TABLE, log_table_name=LOAD_LOG_TABLE):
     """
     Private function to process Excel files and load to database.
     
     Parameters:
         excel_files (list): List of Excel file names to process
         clean_db (bool): Whether to clean database tables before processing
+        table_name (str): Detail table to load into
+        log_table_name (str): Log table to record discarded columns in
     
     Returns:
-        tuple: (total_sheets, total_dataframes, successful_loads, failed_loads)
+        tuple: (total_sheets, total_dataframes, successful_loads, failed_loads, loaded_rows)
     """
     if clean_db:
         clean_database_tables()
@@ -99,49 +260,100 @@ def _process_excel_files(excel_files, clean_db=True):
     total_dataframes = 0
     successful_loads = 0
     failed_loads = 0
+    loaded_rows = 0
+    loaded_files = set()
     
     for sheet_contents in sheet_gen(excel_files):
         logger.info(f"Processing sheet: {sheet_contents.file_name} - {sheet_contents.sheet_name}")
         total_sheets += 1
+        loaded_files.add(sheet_contents.file_name)
         
         for split_df in df_gen(sheet_contents):
             logger.info(f"  Generated dataframe: Table {split_df.table_index}, Shape={split_df.split_df.shape}")
             total_dataframes += 1
             
             # Call load_df_to_db to load the dataframe to database
-            result = load_df_to_db(
+            rows = load_df_to_db(
                 split_df.split_df, 
                 split_df.file_name, 
                 split_df.sheet_name, 
-                split_df.table_index
+                split_df.table_index,
+                table_name=table_name,
+                log_table_name=log_table_name,
             )
             
-            if "Successfully" in result:
+            if rows is not None:
                 successful_loads += 1
-                logger.info(f"    ✓ Successfully loaded to database: {result}")
+                loaded_rows += rows
+                logger.info(f"    ✓ Successfully loaded {rows} rows to database")
             else:
                 failed_loads += 1
-                logger.error(f"    ✗ Failed to load to database: {result}")
+                logger.error("    ✗ Failed to load to database (see the error above)")
+
+    if not clean_db and table_name == PAYROLL_TABLE:
+        # Rows appended to existing files: drop their cleansing watermarks so
+        # `--incremental` cleansing runs pick them up (see cleansing_watermark.py)
+        conn = sqlite3.connect(os.environ.get("SQLITE_DB_PATH"))
+        invalidate_files(conn, loaded_files)
+        conn.commit()
+        conn.close()
     
-    return total_sheets, total_dataframes, successful_loads, failed_loads
+    return total_sheets, total_dataframes, successful_loads, failed_loads, loaded_rows
 
 
-def batch_process_main():
+def batch_process_main(staging=False, keep_snapshot=False, shard=None):
     """
     Main batch processing logic with database loading.
     Complete end-to-end pipeline from files to database.
+
+    Parameters:
+        staging (bool): Load into staging tables and swap them in at the end
+            instead of emptying payroll_details up front
+        keep_snapshot (bool): With staging, keep the replaced tables as *_prev
+        shard (str): Only load the files of this year shard (SQLITE_DB_PATH must
+            already point at the shard database, see payroll_shards.py)
+
+    Returns:
+        bool: False if, with staging, a dataframe failed to load or the staging
+            tables failed verification, so they were not swapped in
     """
     logger.info("Starting batch process main logic (with database loading)...")
 
     # Get all Excel files
     excel_files = get_excel_files()
+    if shard:
+        excel_files = shard_file_filter(excel_files, shard)
+        logger.info(f"Shard {shard}: {len(excel_files)} files")
     # excel_files = excel_files[:4]
     
     # Process files using the common logic
-    total_sheets, total_dataframes, successful_loads, failed_loads = _process_excel_files(excel_files, clean_db=True)
+    if staging:
+        staging_table = prepare_staging_tables()
+        total_sheets, total_dataframes, successful_loads, failed_loads, loaded_rows = _process_excel_files(
+            excel_files,
+            clean_db=False,
+            table_name=staging_table,
+            log_table_name=LOAD_LOG_TABLE + STAGING_SUFFIX,
+        )
+    else:
+        total_sheets, total_dataframes, successful_loads, failed_loads, loaded_rows = _process_excel_files(excel_files, clean_db=True)
     
     logger.info(f"Batch process completed. Processed {total_sheets} sheets and {total_dataframes} dataframes.")
-    logger.info(f"Database loading results: {successful_loads} successful, {failed_loads} failed")
+    logger.info(f"Database loading results: {successful_loads} successful, {failed_loads} failed, {loaded_rows} rows")
+
+    if staging:
+        if failed_loads:
+            logger.error(
+                f"{failed_loads} dataframes failed to load, refusing to swap; "
+                f"live tables left untouched, fix the errors above and rerun"
+            )
+            return False
+        if verify_staging_table(excel_files, loaded_rows):
+            swap_staging_tables(keep_snapshot=keep_snapshot)
+        else:
+            logger.error(f"Live tables left untouched; inspect {staging_table} and rerun")
+            return False
+    return True
 
 
 def process_single_file(file_name: str):
@@ -170,23 +382,43 @@ def process_single_file(file_name: str):
     excel_files = [file_name]
     
     # Process files using the common logic (don't clean DB for single file processing)
-    total_sheets, total_dataframes, successful_loads, failed_loads = _process_excel_files(excel_files, clean_db=False)
+    total_sheets, total_dataframes, successful_loads, failed_loads, _ = _process_excel_files(excel_files, clean_db=False)
     
     logger.info(f"Single file processing completed. Processed {total_sheets} sheets and {total_dataframes} dataframes.")
     logger.info(f"Database loading results: {successful_loads} successful, {failed_loads} failed")
 
 
 if __name__ == "__main__":
-    import sys
+    parser = argparse.ArgumentParser(description="Batch process payroll Excel files into the database")
+    parser.add_argument("file_name", nargs="?", help="Process only this Excel file (DB is not cleaned)")
+    parser.add_argument(
+        "--staging",
+        action="store_true",
+        help="Full rebuild into staging tables, verified and swapped in atomically",
+    )
+    parser.add_argument(
+        "--keep-snapshot",
+        action="store_true",
+        help=f"With --staging, keep the replaced tables as *{SNAPSHOT_SUFFIX} for rollback",
+    )
+    parser.add_argument(
+        "--shard",
+        help="Load into the shard database holding this year (e.g. 2025) instead of SQLITE_DB_PATH, see payroll_shards.py",
+    )
+    args = parser.parse_args()
+
+    if args.shard:
+        os.environ["SQLITE_DB_PATH"] = str(shard_db_path_for_year(args.shard))
+        logger.info(f"Target shard database: {os.environ['SQLITE_DB_PATH']}")
 
     # Acquire exclusive lock BEFORE any DB work (covers both batch and single-file mode).
     # Released automatically on process exit. See acquire_batch_lock() for context.
     _batch_lock_fd = acquire_batch_lock()
 
     # Check for command line parameter
-    if len(sys.argv) > 1:
+    if args.file_name:
         # Process single file mode
-        file_name = sys.argv[1]
+        file_name = args.file_name
         try:
             process_single_file(file_name)
         except FileNotFoundError as e:
@@ -199,4 +431,8 @@ if __name__ == "__main__":
             logger.error(f"Error processing file '{file_name}': {e}")
     else:
         # Normal mode - use batch_process_main function for complete processing
-        batch_process_main()
+        if not batch_process_main(staging=args.staging, keep_snapshot=args.keep_snapshot, shard=args.shard):
+            sys.exit(1)
+
+    if args.shard:
+        update_catalog_entry(resolve_shard_key(args.shard))
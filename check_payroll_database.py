@@ -8,10 +8,12 @@ import sqlite3
 import pandas as pd
 import os
 import sys
+from decimal import Decimal
 
 # Import database configuration
 sys.path.append(os.path.join(os.path.dirname(__file__), 'excel_processor'))
 from config import setup_global_logging
+from db_schema import is_scaled_table, scaled_column, SCALE
 
 
 def print_table_with_format(df, max_rows=10):
@@ -78,8 +80,18 @@ def get_basic_statistics(cursor):
     stats['unique_models'] = cursor.fetchone()[0]
     
     # 金额统计
-    cursor.execute("SELECT MIN(金额), MAX(金额), AVG(金额), SUM(金额) FROM payroll_details;")
-    min_amount, max_amount, avg_amount, sum_amount = cursor.fetchone()
+    if is_scaled_table(cursor.connection):
+        # 整数存储 (金额_x100): 整数聚合, 结果精确
+        amount_x100 = scaled_column('金额')
+        cursor.execute(f"SELECT MIN({amount_x100}), MAX({amount_x100}), SUM({amount_x100}), COUNT({amount_x100}) FROM payroll_details;")
+        min_x100, max_x100, sum_x100, count = cursor.fetchone()
+        min_amount = Decimal(min_x100 or 0) / SCALE
+        max_amount = Decimal(max_x100 or 0) / SCALE
+        sum_amount = Decimal(sum_x100 or 0) / SCALE
+        avg_amount = sum_amount / count if count else Decimal(0)
+    else:
+        cursor.execute("SELECT MIN(金额), MAX(金额), AVG(金额), SUM(金额) FROM payroll_details;")
+        min_amount, max_amount, avg_amount, sum_amount = cursor.fetchone()
     stats['min_amount'] = min_amount
     stats['max_amount'] = max_amount
     stats['avg_amount'] = avg_amount
@@ -153,8 +165,8 @@ def check_payroll_details_table():
         
         print("成功连接到数据库")
         
-        # 检查payroll_details表是否存在
-        cursor.execute("SELECT name FROM sqlite_master WHERE type='table' AND name='payroll_details';")
+        # 检查payroll_details表是否存在（规范化存储模式下为视图）
+        cursor.execute("SELECT name FROM sqlite_master WHERE type IN ('table', 'view') AND name='payroll_details';")
         table_exists = cursor.fetchone()
         
         if not table_exists:
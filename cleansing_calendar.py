@@ -0,0 +1,188 @@
+#!/usr/bin/env python3
+"""
+工作日日历 - 按 (年, 月) 预先计算的日历查询，供清洗步骤和日期校验共用。
+
+Step 4 原来对每条匹配记录都重新构造 holidays.China(years=year) 并从 1 日逐天
+向后找第一个工作日; validate_date_column.py 对每条记录调用 calendar.monthrange()。
+这里在每次运行开始时一次性计算文件范围内每个 (年, 月) 的:
+
+- 第一个工作日 (周一至周五, 且不是中国法定节假日);
+- 当月天数;
+- 休息日 (周末 + 法定节假日, 日号集合)。
+
+之后都是字典查询 (O(1))。holidays 库对全部年份只构造一次; 未安装时只按周末判断。
+预计算范围外的 (年, 月) 在第一次查询时计算并缓存，结果相同。
+
+年份范围取自数据库中的 文件名 (YYYY 前缀) 和分片目录 (payroll_shards.py) 登记的年份。
+
+用法:
+    python cleansing_calendar.py [--shard YEAR] [--year YEAR]
+
+参数:
+    无参数    打印数据库文件范围内每个月的第一个工作日、天数和休息日
+    --year YEAR  只打印该年份 (不读取数据库)
+    --shard YEAR  只处理该年份的分片数据库 (见 payroll_shards.py)
+"""
+
+import sqlite3
+import sys
+import argparse
+import calendar
+from collections import namedtuple
+from datetime import date, timedelta
+from pathlib import Path
+
+from payroll_shards import shard_db_path_for_year, read_catalog, file_year
+
+try:
+    import holidays
+    HAS_HOLIDAYS = True
+except ImportError:
+    HAS_HOLIDAYS = False
+
+DB_PATH = Path(__file__).parent.parent / "payroll_database.db"
+PAYROLL_TABLE = "payroll_details"
+
+# 第一个工作日最多向后找的天数 (与原 Step 4 相同)
+MAX_SEARCH_DAYS = 31
+
+MonthInfo = namedtuple("MonthInfo", ["first_working_day", "days_in_month", "rest_days"])
+
+
+class WorkingDayCalendar:
+    """(年, 月) -> MonthInfo 的预计算字典。"""
+
+    def __init__(self, years=()):
+        self._months = {}
+        self._holidays = {}
+        self.precompute(years)
+
+    def _holidays_for(self, years) -> set:
+        """法定节假日集合 (按年缓存, 未缓存的年份一次性构造)。"""
+        missing = sorted(set(years) - set(self._holidays))
+        if missing:
+            per_year = {year: set() for year in missing}
+            if HAS_HOLIDAYS:
+                for day in holidays.China(years=missing):
+                    if day.year in per_year:
+                        per_year[day.year].add(day)
+            self._holidays.update(per_year)
+        result = set()
+        for year in years:
+            result |= self._holidays[year]
+        return result
+
+    def _compute(self, year: int, month: int, cn_holidays: set) -> MonthInfo:
+        days_in_month = calendar.monthrange(year, month)[1]
+        rest_days = frozenset(
+            day for day in range(1, days_in_month + 1)
+            if date(year, month, day).weekday() >= 5 or date(year, month, day) in cn_holidays
+        )
+        current = date(year, month, 1)
+        for _ in range(MAX_SEARCH_DAYS):
+            # 0=Monday, 5=Saturday, 6=Sunday
+            if current.weekday() < 5 and current not in cn_holidays:
+                break
+            current += timedelta(days=1)
+        return MonthInfo(current, days_in_month, rest_days)
+
+    def precompute(self, years):
+        """计算 years 中每年 12 个月的 MonthInfo (已有的跳过)。"""
+        years = sorted(set(years))
+        if not years:
+            return
+        # 12 月向后找工作日可能跨到下一年
+        cn_holidays = self._holidays_for(years + [years[-1] + 1])
+        for year in years:
+            for month in range(1, 13):
+                if (year, month) not in self._months:
+                    self._months[(year, month)] = self._compute(year, month, cn_holidays)
+
+    def month(self, year: int, month: int) -> MonthInfo:
+        """(年, 月) 的 MonthInfo; 月份无效时与 calendar.monthrange() 一样抛出 ValueError。"""
+        info = self._months.get((year, month))
+        if info is None:
+            cn_holidays = self._holidays_for([year, year + 1])
+            info = self._compute(year, month, cn_holidays)
+            self._months[(year, month)] = info
+        return info
+
+    def first_working_day(self, year: int, month: int) -> date:
+        return self.month(year, month).first_working_day
+
+    def days_in_month(self, year: int, month: int) -> int:
+        return self.month(year, month).days_in_month
+
+    def rest_days(self, year: int, month: int) -> frozenset:
+        return self.month(year, month).rest_days
+
+    def __len__(self):
+        return len(self._months)
+
+
+# 进程内共用的日历 (Step 4、cleansing_engine.py、validate_date_column.py)
+_calendar = WorkingDayCalendar()
+
+
+def get_calendar() -> WorkingDayCalendar:
+    return _calendar
+
+
+def calendar_years(conn: sqlite3.Connection, table: str = PAYROLL_TABLE) -> list:
+    """数据库中 文件名 的年份 (走 文件名 索引) 加上分片目录登记的年份范围。"""
+    years = {
+        file_year(prefix)
+        for (prefix,) in conn.execute(f"SELECT DISTINCT substr(文件名, 1, 4) FROM {table}")
+    }
+    for _, first_year, last_year, *_ in read_catalog():
+        if first_year is not None and last_year is not None:
+            years.update(range(first_year, last_year + 1))
+    return sorted(year for year in years if year is not None)
+
+
+def load_calendar(conn: sqlite3.Connection) -> WorkingDayCalendar:
+    """为 conn 的文件年份范围预计算共用日历并返回。"""
+    _calendar.precompute(calendar_years(conn))
+    return _calendar
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description="工作日日历 - 打印每月第一个工作日、天数和休息日"
+    )
+    parser.add_argument(
+        "--year",
+        type=int,
+        help="只打印该年份 (不读取数据库)"
+    )
+    parser.add_argument(
+        "--shard",
+        help="只处理指定年份的分片数据库 (见 payroll_shards.py)，如 2025"
+    )
+    args = parser.parse_args()
+
+    if args.year:
+        years = [args.year]
+    else:
+        db_path = shard_db_path_for_year(args.shard) if args.shard else DB_PATH
+        if not db_path.exists():
+            print(f"错误: 数据库文件不存在: {db_path}")
+            sys.exit(1)
+        conn = sqlite3.connect(str(db_path))
+        years = calendar_years(conn)
+        conn.close()
+
+    cal = get_calendar()
+    cal.precompute(years)
+    if not HAS_HOLIDAYS:
+        print("警告: holidays 模块未安装，休息日只包含周末（不考虑法定节假日）")
+    print(f"{'年月':<8} {'第一个工作日':<12} {'天数':>4}  休息日")
+    for year in years:
+        for month in range(1, 13):
+            info = cal.month(year, month)
+            rest = ",".join(str(d) for d in sorted(info.rest_days))
+            print(f"{year}-{month:02d}  {info.first_working_day.isoformat():<12} {info.days_in_month:>4}  {rest}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,440 @@
+#!/usr/bin/env python3
+"""
+清洗步骤的变更集文件 (plan / apply / undo)。
+
+各步骤的 --dry-run 与正式运行原来要把整表扫描、解析各做一遍。现在:
+
+- --dry-run 把计算出的变更 (逐条 rowid 的 旧值 -> 新值、要删除的完整记录) 连同
+  数据库的数据版本写入变更集文件 (gzip 压缩的 JSON，默认放在 changesets/ 目录)；
+- --apply <变更集> 先核对数据版本 (文件头修改计数 + 记录数 + 最大 rowid) 未变、
+  每条记录的当前值仍为旧值，再批量写入，不再重新扫描；
+- 每次写入 (正式运行或 --apply) 之后都会写出对应的撤销文件 (*_undo.json.gz)，
+  它本身也是变更集: 更新的新旧值互换，删除的记录改为按原值重新插入。
+  撤销文件同样用 --apply 应用，可替代整库备份来回退单个步骤。
+- 应用计划文件后记录该步骤的清洗水位；应用撤销文件后清空全部水位
+  (见 cleansing_watermark.py)。
+
+用法:
+    python cleansing_changeset.py <变更集文件> [--apply | --roundtrip] [--shard YEAR]
+
+参数:
+    无 --apply    打印变更集摘要，并检查能否应用到当前数据库
+    --apply       应用变更集 (可以是任一步骤的计划文件或撤销文件)
+    --roundtrip   在数据库的临时副本上 应用变更集 -> 写出并应用撤销文件，检查数据表
+                  逐行回到应用前的内容 (不修改数据库)，如
+                  python cleansing_misc_step8.py --dry-run
+                  python cleansing_changeset.py changesets/step8_plan.json.gz --roundtrip
+    --shard YEAR  只处理该年份的分片数据库 (见 payroll_shards.py)
+"""
+
+import gzip
+import json
+import sqlite3
+import sys
+import argparse
+import tempfile
+from datetime import datetime
+from pathlib import Path
+
+from payroll_shards import shard_db_path_for_year
+from cleansing_db_utils import (
+    CHUNK_SIZE, bulk_update_column, bulk_delete_rowids, full_row_columns, full_row_select,
+    generated_columns,
+)
+from cleansing_watermark import ALL_STEPS, clear_watermarks, record_watermark
+from excel_processor.dimensions import view_insert_keeps_rowid
+
+DB_PATH = Path(__file__).parent.parent / "payroll_database.db"
+PAYROLL_TABLE = "payroll_details"
+CHANGESET_DIR = Path(__file__).parent / "changesets"
+CHANGESET_FORMAT = 1
+
+
+def data_version(conn: sqlite3.Connection, table: str = PAYROLL_TABLE) -> dict:
+    """
+    数据库的数据版本: 文件头第 24~27 字节的修改计数 (每次提交写入都会加 1)，
+    再加上记录数和最大 rowid (内存数据库或读不到文件头时只有后两项)。
+    """
+    change_counter = None
+    for _, name, path in conn.execute("PRAGMA database_list"):
+        if name == 'main' and path and Path(path).exists():
+            with open(path, 'rb') as f:
+                header = f.read(28)
+            if len(header) == 28:
+                change_counter = int.from_bytes(header[24:28], 'big')
+    row_count, max_rowid = conn.execute(
+        f"SELECT COUNT(*), MAX(rowid) FROM {table}"
+    ).fetchone()
+    return {'change_counter': change_counter, 'row_count': row_count, 'max_rowid': max_rowid}
+
+
+def plan_path(step: str) -> Path:
+    """--dry-run 写出的计划文件路径。"""
+    return CHANGESET_DIR / f"{step}_plan.json.gz"
+
+
+def undo_path(step: str) -> Path:
+    """写入后生成的撤销文件路径 (带时间戳, 不覆盖以前的撤销文件)。"""
+    return CHANGESET_DIR / f"{step}_{datetime.now().strftime('%Y%m%d_%H%M%S')}_undo.json.gz"
+
+
+def _is_view(conn: sqlite3.Connection, table: str) -> bool:
+    row = conn.execute("SELECT type FROM sqlite_master WHERE name = ?", (table,)).fetchone()
+    return row is not None and row[0] == 'view'
+
+
+def _fetch_by_rowid(conn: sqlite3.Connection, column: str, rowids, table: str) -> dict:
+    """按批读取 {rowid: 列值}；column 为 None 时只检查记录是否存在。"""
+    rowids = list(rowids)
+    result = {}
+    select = f"rowid, {column}" if column else "rowid, NULL"
+    for i in range(0, len(rowids), CHUNK_SIZE):
+        chunk = rowids[i:i + CHUNK_SIZE]
+        placeholders = ",".join("?" * len(chunk))
+        for rowid, value in conn.execute(
+            f"SELECT {select} FROM {table} WHERE rowid IN ({placeholders})", chunk
+        ):
+            result[rowid] = value
+    return result
+
+
+class ChangeSet:
+    """
+    某一步骤对 payroll_details 的一组变更。
+
+    updates: {列名: [[rowid, 旧值, 新值], ...]}
+    deletes: 要删除的完整记录 (与 columns 对应, rowid 在第 0 列)
+    inserts: 要插入的完整记录 (撤销删除时使用)
+
+    columns 不含生成列 (整数存储模式的 计件数量/金额 等): 记录按 *_x100 列保存和重新插入。
+    """
+
+    def __init__(self, step: str, table: str = PAYROLL_TABLE, version: dict = None,
+                 columns: list = None, kind: str = 'plan'):
+        self.step = step
+        self.kind = kind
+        self.table = table
+        self.version = version
+        self.columns = columns or []
+        self.created_at = datetime.now().isoformat(timespec='seconds')
+        self.updates = {}
+        self.deletes = []
+        self.inserts = []
+        # add_delete 收到的整行 (full_row_select) 中要保存的列序号 (None 为全部)
+        self._row_idx = None
+
+    @classmethod
+    def capture(cls, conn: sqlite3.Connection, step: str, table: str = PAYROLL_TABLE):
+        """
+        在扫描数据之前调用，记录当前的数据版本和完整记录的列名。
+        之后 add_delete 接收 full_row_select 读出的整行 (与 full_row_columns 对应)，去掉生成列后保存。
+        """
+        columns = full_row_columns(conn, table)
+        generated = generated_columns(conn, table)
+        changeset = cls(step, table, data_version(conn, table),
+                        [c for c in columns if c not in generated])
+        if generated:
+            changeset._row_idx = [i for i, c in enumerate(columns) if c not in generated]
+        return changeset
+
+    def add_update(self, column: str, rowid, old_value, new_value):
+        self.updates.setdefault(column, []).append([rowid, old_value, new_value])
+
+    def add_delete(self, row):
+        if self._row_idx is not None:
+            row = [row[i] for i in self._row_idx]
+        self.deletes.append(list(row))
+
+    def update_count(self) -> int:
+        return sum(len(items) for items in self.updates.values())
+
+    def summary_line(self) -> str:
+        label = '撤销文件' if self.kind == 'undo' else '变更集'
+        parts = [f"删除 {len(self.deletes)} 条"]
+        if self.inserts:
+            parts.append(f"插入 {len(self.inserts)} 条")
+        parts.append(f"更新 {self.update_count()} 个值")
+        for column, items in self.updates.items():
+            parts.append(f"{column}: {len(items)}")
+        return f"{label} [{self.step}] " + ", ".join(parts)
+
+    # ------------------------------------------------------------------
+    # 文件读写
+    # ------------------------------------------------------------------
+
+    def write(self, path: Path) -> Path:
+        path = Path(path)
+        path.parent.mkdir(parents=True, exist_ok=True)
+        data = {
+            'format': CHANGESET_FORMAT,
+            'step': self.step,
+            'kind': self.kind,
+            'table': self.table,
+            'created_at': self.created_at,
+            'version': self.version,
+            'columns': self.columns,
+            'updates': self.updates,
+            'deletes': self.deletes,
+            'inserts': self.inserts,
+        }
+        with gzip.open(path, 'wt', encoding='utf-8') as f:
+            json.dump(data, f, ensure_ascii=False, separators=(',', ':'))
+        return path
+
+    @classmethod
+    def load(cls, path: Path):
+        with gzip.open(path, 'rt', encoding='utf-8') as f:
+            data = json.load(f)
+        if data.get('format') != CHANGESET_FORMAT:
+            raise ValueError(f"不支持的变更集格式: {data.get('format')}")
+        changeset = cls(data['step'], data['table'], data['version'], data['columns'],
+                        data['kind'])
+        changeset.created_at = data['created_at']
+        changeset.updates = data['updates']
+        changeset.deletes = data['deletes']
+        changeset.inserts = data['inserts']
+        return changeset
+
+    # ------------------------------------------------------------------
+    # 核对 / 应用 / 撤销
+    # ------------------------------------------------------------------
+
+    def verify(self, conn: sqlite3.Connection) -> list:
+        """
+        返回无法应用的原因列表 (为空表示可以应用)。
+        计划文件要求数据版本完全一致；撤销文件允许之后还有其他写入 (例如按倒序
+        逐个撤销多个步骤)，只逐条核对涉及的记录仍是写入后的值。
+        """
+        current = data_version(conn, self.table)
+        if self.kind == 'plan' and current != self.version:
+            return [f"数据版本已变化: 变更集 {self.version}, 当前 {current}"]
+
+        problems = []
+        # 本变更集重新插入的记录 (撤销删除) 先插入再更新, 核对时还不存在
+        inserted = {row[0] for row in self.inserts}
+        for column, items in self.updates.items():
+            values = _fetch_by_rowid(conn, column, (rowid for rowid, _, _ in items), self.table)
+            for rowid, old_value, _ in items:
+                if rowid in inserted:
+                    continue
+                if rowid not in values:
+                    problems.append(f"rowid={rowid} 不存在 (更新 {column})")
+                elif values[rowid] != old_value:
+                    problems.append(
+                        f"rowid={rowid} 的 {column} 为 {values[rowid]!r}, 变更集中的旧值为 {old_value!r}"
+                    )
+        existing = _fetch_by_rowid(conn, None, (row[0] for row in self.deletes), self.table)
+        for row in self.deletes:
+            if row[0] not in existing:
+                problems.append(f"rowid={row[0]} 不存在 (删除)")
+        if self.inserts and _is_view(conn, self.table) and not view_insert_keeps_rowid(conn, self.table):
+            problems.append(
+                f"视图 {self.table} 的插入触发器不保留 rowid (旧版本创建), "
+                f"请先运行 update_database_schema.py --normalize-dimensions 更新触发器"
+            )
+        if self.inserts:
+            existing = _fetch_by_rowid(conn, None, (row[0] for row in self.inserts), self.table)
+            for rowid in existing:
+                problems.append(f"rowid={rowid} 已存在 (插入)")
+        return problems
+
+    def apply(self, conn: sqlite3.Connection) -> tuple:
+        """批量写入 (不提交)，返回 (插入数, 删除数, 更新数)。"""
+        inserted = 0
+        if self.inserts:
+            # 按原 rowid 重新插入 (视图的 INSTEAD OF INSERT 触发器把 rowid 传给事实表);
+            # 规范化模式下以前的变更集中 rowid 列出现两次, 只取第 0 列。
+            # 以前的变更集可能含生成列, 插入时跳过 (值由 *_x100 列生成)
+            generated = generated_columns(conn, self.table)
+            data_idx = [i for i, c in enumerate(self.columns) if c != 'rowid' and c not in generated]
+            names = ['rowid'] + [self.columns[i] for i in data_idx]
+            rows = [[row[0]] + [row[i] for i in data_idx] for row in self.inserts]
+            conn.executemany(
+                f"INSERT INTO {self.table} ({', '.join(names)}) "
+                f"VALUES ({', '.join('?' * len(names))})",
+                rows
+            )
+            inserted = len(rows)
+        deleted = bulk_delete_rowids(conn, [row[0] for row in self.deletes], self.table)
+        updated = 0
+        for column, items in self.updates.items():
+            bulk_update_column(conn, column, [(new, rowid) for rowid, _, new in items], self.table)
+            updated += len(items)
+        return inserted, deleted, updated
+
+    def inverse(self, conn: sqlite3.Connection):
+        """应用 (并提交) 之后调用: 生成撤销变更集，数据版本取当前版本。"""
+        undo = ChangeSet(self.step, self.table, data_version(conn, self.table), self.columns,
+                         kind='undo')
+        undo.updates = {
+            column: [[rowid, new, old] for rowid, old, new in items]
+            for column, items in self.updates.items()
+        }
+        undo.inserts = self.deletes
+        undo.deletes = self.inserts
+        return undo
+
+    def write_undo(self, conn: sqlite3.Connection) -> Path:
+        """写出撤销文件，返回路径。"""
+        return self.inverse(conn).write(undo_path(self.step))
+
+
+def table_differences(conn: sqlite3.Connection, other_path: Path, table: str = PAYROLL_TABLE) -> list:
+    """
+    比较 conn 与 other_path 两个数据库中的 table (rowid 和全部列)，返回差异说明列表。
+    """
+    columns = full_row_select(conn, table)
+    conn.execute("ATTACH DATABASE ? AS other", (str(other_path),))
+    try:
+        problems = []
+        counts = [conn.execute(f"SELECT COUNT(*) FROM {schema}.{table}").fetchone()[0]
+                  for schema in ("main", "other")]
+        if counts[0] != counts[1]:
+            problems.append(f"记录数 {counts[0]}, 原来为 {counts[1]}")
+        for first, second, label in (("main", "other", "多出"), ("other", "main", "缺少")):
+            rows = conn.execute(
+                f"SELECT {columns} FROM {first}.{table} EXCEPT SELECT {columns} FROM {second}.{table} "
+                f"ORDER BY 1 LIMIT 5"
+            ).fetchall()
+            problems.extend(f"{label}记录: {list(row)}" for row in rows)
+        return problems
+    finally:
+        conn.execute("DETACH DATABASE other")
+
+
+def roundtrip_check(db_path: Path, path: Path) -> list:
+    """
+    在 db_path 的临时副本上应用变更集，写出并重新载入撤销文件，再应用撤销文件，
+    检查数据表与 db_path 完全相同。db_path 本身不修改。返回问题列表 (为空表示通过)。
+    """
+    changeset = ChangeSet.load(path)
+    live = sqlite3.connect(str(db_path))
+    try:
+        problems = changeset.verify(live)
+        if problems:
+            return [f"变更集: {problem}" for problem in problems]
+        with tempfile.TemporaryDirectory() as tmp:
+            copy = sqlite3.connect(str(Path(tmp) / "roundtrip.db"))
+            try:
+                live.backup(copy)
+                changeset.apply(copy)
+                copy.commit()
+                undo = ChangeSet.load(changeset.inverse(copy).write(Path(tmp) / "undo.json.gz"))
+                problems = undo.verify(copy)
+                if problems:
+                    return [f"撤销文件: {problem}" for problem in problems]
+                undo.apply(copy)
+                copy.commit()
+                return table_differences(copy, db_path, changeset.table)
+            finally:
+                copy.close()
+    finally:
+        live.close()
+
+
+def apply_changeset_file(db_path: Path, path: Path, step: str = None,
+                         assume_yes: bool = False) -> int:
+    """
+    各步骤 --apply 的实现: 载入变更集、核对、确认后批量写入并写出撤销文件。
+    step 不为 None 时只接受该步骤的变更集；assume_yes 时跳过确认提示。返回进程退出码。
+    """
+    path = Path(path)
+    if not path.exists():
+        print(f"错误: 变更集文件不存在: {path}")
+        return 1
+    changeset = ChangeSet.load(path)
+    if step is not None and changeset.step != step:
+        print(f"错误: 变更集属于 {changeset.step}, 不是 {step}")
+        return 1
+
+    conn = sqlite3.connect(str(db_path))
+    print(f"{changeset.summary_line()} (生成于 {changeset.created_at})")
+    problems = changeset.verify(conn)
+    if problems:
+        print("错误: 变更集无法应用到当前数据库 (请重新运行 --dry-run 生成):")
+        for problem in problems[:20]:
+            print(f"  - {problem}")
+        if len(problems) > 20:
+            print(f"  ... 还有 {len(problems) - 20} 条未显示")
+        conn.close()
+        return 1
+
+    confirm = "yes" if assume_yes else input(f"\n[确认] 即将应用变更集 {path.name}。\n请输入 'yes' 确认: ")
+    if confirm.strip().lower() != "yes":
+        print("已取消操作。")
+        conn.close()
+        return 0
+
+    inserted, deleted, updated = changeset.apply(conn)
+    conn.commit()
+    if changeset.kind == 'undo':
+        # 撤销后相关文件回到未清洗状态, 下次 --incremental 全部重新处理
+        clear_watermarks(conn)
+        conn.commit()
+    else:
+        record_watermark(conn, ALL_STEPS if changeset.step == 'engine' else changeset.step,
+                         changeset.table)
+    print(f"已插入 {inserted} 条、删除 {deleted} 条记录, 更新 {updated} 个值。")
+    print(f"撤销文件: {changeset.write_undo(conn)}")
+    cursor = conn.execute(f"SELECT COUNT(*) FROM {changeset.table}")
+    print(f"操作完成后数据库共有 {cursor.fetchone()[0]} 条记录。")
+    conn.close()
+    return 0
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description="清洗步骤变更集 - 查看 / 应用计划文件或撤销文件"
+    )
+    parser.add_argument("changeset", help="变更集文件 (*.json.gz)")
+    parser.add_argument(
+        "--apply",
+        action="store_true",
+        help="应用变更集 (默认只打印摘要并检查能否应用)"
+    )
+    parser.add_argument(
+        "--roundtrip",
+        action="store_true",
+        help="在数据库的临时副本上应用变更集再撤销, 检查数据表回到原样 (不修改数据库)"
+    )
+    parser.add_argument(
+        "--shard",
+        help="只处理指定年份的分片数据库 (见 payroll_shards.py)，如 2025"
+    )
+    args = parser.parse_args()
+    db_path = shard_db_path_for_year(args.shard) if args.shard else DB_PATH
+
+    if not db_path.exists():
+        print(f"错误: 数据库文件不存在: {db_path}")
+        sys.exit(1)
+
+    if args.apply:
+        sys.exit(apply_changeset_file(db_path, args.changeset))
+
+    if args.roundtrip:
+        if not Path(args.changeset).exists():
+            print(f"错误: 变更集文件不存在: {args.changeset}")
+            sys.exit(1)
+        problems = roundtrip_check(db_path, Path(args.changeset))
+        if problems:
+            print(f"往返检查失败 ({len(problems)} 个问题):")
+            for problem in problems[:20]:
+                print(f"  - {problem}")
+            sys.exit(1)
+        print("往返检查通过: 应用变更集并撤销后数据表与原来完全相同。")
+        return
+
+    changeset = ChangeSet.load(Path(args.changeset))
+    print(f"{changeset.summary_line()} (生成于 {changeset.created_at})")
+    print(f"数据版本: {changeset.version}")
+    conn = sqlite3.connect(str(db_path))
+    problems = changeset.verify(conn)
+    conn.close()
+    if problems:
+        print(f"不能应用到当前数据库 ({len(problems)} 个问题), 例如: {problems[0]}")
+    else:
+        print("可以应用到当前数据库。")
+
+
+if __name__ == "__main__":
+    main()
@@ -17,10 +17,14 @@
 - 　(末尾空格) -> '' (去除)
 
 用法:
-    python cleansing_data_dbcs_handling_step0.py [--dry-run]
+    python cleansing_data_dbcs_handling_step0.py [--dry-run] [--apply CHANGESET] [--yes] [--incremental] [--shard YEAR]
 
 参数:
     --dry-run  仅预览，不执行更新
+    --apply CHANGESET  应用 --dry-run 写出的变更集 (或撤销文件)，不重新扫描
+    --yes      跳过 'yes' 确认提示 (非交互运行, 见 payroll_pipeline.py)
+    --incremental  只处理新文件或上次清洗后有变化的文件 (见 cleansing_watermark.py)
+    --shard YEAR  只处理该年份的分片数据库 (见 payroll_shards.py)
     无参数    执行更新操作
 """
 
@@ -29,9 +33,16 @@ import sys
 import argparse
 from pathlib import Path
 
+from payroll_shards import shard_db_path_for_year
+from cleansing_report import HtmlReport
+from cleansing_changeset import ChangeSet, apply_changeset_file, plan_path
+from cleansing_watermark import prepare_scope, record_watermark
+from cleansing_db_utils import bulk_update_column, count_rows, iter_rows, fetch_full_rows
+
 DB_PATH = Path(__file__).parent.parent / "payroll_database.db"
 OUTPUT_PATH = Path(__file__).parent / "dbcs_handling_step0_output.html"
 PAYROLL_TABLE = "payroll_details"
+CHANGESET_STEP = "step0"
 
 
 # 全角转半角映射表
@@ -65,45 +76,48 @@ def convert_dbcs(text: str) -> str:
     return result
 
 
-def export_to_html(columns: list, rows_with_changes: list, output_path: Path):
-    """导出更新记录到HTML文件。"""
-    html = f'''<!DOCTYPE html>
-<html>
-<head>
-<meta charset="UTF-8">
-<title>Step 0 - 全角转半角处理结果</title>
-<style>
-table {{ border-collapse: collapse; font-size: 12px; }}
-th, td {{ border: 1px solid #ddd; padding: 8px; }}
-th {{ background-color: #4472C4; color: white; position: sticky; top: 0; }}
-tr:nth-child(even) {{ background-color: #f2f2f2; }}
-tr:hover {{ background-color: #ddd; }}
-td {{ max-width: 200px; overflow: hidden; text-overflow: ellipsis; white-space: nowrap; }}
-</style>
-</head>
-<body>
-<h1>Step 0 - 全角转半角处理结果</h1>
-<p>共 {len(rows_with_changes)} 条记录被更新</p>
-<table>
-<tr><th>原日期</th><th>新日期</th>''' + ''.join(f'<th>{c}</th>' for c in columns) + '''</tr>
-'''
-    for old_date, new_date, row in rows_with_changes:
-        html += '<tr>'
-        html += f'<td>{old_date}</td>'
-        html += f'<td>{new_date}</td>'
-        html += ''.join(f'<td>{str(v) if v is not None else ""}</td>' for v in row)
-        html += '</tr>'
+def collect_dbcs_changes(columns: list, all_rows: list) -> tuple:
+    """
+    对每条记录的日期列做全角转半角，不访问数据库 (cleansing_engine.py 也复用此函数)。
+    返回 (updates, rows_with_changes, skipped)，updates 为 (新日期, rowid) 列表。
+    """
+    date_idx = columns.index('日期')
+    updates = []
+    rows_with_changes = []
+    skipped = 0
+
+    for row in all_rows:
+        rowid = row[0]
+        old_date = row[date_idx]
+
+        if old_date is None or str(old_date).strip() == '':
+            skipped += 1
+            continue
 
-    html += '''
-</table>
-</body>
-</html>'''
+        old_date_str = str(old_date)
+
+        # 转换全角字符
+        new_date_str = convert_dbcs(old_date_str)
+
+        if new_date_str != old_date_str:
+            updates.append((new_date_str, rowid))
+            rows_with_changes.append((old_date_str, new_date_str, row))
 
-    with open(output_path, 'w', encoding='utf-8') as f:
-        f.write(html)
+    return updates, rows_with_changes, skipped
 
 
-def main():
+def export_to_html(columns: list, rows_with_changes: list, output_path: Path) -> Path:
+    """导出更新记录到HTML文件 (流式写入, 见 cleansing_report.py)，返回实际写入的文件。"""
+    with HtmlReport(output_path, "Step 0 - 全角转半角处理结果") as report:
+        report.write(f"<h1>Step 0 - 全角转半角处理结果</h1>\n<p>共 {len(rows_with_changes)} 条记录被更新</p>\n")
+        report.table(
+            ["原日期", "新日期"] + list(columns),
+            ([old_date, new_date, *row] for old_date, new_date, row in rows_with_changes),
+        )
+    return report.path
+
+
+def main(argv=None):
     parser = argparse.ArgumentParser(
         description="清洁工资数据库中的日期列 - Step 0 (全角转半角)"
     )
@@ -112,47 +126,48 @@ def main():
         action="store_true",
         help="仅预览，不执行更新"
     )
-    args = parser.parse_args()
+    parser.add_argument(
+        "--apply",
+        metavar="CHANGESET",
+        help="应用 --dry-run 写出的变更集文件 (或撤销文件)，不重新扫描"
+    )
+    parser.add_argument(
+        "--yes",
+        action="store_true",
+        help="跳过 'yes' 确认提示 (供 payroll_pipeline.py 等非交互调用)"
+    )
+    parser.add_argument(
+        "--incremental",
+        action="store_true",
+        help="只处理新文件或上次清洗后有变化的文件 (按 文件名 记录的水位, 见 cleansing_watermark.py)"
+    )
+    parser.add_argument(
+        "--shard",
+        help="只处理指定年份的分片数据库 (见 payroll_shards.py)，如 2025"
+    )
+    args = parser.parse_args(argv)
+    db_path = shard_db_path_for_year(args.shard) if args.shard else DB_PATH
 
-    if not DB_PATH.exists():
-        print(f"错误: 数据库文件不存在: {DB_PATH}")
+    if not db_path.exists():
+        print(f"错误: 数据库文件不存在: {db_path}")
         sys.exit(1)
 
-    conn = sqlite3.connect(str(DB_PATH))
+    if args.apply:
+        sys.exit(apply_changeset_file(db_path, args.apply, CHANGESET_STEP, args.yes))
 
-    # 获取所有记录
-    cursor = conn.execute(f"SELECT rowid, * FROM {PAYROLL_TABLE}")
-    columns = [desc[0] for desc in cursor.description]
-    all_rows = cursor.fetchall()
+    conn = sqlite3.connect(str(db_path))
+    changeset = ChangeSet.capture(conn, CHANGESET_STEP)
+    scope = prepare_scope(conn, CHANGESET_STEP) if args.incremental else None
 
-    print(f"数据库共有 {len(all_rows)} 条记录")
+    # 只读取 rowid 和日期列, 分批流式处理 (完整记录只在导出报告时按需读取)
+    print(f"数据库共有 {count_rows(conn)} 条记录")
     print(f"开始处理全角字符...")
 
     # 处理每条记录
-    updates = []
-    skipped = 0
-    updated = 0
-
-    rows_with_changes = []
-
-    for row in all_rows:
-        rowid = row[0]
-        date_idx = columns.index('日期')
-        old_date = row[date_idx]
-
-        if old_date is None or str(old_date).strip() == '':
-            skipped += 1
-            continue
-
-        old_date_str = str(old_date)
-
-        # 转换全角字符
-        new_date_str = convert_dbcs(old_date_str)
-
-        if new_date_str != old_date_str:
-            updates.append((new_date_str, rowid))
-            rows_with_changes.append((old_date_str, new_date_str, row))
-            updated += 1
+    updates, rows_with_changes, skipped = collect_dbcs_changes(
+        ['rowid', '日期'], iter_rows(conn, ['日期'], where=scope)
+    )
+    updated = len(updates)
 
     # 按模式统计
     patterns = {}
@@ -171,12 +186,19 @@ def main():
     for old_pat, info in sorted_patterns[:20]:
         print(f"  '{old_pat}' -> '{info['new']}': {info['count']} records")
 
-    # 导出到HTML
-    export_to_html(columns, rows_with_changes, OUTPUT_PATH)
-    print(f"\n已导出到: {OUTPUT_PATH}")
+    # 导出到HTML (只为报告中的记录读取完整行)
+    columns, full_rows = fetch_full_rows(conn, [row[0] for _, _, row in rows_with_changes])
+    rows_with_changes = [(old, new, full_rows[row[0]]) for old, new, row in rows_with_changes]
+    report = export_to_html(columns, rows_with_changes, OUTPUT_PATH)
+    print(f"\n已导出到: {report}")
+
+    date_idx = columns.index('日期')
+    for old_date, new_date, row in rows_with_changes:
+        changeset.add_update('日期', row[0], row[date_idx], new_date)
 
     if args.dry_run:
         print(f"\n[DRY-RUN 模式] 预览: 本次可更新 {len(updates)} 条记录。")
+        print(f"变更集已写入: {changeset.write(plan_path(CHANGESET_STEP))} (可用 --apply 应用)")
     else:
         def count_table_records(conn):
             cursor = conn.execute(f"SELECT COUNT(*) FROM {PAYROLL_TABLE}")
@@ -186,18 +208,16 @@ def main():
         print(f"\n[确认更新] 数据库当前共有 {before_count} 条记录")
         print(f"[确认更新] 即将更新 {len(updates)} 条日期记录...")
 
-        confirm = input("请输入 'yes' 确认更新: ")
+        confirm = "yes" if args.yes else input("请输入 'yes' 确认更新: ")
         if confirm.strip().lower() == "yes":
             # 执行更新
-            for new_date, rowid in updates:
-                conn.execute(
-                    f"UPDATE {PAYROLL_TABLE} SET 日期 = ? WHERE rowid = ?",
-                    (new_date, rowid)
-                )
+            bulk_update_column(conn, '日期', updates)
             conn.commit()
+            record_watermark(conn, CHANGESET_STEP)
 
             after_count = count_table_records(conn)
             print(f"已成功更新 {len(updates)} 条记录。")
+            print(f"撤销文件: {changeset.write_undo(conn)}")
             print(f"更新后数据库共有 {after_count} 条记录。")
         else:
             print("已取消更新操作。")
@@ -0,0 +1,280 @@
+#!/usr/bin/env python3
+"""
+日期规范化字典 - Step 5 ~ Step 9 共用。
+
+日期列的不同取值远少于记录数 (同一个文件里大量记录的日期完全相同)，
+但各步骤原来对每条记录都重新解析一次日期。这里把解析结果持久化到
+数据库表 date_canonical_dict:
+
+    (步骤, 文件年月, 原始日期) -> (规范化日期, 分类, 说明)
+
+- 文件年月取文件名前 6 位 (如 '202504')；结果与文件无关的步骤 (5/7/8) 统一用 ''，
+  这样新月份可以直接复用以前解析过的日期。
+- 原始日期按数据库中的原值 (未 strip) 保存，便于用 `UPDATE ... FROM` 精确联表。
+- 规范化日期为 NULL 表示该日期在这一步不需要修改。
+- 每个步骤有自己的版本号 (DATE_DICT_VERSION)，解析逻辑修改后加 1，旧条目自动失效。
+
+各步骤只对字典中没有的 (文件年月, 原始日期) 调用解析函数，新结果写回字典，
+然后用一条联表 UPDATE 把字典应用到 payroll_details (SQLite < 3.33 没有
+`UPDATE ... FROM`，改用关联子查询的 UPDATE，结果相同)。
+
+用法:
+    python cleansing_date_dict.py [--clear] [--shard YEAR]
+
+参数:
+    无参数    按步骤打印字典条目统计
+    --clear  清空字典 (下次运行各步骤时全部重新解析)
+    --shard YEAR  只处理该年份的分片数据库 (见 payroll_shards.py)
+"""
+
+import sqlite3
+import sys
+import argparse
+from pathlib import Path
+
+from payroll_shards import shard_db_path_for_year
+from cleansing_parallel import parallel_compute
+from cleansing_db_utils import HAS_UPDATE_FROM
+
+DB_PATH = Path(__file__).parent.parent / "payroll_database.db"
+PAYROLL_TABLE = "payroll_details"
+DICT_TABLE = "date_canonical_dict"
+
+
+def ensure_dict_table(conn: sqlite3.Connection):
+    """创建字典表 (已存在则跳过)。"""
+    conn.execute(f"""
+        CREATE TABLE IF NOT EXISTS {DICT_TABLE} (
+            step TEXT NOT NULL,
+            version INTEGER NOT NULL,
+            file_ym TEXT NOT NULL,
+            raw_date TEXT NOT NULL,
+            canonical TEXT,
+            kind TEXT,
+            message TEXT,
+            PRIMARY KEY (step, file_ym, raw_date)
+        )
+    """)
+
+
+def dict_table_exists(conn: sqlite3.Connection) -> bool:
+    return conn.execute(
+        "SELECT 1 FROM sqlite_master WHERE type = 'table' AND name = ?", (DICT_TABLE,)
+    ).fetchone() is not None
+
+
+def file_year_month_key(file_name) -> str:
+    """文件名前 6 位为数字时返回 'YYYYMM'，否则返回 None (不缓存)。"""
+    if not file_name:
+        return None
+    ym = str(file_name)[:6]
+    if len(ym) == 6 and ym.isascii() and ym.isdigit():
+        return ym
+    return None
+
+
+class DateCanonDict:
+    """
+    某一步骤的日期规范化字典。
+
+    compute(stripped_date, file_name) 返回 (canonical, kind, message)，
+    canonical 为 None 表示不需要修改。per_file=False 时结果只取决于日期本身。
+    """
+
+    def __init__(self, step: str, version: int, compute, per_file: bool = True):
+        self.step = step
+        self.version = version
+        self.compute = compute
+        self.per_file = per_file
+        self.entries = {}
+        self.new_entries = {}
+        self.hits = 0
+        self.misses = 0
+        # prefetch() 预先解析、尚未被 lookup() 用到的键 (首次 lookup 仍计为新解析)
+        self.prefetched = set()
+
+    @classmethod
+    def load(cls, conn: sqlite3.Connection, step: str, version: int, compute,
+             per_file: bool = True):
+        """从数据库载入该步骤当前版本的字典条目 (字典表不存在时为空字典)。"""
+        date_dict = cls(step, version, compute, per_file)
+        if dict_table_exists(conn):
+            cursor = conn.execute(
+                f"SELECT file_ym, raw_date, canonical, kind, message FROM {DICT_TABLE} "
+                f"WHERE step = ? AND version = ?",
+                (step, version)
+            )
+            for file_ym, raw_date, canonical, kind, message in cursor:
+                date_dict.entries[(file_ym, raw_date)] = (canonical, kind, message)
+        return date_dict
+
+    def lookup(self, raw_date, file_name) -> tuple:
+        """返回 (canonical, kind, message)；字典中没有时调用 compute 并记录新条目。"""
+        file_ym = file_year_month_key(file_name) if self.per_file else ''
+        if file_ym is None:
+            # 文件名无法提取年月: 不缓存, 直接计算
+            self.misses += 1
+            return self.compute(str(raw_date).strip(), file_name)
+
+        key = (file_ym, raw_date)
+        result = self.entries.get(key)
+        if result is not None:
+            if key in self.prefetched:
+                self.prefetched.discard(key)
+                self.misses += 1
+            else:
+                self.hits += 1
+            return result
+
+        self.misses += 1
+        result = self.compute(str(raw_date).strip(), file_name)
+        self.entries[key] = result
+        self.new_entries[key] = result
+        return result
+
+    def prefetch(self, pairs, workers: int = 1) -> int:
+        """
+        把 (原始日期, 文件名) 中字典没有的条目按文件年月分区，用进程池并行解析
+        (见 cleansing_parallel.py)，之后逐行 lookup() 直接命中，结果与串行相同。
+        空日期和无法提取年月的文件名跳过 (与 lookup() 一致)。返回解析的条目数。
+        """
+        partitions = {}
+        for raw_date, file_name in pairs:
+            if raw_date is None or str(raw_date).strip() == '':
+                continue
+            file_ym = file_year_month_key(file_name) if self.per_file else ''
+            if file_ym is None:
+                continue
+            key = (file_ym, raw_date)
+            if key in self.entries:
+                continue
+            args = (str(raw_date).strip(), file_name if self.per_file else None)
+            partitions.setdefault(file_ym, {}).setdefault(key, args)
+
+        results = parallel_compute(
+            self.compute,
+            {file_ym: list(items.items()) for file_ym, items in partitions.items()},
+            workers
+        )
+        self.entries.update(results)
+        self.new_entries.update(results)
+        self.prefetched.update(results)
+        return len(results)
+
+    def prefetch_from_db(self, conn: sqlite3.Connection, workers: int = 1,
+                         table: str = PAYROLL_TABLE, where: str = None) -> int:
+        """prefetch() 的数据库版本: 只读取去重后的 (日期, 文件名)，不读取整表。"""
+        file_column = "文件名" if self.per_file else "NULL"
+        where_clause = f"WHERE {where}" if where else ""
+        cursor = conn.execute(
+            f"SELECT DISTINCT 日期, {file_column} FROM {table} {where_clause}"
+        )
+        return self.prefetch(cursor, workers)
+
+    def save(self, conn: sqlite3.Connection) -> int:
+        """把本次新解析的条目写入字典表 (不提交)，返回写入条数。"""
+        if not self.new_entries:
+            return 0
+        ensure_dict_table(conn)
+        conn.executemany(
+            f"INSERT OR REPLACE INTO {DICT_TABLE} "
+            f"(step, version, file_ym, raw_date, canonical, kind, message) "
+            f"VALUES (?, ?, ?, ?, ?, ?, ?)",
+            [
+                (self.step, self.version, file_ym, raw_date, canonical, kind, message)
+                for (file_ym, raw_date), (canonical, kind, message) in self.new_entries.items()
+            ]
+        )
+        count = len(self.new_entries)
+        self.new_entries = {}
+        return count
+
+    def apply(self, conn: sqlite3.Connection, table: str = PAYROLL_TABLE,
+              where: str = None) -> int:
+        """
+        用一条联表 UPDATE 把字典应用到 payroll_details (不提交)。
+        需先调用 save()，以保证本次扫描到的所有日期都已在字典中。
+        where 为附加条件 (如增量模式的文件范围)。
+        """
+        if self.per_file:
+            file_match = f"d.file_ym = substr({table}.文件名, 1, 6)"
+        else:
+            file_match = "d.file_ym = ''"
+        entry_match = (
+            f"d.step = ? AND d.version = ? AND d.canonical IS NOT NULL "
+            f"AND d.raw_date = {table}.日期 AND {file_match}"
+        )
+        scope = f" AND ({where})" if where else ""
+        params = (self.step, self.version)
+
+        if not HAS_UPDATE_FROM:
+            # 主键 (step, file_ym, raw_date) 保证子查询最多一行
+            cursor = conn.execute(
+                f"UPDATE {table} SET 日期 = (SELECT d.canonical FROM {DICT_TABLE} AS d WHERE {entry_match}) "
+                f"WHERE EXISTS (SELECT 1 FROM {DICT_TABLE} AS d WHERE {entry_match}){scope}",
+                params + params
+            )
+            return cursor.rowcount
+
+        cursor = conn.execute(
+            f"UPDATE {table} SET 日期 = d.canonical "
+            f"FROM {DICT_TABLE} AS d "
+            f"WHERE {entry_match}{scope}",
+            params
+        )
+        return cursor.rowcount
+
+    def stats_line(self) -> str:
+        return (f"日期字典: 命中 {self.hits} 条, 新解析 {self.misses} 条 "
+                f"(新增条目 {len(self.new_entries)} 个)")
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description="日期规范化字典 (Step 5 ~ Step 9 共用) - 查看统计或清空"
+    )
+    parser.add_argument(
+        "--clear",
+        action="store_true",
+        help="清空字典 (下次运行各步骤时全部重新解析)"
+    )
+    parser.add_argument(
+        "--shard",
+        help="只处理指定年份的分片数据库 (见 payroll_shards.py)，如 2025"
+    )
+    args = parser.parse_args()
+    db_path = shard_db_path_for_year(args.shard) if args.shard else DB_PATH
+
+    if not db_path.exists():
+        print(f"错误: 数据库文件不存在: {db_path}")
+        sys.exit(1)
+
+    conn = sqlite3.connect(str(db_path))
+    if not dict_table_exists(conn):
+        print(f"字典表 {DICT_TABLE} 不存在 (尚未运行过 Step 5 ~ Step 9)。")
+        conn.close()
+        return
+
+    if args.clear:
+        confirm = input(f"[确认] 即将清空字典表 {DICT_TABLE}。\n请输入 'yes' 确认: ")
+        if confirm.strip().lower() != "yes":
+            print("已取消操作。")
+            conn.close()
+            sys.exit(0)
+        conn.execute(f"DELETE FROM {DICT_TABLE}")
+        conn.commit()
+        print("字典已清空。")
+        conn.close()
+        return
+
+    print(f"{'步骤':<8} {'版本':>4} {'条目数':>8} {'需修改':>8} {'文件年月数':>10}")
+    for step, version, total, changed, months in conn.execute(f"""
+        SELECT step, version, COUNT(*), COUNT(canonical), COUNT(DISTINCT file_ym)
+        FROM {DICT_TABLE} GROUP BY step, version ORDER BY step, version
+    """):
+        print(f"{step:<8} {version:>4} {total:>8} {changed:>8} {months:>10}")
+    conn.close()
+
+
+if __name__ == "__main__":
+    main()
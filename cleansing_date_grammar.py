@@ -0,0 +1,192 @@
+#!/usr/bin/env python3
+"""
+日期格式判断 - 规范格式快速判断和按文法的格式分类。
+
+Step 5 ~ Step 9 各自用一串正则判断日期是否需要处理，同一个字符串要被
+反复切分、匹配五次；而清洗后绝大多数日期已经是规范格式 (升序、逗号分隔、
+1~31，如 '2,3,15')。本模块提供:
+
+- is_canonical_date(): 只扫描一次即可判断是否为规范格式，各步骤据此跳过正则链；
+- classify_date_value(): 把任意日期字符串切分为记号 (数字 / 分隔符 / 范围符 /
+  括号 / 休 / 加班 / 其他文字)，按 "项 (分隔符 项)*" 的文法解析后给出分类，
+  供 validate_date_column.py 按格式统计无效日期。
+
+分类:
+    empty      空值
+    canonical  已是规范格式
+    day_list   由数字、范围和分隔符组成 (如 '1-3.5', 即 1,2,3,5)
+    annotated  含休息日/加班标注 (如 '1-5(3休', '6(加班)')
+    prefixed   以文件年月为前缀 (如 '25,4,1,2' 或 '4,1,2', 需给出文件年月)
+    text       含非日期文字
+    unparsed   记号齐全但不符合文法 (如 '1--', ',,')
+
+本模块只做判断和分类，不修改数据；各步骤的转换规则仍以各自脚本为准。
+没有用一次解析的规范结果代替 Step 5/6/7/8/9 的转换: 每一步只处理自己的格式
+(如 Step 6 的 yyyymm-d 与休息日、Step 9 的 yy,m 前缀及其报错), 各自生成变更集、
+撤销文件和报告，并按顺序接力 (前一步的输出是后一步的输入)。直接给出最终规范
+结果会改变每一步写入和撤销的内容。各步骤的耗时主要花在大量已规范的日期上，
+is_canonical_date() 让它们一次扫描即可跳过全部正则。
+"""
+
+# 分隔符 (全角/中文标点在 Step 0 已转为半角, 这里一并识别以便只读脚本直接使用)
+SEPARATORS = {',': ',', '，': ',', '、': ',', '.': '.', '。': '.', ' ': ' ', '　': ' ', '&': '&'}
+# 范围符 ('——' 由连续两个 '—' 组成, 解析时合并)
+RANGE_MARKS = {'-', '~', '～', '—'}
+MAX_DAY = 31
+
+
+def is_canonical_date(date_str: str) -> bool:
+    """
+    是否为规范格式: 半角逗号分隔、严格升序、无前导 0 的 1~31 整数 (单个日期也算)。
+    只做一次 split，不使用正则。
+    """
+    if not date_str:
+        return False
+    prev = 0
+    for part in date_str.split(','):
+        if not part or not part.isascii() or not part.isdigit() or part[0] == '0':
+            return False
+        day = int(part)
+        if day > MAX_DAY or day <= prev:
+            return False
+        prev = day
+    return True
+
+
+def tokenize(date_str: str) -> list:
+    """
+    把日期字符串切分为 (类型, 值) 记号列表，类型为:
+    num / sep / range / lparen / rparen / rest / overtime / text
+    """
+    tokens = []
+    i = 0
+    n = len(date_str)
+    while i < n:
+        ch = date_str[i]
+        if ch.isascii() and ch.isdigit():
+            j = i
+            while j < n and date_str[j].isascii() and date_str[j].isdigit():
+                j += 1
+            tokens.append(('num', date_str[i:j]))
+            i = j
+        elif ch in SEPARATORS:
+            # 连续空格视为一个分隔符
+            sep = SEPARATORS[ch]
+            if not (sep == ' ' and tokens and tokens[-1] == ('sep', ' ')):
+                tokens.append(('sep', sep))
+            i += 1
+        elif ch in RANGE_MARKS:
+            j = i
+            while j < n and date_str[j] in RANGE_MARKS:
+                j += 1
+            tokens.append(('range', date_str[i:j]))
+            i = j
+        elif ch in '(（':
+            tokens.append(('lparen', ch))
+            i += 1
+        elif ch in ')）':
+            tokens.append(('rparen', ch))
+            i += 1
+        elif ch == '休':
+            tokens.append(('rest', ch))
+            i += 1
+        elif date_str.startswith('加班', i):
+            tokens.append(('overtime', '加班'))
+            i += 2
+        else:
+            tokens.append(('text', ch))
+            i += 1
+    return tokens
+
+
+def _parse_items(tokens: list) -> tuple:
+    """
+    按文法 "项 (分隔符 项)*" 解析记号。
+    项 := 数字 [范围符 数字] [ '(' [数字] 休 [')'] | '(' 加班 ')' ]
+    返回 (days, annotated, separators, error)；days 为展开后的日期 (不含休息日标注)。
+    """
+    days = []
+    annotated = False
+    separators = set()
+    pos = 0
+    n = len(tokens)
+
+    def peek(kind):
+        return pos < n and tokens[pos][0] == kind
+
+    while pos < n:
+        if not peek('num'):
+            return None, annotated, separators, f"位置 {pos} 处应为数字"
+        start = int(tokens[pos][1])
+        pos += 1
+        end = start
+        if peek('range'):
+            mark = tokens[pos][1]
+            if len(mark) > 1 and mark != '——':
+                return None, annotated, separators, f"无效范围符 '{mark}'"
+            pos += 1
+            if not peek('num'):
+                return None, annotated, separators, "范围缺少结束日期"
+            end = int(tokens[pos][1])
+            pos += 1
+            if end < start:
+                return None, annotated, separators, f"范围 {start}-{end} 起止颠倒"
+        days.extend(range(start, end + 1))
+
+        # 休息日 / 加班标注
+        if peek('lparen') or peek('rest'):
+            annotated = True
+            if peek('lparen'):
+                pos += 1
+            if peek('overtime'):
+                pos += 1
+            else:
+                if peek('num'):
+                    pos += 1
+                if not peek('rest'):
+                    return None, annotated, separators, "休息日标注缺少 '休'"
+                pos += 1
+            if peek('rparen'):
+                pos += 1
+
+        if pos < n:
+            if not peek('sep'):
+                return None, annotated, separators, f"位置 {pos} 处应为分隔符"
+            separators.add(tokens[pos][1])
+            pos += 1
+            if pos == n:
+                return None, annotated, separators, "末尾多余的分隔符"
+
+    return days, annotated, separators, None
+
+
+def classify_date_value(date_str, year: int = None, month: int = None) -> str:
+    """
+    日期值的分类 (见模块说明)。year/month 为文件年月 (可选)，用于识别 yy,m / m 前缀。
+    """
+    if date_str is None or str(date_str).strip() == '':
+        return 'empty'
+    s = str(date_str).strip()
+
+    if is_canonical_date(s):
+        return 'canonical'
+
+    tokens = tokenize(s)
+    if any(kind == 'text' for kind, _ in tokens):
+        return 'text'
+
+    days, annotated, separators, error = _parse_items(tokens)
+    if error:
+        return 'unparsed'
+
+    # 文件年月前缀: yy,m,d... 或 m,d... (其余部分升序)
+    if year is not None and month is not None and len(days) >= 2 and separators <= {','}:
+        rest = None
+        if len(days) >= 3 and days[0] == year % 100 and days[1] == month:
+            rest = days[2:]
+        elif days[0] == month and days[0] >= days[1]:
+            rest = days[1:]
+        if rest and all(a < b for a, b in zip(rest, rest[1:])):
+            return 'prefixed'
+
+    return 'annotated' if annotated else 'day_list'
@@ -14,10 +14,15 @@
 注意: Case 6 (复杂混合模式) 不在本步骤处理，将在 Step 6 处理。
 
 用法:
-    python cleansing_date_handling_step5.py [--dry-run]
+    python cleansing_date_handling_step5.py [--dry-run] [--apply CHANGESET] [--yes] [--incremental] [--workers N] [--shard YEAR]
 
 参数:
     --dry-run  仅预览，不执行更新
+    --apply CHANGESET  应用 --dry-run 写出的变更集 (或撤销文件)，不重新扫描
+    --yes      跳过 'yes' 确认提示 (非交互运行, 见 payroll_pipeline.py)
+    --incremental  只处理新文件或上次清洗后有变化的文件 (见 cleansing_watermark.py)
+    --workers N  字典中没有的日期按文件分区用 N 个进程并行解析 (0 为 CPU 核数, 默认 1)
+    --shard YEAR  只处理该年份的分片数据库 (见 payroll_shards.py)
     无参数    执行更新操作
 """
 
@@ -27,9 +32,22 @@ import argparse
 import re
 from pathlib import Path
 
+from payroll_shards import shard_db_path_for_year
+from cleansing_report import HtmlReport
+from cleansing_changeset import ChangeSet, apply_changeset_file, plan_path
+from cleansing_watermark import prepare_scope, record_watermark
+from cleansing_db_utils import count_rows, iter_rows, fetch_full_rows
+from cleansing_date_dict import DateCanonDict
+from cleansing_date_grammar import is_canonical_date
+
 DB_PATH = Path(__file__).parent.parent / "payroll_database.db"
 OUTPUT_PATH = Path(__file__).parent / "date_handling_step5_output.html"
 PAYROLL_TABLE = "payroll_details"
+CHANGESET_STEP = "step5"
+
+# 日期字典中本步骤的名称与版本 (修改解析逻辑后版本号加 1)
+DATE_DICT_STEP = "step5"
+DATE_DICT_VERSION = 1
 
 
 def parse_comma_range(date_str: str) -> str:
@@ -346,109 +364,148 @@ def expand_date(date_str: str) -> str:
     return s
 
 
-def export_to_html(columns: list, rows_with_changes: list, output_path: Path):
-    """导出更新记录到HTML文件。"""
-    html = f'''<!DOCTYPE html>
-<html>
-<head>
-<meta charset="UTF-8">
-<title>Step 5 - 日期处理结果</title>
-<style>
-table {{ border-collapse: collapse; font-size: 12px; }}
-th, td {{ border: 1px solid #ddd; padding: 8px; }}
-th {{ background-color: #4472C4; color: white; position: sticky; top: 0; }}
-tr:nth-child(even) {{ background-color: #f2f2f2; }}
-tr:hover {{ background-color: #ddd; }}
-td {{ max-width: 200px; overflow: hidden; text-overflow: ellipsis; white-space: nowrap; }}
-</style>
-</head>
-<body>
-<h1>Step 5 - 日期处理结果</h1>
-<p>共 {len(rows_with_changes)} 条记录被更新</p>
-<table>
-<tr><th>原日期</th><th>新日期</th>''' + ''.join(f'<th>{c}</th>' for c in columns) + '''</tr>
-'''
-    for old_date, new_date, row in rows_with_changes:
-        html += '<tr>'
-        html += f'<td>{old_date}</td>'
-        html += f'<td>{new_date}</td>'
-        html += ''.join(f'<td>{str(v) if v is not None else ""}</td>' for v in row)
-        html += '</tr>'
+def canonicalize_date(date_str: str, file_name: str = None) -> tuple:
+    """
+    计算单个 (已 strip 的) 日期在本步骤的结果，供日期字典缓存。
+    返回 (新日期或None, 分类, None)，分类为 'single' / 'complex' (跳过原因) 或 None。
+    """
+    # 已是规范格式 (升序逗号分隔的 1~31) 的日期无需再走下面的正则 (见 cleansing_date_grammar.py)
+    if is_canonical_date(date_str):
+        return (None, 'single', None) if ',' not in date_str else (None, None, None)
 
-    html += '''
-</table>
-</body>
-</html>'''
+    # 检查是否需要展开
+    if not needs_expansion(date_str):
+        if date_str.isdigit() and 1 <= int(date_str) <= 31:
+            return None, 'single', None
+        return None, 'complex', None
 
-    with open(output_path, 'w', encoding='utf-8') as f:
-        f.write(html)
+    # 展开日期
+    new_date = expand_date(date_str)
 
+    # 如果返回None，表示是复杂日期模式(如14.6.3)，需要Step 6处理
+    if new_date is None:
+        return None, 'complex', None
 
-def main():
-    parser = argparse.ArgumentParser(
-        description="清洁工资数据库中的日期列 - Step 5"
-    )
-    parser.add_argument(
-        "--dry-run",
-        action="store_true",
-        help="仅预览，不执行更新"
-    )
-    args = parser.parse_args()
+    if new_date != date_str:
+        return new_date, None, None
+    return None, None, None
 
-    if not DB_PATH.exists():
-        print(f"错误: 数据库文件不存在: {DB_PATH}")
-        sys.exit(1)
 
-    conn = sqlite3.connect(str(DB_PATH))
+def load_date_dict(conn: sqlite3.Connection) -> DateCanonDict:
+    """载入本步骤的日期字典 (结果与文件名无关)。"""
+    return DateCanonDict.load(conn, DATE_DICT_STEP, DATE_DICT_VERSION,
+                              canonicalize_date, per_file=False)
 
-    # 获取所有记录
-    cursor = conn.execute(f"SELECT rowid, * FROM {PAYROLL_TABLE}")
-    columns = [desc[0] for desc in cursor.description]
-    all_rows = cursor.fetchall()
 
-    print(f"数据库共有 {len(all_rows)} 条记录")
-    print(f"开始处理日期列...")
-
-    # 处理每条记录
+def collect_date_changes(columns: list, all_rows: list, date_dict: DateCanonDict = None) -> tuple:
+    """
+    对每条记录计算展开后的日期，不访问数据库 (cleansing_engine.py 也复用此函数)。
+    每个不同的日期只解析一次 (见 cleansing_date_dict.py)。
+    返回 (updates, rows_with_changes, skipped_single, skipped_complex)。
+    """
+    if date_dict is None:
+        date_dict = DateCanonDict(DATE_DICT_STEP, DATE_DICT_VERSION,
+                                  canonicalize_date, per_file=False)
+    date_idx = columns.index('日期')
     updates = []
+    rows_with_changes = []
     skipped_complex = 0
     skipped_single = 0
-    updated = 0
-
-    rows_with_changes = []
 
     for row in all_rows:
         rowid = row[0]
-        date_idx = columns.index('日期')
         old_date = row[date_idx]
 
         if old_date is None or str(old_date).strip() == '':
             continue
 
-        old_date_str = str(old_date).strip()
+        new_date, kind, _ = date_dict.lookup(old_date, None)
+        if kind == 'single':
+            skipped_single += 1
+        elif kind == 'complex':
+            skipped_complex += 1
+        elif new_date is not None:
+            updates.append((new_date, rowid))
+            rows_with_changes.append((str(old_date).strip(), new_date, row))
 
-        # 检查是否需要展开
-        if not needs_expansion(old_date_str):
-            if old_date_str.isdigit() and 1 <= int(old_date_str) <= 31:
-                skipped_single += 1
-            else:
-                skipped_complex += 1
-            continue
+    return updates, rows_with_changes, skipped_single, skipped_complex
 
-        # 展开日期
-        new_date = expand_date(old_date_str)
 
-        # 如果返回None，表示是复杂日期模式(如14.6.3)，需要Step 6处理
-        if new_date is None:
-            skipped_complex += 1
-            continue
+def export_to_html(columns: list, rows_with_changes: list, output_path: Path) -> Path:
+    """导出更新记录到HTML文件 (流式写入, 见 cleansing_report.py)，返回实际写入的文件。"""
+    with HtmlReport(output_path, "Step 5 - 日期处理结果") as report:
+        report.write(f"<h1>Step 5 - 日期处理结果</h1>\n<p>共 {len(rows_with_changes)} 条记录被更新</p>\n")
+        report.table(
+            ["原日期", "新日期"] + list(columns),
+            ([old_date, new_date, *row] for old_date, new_date, row in rows_with_changes),
+        )
+    return report.path
 
-        if new_date != old_date_str:
-            updates.append((new_date, rowid))
-            rows_with_changes.append((old_date_str, new_date, row))
-            updated += 1
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(
+        description="清洁工资数据库中的日期列 - Step 5"
+    )
+    parser.add_argument(
+        "--dry-run",
+        action="store_true",
+        help="仅预览，不执行更新"
+    )
+    parser.add_argument(
+        "--apply",
+        metavar="CHANGESET",
+        help="应用 --dry-run 写出的变更集文件 (或撤销文件)，不重新扫描"
+    )
+    parser.add_argument(
+        "--yes",
+        action="store_true",
+        help="跳过 'yes' 确认提示 (供 payroll_pipeline.py 等非交互调用)"
+    )
+    parser.add_argument(
+        "--incremental",
+        action="store_true",
+        help="只处理新文件或上次清洗后有变化的文件 (按 文件名 记录的水位, 见 cleansing_watermark.py)"
+    )
+    parser.add_argument(
+        "--workers",
+        type=int,
+        default=1,
+        help="并行解析日期的进程数 (0 为 CPU 核数, 默认 1 不并行, 见 cleansing_parallel.py)"
+    )
+    parser.add_argument(
+        "--shard",
+        help="只处理指定年份的分片数据库 (见 payroll_shards.py)，如 2025"
+    )
+    args = parser.parse_args(argv)
+    db_path = shard_db_path_for_year(args.shard) if args.shard else DB_PATH
+
+    if not db_path.exists():
+        print(f"错误: 数据库文件不存在: {db_path}")
+        sys.exit(1)
+
+    if args.apply:
+        sys.exit(apply_changeset_file(db_path, args.apply, CHANGESET_STEP, args.yes))
+
+    conn = sqlite3.connect(str(db_path))
+    changeset = ChangeSet.capture(conn, CHANGESET_STEP)
+    scope = prepare_scope(conn, CHANGESET_STEP) if args.incremental else None
+
+    # 只读取日期列, 分批流式处理 (完整记录只在导出报告时按需读取)
+    read_columns = ['日期']
+    print(f"数据库共有 {count_rows(conn)} 条记录")
+    print(f"开始处理日期列...")
+
+    # 处理每条记录 (每个不同的日期只解析一次)
+    date_dict = load_date_dict(conn)
+    if args.workers != 1:
+        # 字典中没有的日期先按文件分区并行解析, 逐行处理时直接命中 (见 cleansing_parallel.py)
+        date_dict.prefetch_from_db(conn, args.workers, where=scope)
+    updates, rows_with_changes, skipped_single, skipped_complex = \
+        collect_date_changes(['rowid'] + read_columns, iter_rows(conn, read_columns, where=scope), date_dict)
+    updated = len(updates)
 
     print(f"\n处理完成:")
+    print(f"  - {date_dict.stats_line()}")
     print(f"  - 单个日期跳过: {skipped_single}")
     print(f"  - 复杂模式跳过 (Step 6处理): {skipped_complex}")
     print(f"  - 已更新: {updated}")
@@ -465,12 +522,22 @@ def main():
     for old_pat, info in sorted_patterns[:20]:
         print(f"  '{old_pat}' -> '{info['new']}': {info['count']} records")
 
-    # 导出到HTML
-    export_to_html(columns, rows_with_changes, OUTPUT_PATH)
-    print(f"\n已导出到: {OUTPUT_PATH}")
+    # 导出到HTML (只为报告中的记录读取完整行)
+    columns, full_rows = fetch_full_rows(conn, [row[0] for _, _, row in rows_with_changes])
+    rows_with_changes = [(old, new, full_rows[row[0]]) for old, new, row in rows_with_changes]
+    report = export_to_html(columns, rows_with_changes, OUTPUT_PATH)
+    print(f"\n已导出到: {report}")
+
+    date_idx = columns.index('日期')
+    new_dates = dict((rowid, new_date) for new_date, rowid in updates)
+    for item in rows_with_changes:
+        row = item[-1]
+        if row[0] in new_dates:
+            changeset.add_update('日期', row[0], row[date_idx], new_dates.pop(row[0]))
 
     if args.dry_run:
         print(f"\n[DRY-RUN 模式] 预览: 本次可更新 {len(updates)} 条记录。")
+        print(f"变更集已写入: {changeset.write(plan_path(CHANGESET_STEP))} (可用 --apply 应用)")
     else:
         def count_table_records(conn):
             cursor = conn.execute(f"SELECT COUNT(*) FROM {PAYROLL_TABLE}")
@@ -480,19 +547,18 @@ def main():
         print(f"\n[确认更新] 数据库当前共有 {before_count} 条记录")
         print(f"[确认更新] 即将更新 {len(updates)} 条日期记录...")
 
-        confirm = input("请输入 'yes' 确认更新: ")
+        confirm = "yes" if args.yes else input("请输入 'yes' 确认更新: ")
         if confirm.strip().lower() == "yes":
-            # 执行更新
-            for new_date, rowid in updates:
-                conn.execute(
-                    f"UPDATE {PAYROLL_TABLE} SET 日期 = ? WHERE rowid = ?",
-                    (new_date, rowid)
-                )
+            # 执行更新: 新解析的日期先写入日期字典, 再按字典联表更新
+            date_dict.save(conn)
+            date_dict.apply(conn, where=scope)
             conn.commit()
+            record_watermark(conn, CHANGESET_STEP)
 
             after_count = count_table_records(conn)
             print(f"已成功更新 {len(updates)} 条记录。")
             print(f"更新后数据库共有 {after_count} 条记录。")
+            print(f"撤销文件: {changeset.write_undo(conn)}")
         else:
             print("已取消更新操作。")
 
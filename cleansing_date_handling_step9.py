@@ -15,10 +15,15 @@
 5. 包含短横线范围 (如 '1-3') 的记录会先展开再判断
 
 用法:
-    python cleansing_date_handling_step9.py [--dry-run]
+    python cleansing_date_handling_step9.py [--dry-run] [--apply CHANGESET] [--yes] [--incremental] [--workers N] [--shard YEAR]
 
 参数:
     --dry-run  仅预览并导出HTML，不执行更新
+    --apply CHANGESET  应用 --dry-run 写出的变更集 (或撤销文件)，不重新扫描
+    --yes      跳过 'yes' 确认提示 (非交互运行, 见 payroll_pipeline.py)
+    --incremental  只处理新文件或上次清洗后有变化的文件 (见 cleansing_watermark.py)
+    --workers N  字典中没有的日期按文件分区用 N 个进程并行解析 (0 为 CPU 核数, 默认 1)
+    --shard YEAR  只处理该年份的分片数据库 (见 payroll_shards.py)
     无参数    执行更新操作
 """
 
@@ -28,9 +33,22 @@ import argparse
 import re
 from pathlib import Path
 
+from payroll_shards import shard_db_path_for_year
+from cleansing_report import HtmlReport
+from cleansing_changeset import ChangeSet, apply_changeset_file, plan_path
+from cleansing_watermark import prepare_scope, record_watermark
+from cleansing_db_utils import count_rows, iter_rows, fetch_full_rows
+from cleansing_date_dict import DateCanonDict
+from cleansing_date_grammar import is_canonical_date
+
 DB_PATH = Path(__file__).parent.parent / "payroll_database.db"
 OUTPUT_PATH = Path(__file__).parent / "date_handling_step9_output.html"
 PAYROLL_TABLE = "payroll_details"
+CHANGESET_STEP = "step9"
+
+# 日期字典中本步骤的名称与版本 (修改解析逻辑后版本号加 1)
+DATE_DICT_STEP = "step9"
+DATE_DICT_VERSION = 1
 
 
 def parse_file_year_month(file_name: str) -> tuple:
@@ -141,112 +159,62 @@ def is_prefix_candidate(nums: list) -> bool:
     return 0 <= nums[0] <= 99
 
 
-def export_to_html(columns, yy_m_updates, m_updates, errors, output_path: Path):
-    """导出处理结果到HTML"""
-    display_cols = [c for c in columns if c != 'rowid']
+def canonicalize_date(date_str: str, file_name: str) -> tuple:
+    """
+    计算单个 (已 strip 的) 日期在本步骤的结果，供日期字典缓存。
+    返回 (新日期或None, 分类, 错误原因)，分类为 'yy_m' / 'm' / 'error' 或 None (跳过)。
+    """
+    # 已是规范格式 (升序逗号分隔的 1~31) 的日期无需再走下面的正则 (见 cleansing_date_grammar.py)
+    if is_canonical_date(date_str):
+        return None, None, None
 
-    def render_row(row, extra_cells):
-        display_row = [row[columns.index(c)] for c in display_cols]
-        cells = ''.join(f'<td>{str(v) if v is not None else ""}</td>' for v in display_row)
-        return f'<tr>{"".join(extra_cells)}{cells}</tr>'
+    nums = parse_date_list(date_str)
+    if nums is None:
+        return None, None, None
 
-    header = (
-        '<tr><th>操作</th><th>原日期</th><th>新日期</th>'
-        + ''.join(f'<th>{c}</th>' for c in display_cols)
-        + '</tr>'
-    )
-    err_header = (
-        '<tr><th>原日期</th><th>原因</th>'
-        + ''.join(f'<th>{c}</th>' for c in display_cols)
-        + '</tr>'
-    )
+    # 仅处理当前为非升序的记录（即验证失败的）
+    if is_strictly_ascending(nums):
+        return None, None, None
 
-    html_parts = ['''<!DOCTYPE html>
-<html>
-<head>
-<meta charset="UTF-8">
-<title>Step 9 - yy,m / m 前缀清理结果</title>
-<style>
-body { font-family: sans-serif; margin: 20px; }
-table { border-collapse: collapse; font-size: 12px; margin-bottom: 30px; }
-th, td { border: 1px solid #ddd; padding: 6px; }
-th { background-color: #4472C4; color: white; position: sticky; top: 0; }
-tr:nth-child(even) { background-color: #f2f2f2; }
-tr:hover { background-color: #ffeb99; }
-td { max-width: 250px; overflow: hidden; text-overflow: ellipsis; white-space: nowrap; }
-.section { font-size: 18px; font-weight: bold; margin-top: 30px; margin-bottom: 10px; }
-.updated { background-color: #ffffcc; }
-.error { background-color: #ffcccc; }
-</style>
-</head>
-<body>
-<h1>Step 9 - yy,m / m 前缀清理结果</h1>
-''']
-
-    html_parts.append(f'<div class="section">一、yy,m 前缀已更新记录（{len(yy_m_updates)} 条）</div>')
-    html_parts.append(f'<table>{header}')
-    for upd in yy_m_updates:
-        cells = [
-            '<td>yy,m→日</td>',
-            f'<td>{upd["old"]}</td>',
-            f'<td>{upd["new"]}</td>',
-        ]
-        html_parts.append(render_row(upd['row'], cells).replace('<tr>', '<tr class="updated">'))
-    html_parts.append('</table>')
-
-    html_parts.append(f'<div class="section">二、m 前缀已更新记录（{len(m_updates)} 条）</div>')
-    html_parts.append(f'<table>{header}')
-    for upd in m_updates:
-        cells = [
-            '<td>m→日</td>',
-            f'<td>{upd["old"]}</td>',
-            f'<td>{upd["new"]}</td>',
-        ]
-        html_parts.append(render_row(upd['row'], cells).replace('<tr>', '<tr class="updated">'))
-    html_parts.append('</table>')
-
-    html_parts.append(f'<div class="section">三、错误（未匹配任何前缀，保留原值，{len(errors)} 条）</div>')
-    html_parts.append(f'<table>{err_header}')
-    for err in errors:
-        cells = [
-            f'<td>{err["old"]}</td>',
-            f'<td>{err["reason"]}</td>',
-        ]
-        html_parts.append(render_row(err['row'], cells).replace('<tr>', '<tr class="error">'))
-    html_parts.append('</table>')
-
-    html_parts.append('</body></html>')
-
-    with open(output_path, 'w', encoding='utf-8') as f:
-        f.write(''.join(html_parts))
-
-
-def main():
-    parser = argparse.ArgumentParser(
-        description="清洁工资数据库 Step 9 - 清理残留的 yy,m 与 m 前缀日期"
-    )
-    parser.add_argument(
-        "--dry-run",
-        action="store_true",
-        help="仅预览并导出HTML，不执行更新"
-    )
-    args = parser.parse_args()
+    year, month = parse_file_year_month(file_name)
+    if year is None:
+        return None, None, None
 
-    if not DB_PATH.exists():
-        print(f"错误: 数据库文件不存在: {DB_PATH}")
-        sys.exit(1)
+    # 先尝试 yy,m 模式
+    matched, new_nums, ym_err = try_yy_m_pattern(nums, year, month)
+    if matched:
+        return ','.join(str(n) for n in new_nums), 'yy_m', None
+
+    # 再尝试 m 模式
+    matched, new_nums, m_err = try_m_pattern(nums, year, month)
+    if matched:
+        return ','.join(str(n) for n in new_nums), 'm', None
+
+    # 都不匹配：若是前缀候选则记为错误
+    if is_prefix_candidate(nums):
+        return None, 'error', ym_err or m_err or "未匹配任何前缀模式"
+    return None, None, None
 
-    conn = sqlite3.connect(str(DB_PATH))
-    cursor = conn.execute(f"SELECT rowid, * FROM {PAYROLL_TABLE}")
-    columns = [desc[0] for desc in cursor.description]
-    all_rows = cursor.fetchall()
 
+def load_date_dict(conn: sqlite3.Connection) -> DateCanonDict:
+    """载入本步骤的日期字典 (结果取决于文件年月)。"""
+    return DateCanonDict.load(conn, DATE_DICT_STEP, DATE_DICT_VERSION,
+                              canonicalize_date, per_file=True)
+
+
+def collect_prefix_updates(columns: list, all_rows: list, date_dict: DateCanonDict = None) -> tuple:
+    """
+    找出 yy,m / m 前缀日期并计算新值，不访问数据库 (cleansing_engine.py 也复用此函数)。
+    每个 (文件年月, 日期) 只解析一次 (见 cleansing_date_dict.py)。
+    返回 (yy_m_updates, m_updates, error_rows, skipped)。
+    """
+    if date_dict is None:
+        date_dict = DateCanonDict(DATE_DICT_STEP, DATE_DICT_VERSION,
+                                  canonicalize_date, per_file=True)
     date_idx = columns.index('日期')
     filename_idx = columns.index('文件名')
     rowid_idx = 0
 
-    print(f"数据库共有 {len(all_rows)} 条记录")
-
     yy_m_updates = []
     m_updates = []
     error_rows = []
@@ -255,56 +223,135 @@ def main():
     for row in all_rows:
         rowid = row[rowid_idx]
         date_val = row[date_idx]
-        file_name = row[filename_idx]
 
         if date_val is None or str(date_val).strip() == '':
             skipped += 1
             continue
 
-        nums = parse_date_list(date_val)
-        if nums is None:
-            skipped += 1
-            continue
-
-        # 仅处理当前为非升序的记录（即验证失败的）
-        if is_strictly_ascending(nums):
-            skipped += 1
-            continue
-
-        year, month = parse_file_year_month(file_name)
-        if year is None:
-            skipped += 1
-            continue
-
+        new_str, kind, reason = date_dict.lookup(date_val, row[filename_idx])
         old_str = str(date_val).strip()
-
-        # 先尝试 yy,m 模式
-        matched, new_nums, ym_err = try_yy_m_pattern(nums, year, month)
-        if matched:
-            new_str = ','.join(str(n) for n in new_nums)
+        if kind == 'yy_m':
             yy_m_updates.append({
                 'old': old_str, 'new': new_str, 'row': row, 'rowid': rowid,
             })
-            continue
-
-        # 再尝试 m 模式
-        matched, new_nums, m_err = try_m_pattern(nums, year, month)
-        if matched:
-            new_str = ','.join(str(n) for n in new_nums)
+        elif kind == 'm':
             m_updates.append({
                 'old': old_str, 'new': new_str, 'row': row, 'rowid': rowid,
             })
-            continue
-
-        # 都不匹配：若是前缀候选则记为错误
-        if is_prefix_candidate(nums):
-            reason = ym_err or m_err or "未匹配任何前缀模式"
+        elif kind == 'error':
             error_rows.append({
                 'old': old_str, 'reason': reason, 'row': row, 'rowid': rowid,
             })
         else:
             skipped += 1
 
+    return yy_m_updates, m_updates, error_rows, skipped
+
+
+def export_to_html(columns, yy_m_updates, m_updates, errors, output_path: Path) -> Path:
+    """导出处理结果到HTML (流式写入, 见 cleansing_report.py)，返回实际写入的文件"""
+    display_cols = [c for c in columns if c != 'rowid']
+    display_idx = [columns.index(c) for c in display_cols]
+
+    def display_row(row):
+        return [row[i] for i in display_idx]
+
+    style = """
+body { font-family: sans-serif; margin: 20px; }
+table { margin-bottom: 30px; }
+th, td { padding: 6px; }
+tr:hover { background-color: #ffeb99; }
+td { max-width: 250px; }
+.section { font-size: 18px; font-weight: bold; margin-top: 30px; margin-bottom: 10px; }
+.updated { background-color: #ffffcc; }
+.error { background-color: #ffcccc; }
+"""
+    header = ['操作', '原日期', '新日期'] + display_cols
+    with HtmlReport(output_path, "Step 9 - yy,m / m 前缀清理结果", style) as report:
+        report.write('<h1>Step 9 - yy,m / m 前缀清理结果</h1>\n')
+
+        report.write(f'<div class="section">一、yy,m 前缀已更新记录（{len(yy_m_updates)} 条）</div>\n')
+        report.table(
+            header,
+            (['yy,m→日', upd['old'], upd['new']] + display_row(upd['row']) for upd in yy_m_updates),
+            row_class="updated",
+        )
+
+        report.write(f'<div class="section">二、m 前缀已更新记录（{len(m_updates)} 条）</div>\n')
+        report.table(
+            header,
+            (['m→日', upd['old'], upd['new']] + display_row(upd['row']) for upd in m_updates),
+            row_class="updated",
+        )
+
+        report.write(f'<div class="section">三、错误（未匹配任何前缀，保留原值，{len(errors)} 条）</div>\n')
+        report.table(
+            ['原日期', '原因'] + display_cols,
+            ([err['old'], err['reason']] + display_row(err['row']) for err in errors),
+            row_class="error",
+        )
+    return report.path
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(
+        description="清洁工资数据库 Step 9 - 清理残留的 yy,m 与 m 前缀日期"
+    )
+    parser.add_argument(
+        "--dry-run",
+        action="store_true",
+        help="仅预览并导出HTML，不执行更新"
+    )
+    parser.add_argument(
+        "--apply",
+        metavar="CHANGESET",
+        help="应用 --dry-run 写出的变更集文件 (或撤销文件)，不重新扫描"
+    )
+    parser.add_argument(
+        "--yes",
+        action="store_true",
+        help="跳过 'yes' 确认提示 (供 payroll_pipeline.py 等非交互调用)"
+    )
+    parser.add_argument(
+        "--incremental",
+        action="store_true",
+        help="只处理新文件或上次清洗后有变化的文件 (按 文件名 记录的水位, 见 cleansing_watermark.py)"
+    )
+    parser.add_argument(
+        "--workers",
+        type=int,
+        default=1,
+        help="并行解析日期的进程数 (0 为 CPU 核数, 默认 1 不并行, 见 cleansing_parallel.py)"
+    )
+    parser.add_argument(
+        "--shard",
+        help="只处理指定年份的分片数据库 (见 payroll_shards.py)，如 2025"
+    )
+    args = parser.parse_args(argv)
+    db_path = shard_db_path_for_year(args.shard) if args.shard else DB_PATH
+
+    if not db_path.exists():
+        print(f"错误: 数据库文件不存在: {db_path}")
+        sys.exit(1)
+
+    if args.apply:
+        sys.exit(apply_changeset_file(db_path, args.apply, CHANGESET_STEP, args.yes))
+
+    conn = sqlite3.connect(str(db_path))
+    changeset = ChangeSet.capture(conn, CHANGESET_STEP)
+    scope = prepare_scope(conn, CHANGESET_STEP) if args.incremental else None
+    # 只读取日期、文件名列, 分批流式处理 (完整记录只在导出报告时按需读取)
+    read_columns = ['日期', '文件名']
+    print(f"数据库共有 {count_rows(conn)} 条记录")
+
+    date_dict = load_date_dict(conn)
+    if args.workers != 1:
+        # 字典中没有的日期先按文件分区并行解析, 逐行处理时直接命中 (见 cleansing_parallel.py)
+        date_dict.prefetch_from_db(conn, args.workers, where=scope)
+    yy_m_updates, m_updates, error_rows, skipped = collect_prefix_updates(
+        ['rowid'] + read_columns, iter_rows(conn, read_columns, where=scope), date_dict
+    )
+
     total_updates = len(yy_m_updates) + len(m_updates)
     print(f"\n【更新】")
     print(f"  yy,m 模式: {len(yy_m_updates)} 条")
@@ -312,6 +359,7 @@ def main():
     print(f"  合计:      {total_updates} 条")
     print(f"\n【错误】保留原值: {len(error_rows)} 条")
     print(f"\n【跳过】无需处理: {skipped} 条")
+    print(f"\n{date_dict.stats_line()}")
 
     # 模式统计
     if total_updates > 0:
@@ -334,15 +382,25 @@ def main():
         for (old, reason), count in sorted(err_patterns.items(), key=lambda x: x[1], reverse=True)[:20]:
             print(f"  '{old}': {reason} — {count} 条")
 
-    # 导出 HTML
-    export_to_html(columns, yy_m_updates, m_updates, error_rows, OUTPUT_PATH)
-    print(f"\n已导出到: {OUTPUT_PATH}")
+    # 导出 HTML (只为报告中的记录读取完整行)
+    columns, full_rows = fetch_full_rows(
+        conn, [item['rowid'] for item in yy_m_updates + m_updates + error_rows]
+    )
+    for item in yy_m_updates + m_updates + error_rows:
+        item['row'] = full_rows[item['rowid']]
+    report = export_to_html(columns, yy_m_updates, m_updates, error_rows, OUTPUT_PATH)
+    print(f"\n已导出到: {report}")
 
     # 执行或 dry-run
+    date_idx = columns.index('日期')
+    for upd in yy_m_updates + m_updates:
+        changeset.add_update('日期', upd['rowid'], upd['row'][date_idx], upd['new'])
+
     if args.dry_run:
         print(f"\n[DRY-RUN 模式] 未执行任何数据库操作。")
+        print(f"变更集已写入: {changeset.write(plan_path(CHANGESET_STEP))} (可用 --apply 应用)")
     else:
-        confirm = input(
+        confirm = "yes" if args.yes else input(
             f"\n[确认] 即将更新 {total_updates} 条记录（{len(error_rows)} 条错误保留原值）。\n"
             f"请输入 'yes' 确认: "
         )
@@ -351,25 +409,21 @@ def main():
             conn.close()
             sys.exit(0)
 
-        for upd in yy_m_updates + m_updates:
-            conn.execute(
-                f"UPDATE {PAYROLL_TABLE} SET 日期 = ? WHERE rowid = ?",
-                (upd['new'], upd['rowid'])
-            )
+        # 新解析的日期先写入日期字典, 再按字典联表更新
+        date_dict.save(conn)
+        date_dict.apply(conn, where=scope)
         conn.commit()
+        record_watermark(conn, CHANGESET_STEP)
         print(f"已更新 {total_updates} 条记录。")
 
         cursor = conn.execute(f"SELECT COUNT(*) FROM {PAYROLL_TABLE}")
         final_count = cursor.fetchone()[0]
         print(f"操作完成后数据库共有 {final_count} 条记录。")
+        print(f"撤销文件: {changeset.write_undo(conn)}")
 
         # 验证：检查是否还有可修复的残留
-        cursor = conn.execute(
-            f"SELECT rowid, 日期, 文件名 FROM {PAYROLL_TABLE}"
-        )
-        remaining = cursor.fetchall()
         remaining_bad = []
-        for rid, date, fname in remaining:
+        for rid, date, fname in iter_rows(conn, ['日期', '文件名'], where=scope):
             if date is None or str(date).strip() == '':
                 continue
             nums = parse_date_list(date)
@@ -0,0 +1,163 @@
+#!/usr/bin/env python3
+"""
+清洗脚本共用的批量读写工具。
+
+各 cleansing 步骤原来对每条变更记录执行一次
+`UPDATE payroll_details SET 日期 = ? WHERE rowid = ?`，变更多时要执行几十万条语句。
+这里改为:
+- 更新: 先用 executemany 把 (rowid, 新值) 写入临时表，再用一条
+  `UPDATE ... FROM` 联表更新 (SQLite >= 3.33)；旧版本 SQLite 退回分批 executemany。
+- 删除: `DELETE ... WHERE rowid IN (...)` 按批执行，避免超出 SQLite 的变量个数上限
+  (SQLite < 3.32 默认只有 999 个)。
+
+两个函数都不提交事务，由调用方 conn.commit()，以保持各步骤原有的事务边界。
+payroll_details 为视图 (规范化存储, 见 excel_processor/dimensions.py) 时同样适用，
+写入经由视图的 INSTEAD OF 触发器完成。
+
+读取方面，各步骤不再 `SELECT rowid, *` 后 fetchall() 整表读入:
+- iter_rows(): 只投影需要的列 (通常只有 日期 / 文件名)，用 fetchmany 分批流式读取；
+- fetch_full_rows(): HTML 报告需要展示完整记录时，只按 rowid 取回报告中的那些行。
+"""
+
+import sqlite3
+
+PAYROLL_TABLE = "payroll_details"
+
+# 每批 rowid 个数 (远小于旧版 SQLite 的 999 个变量上限)
+CHUNK_SIZE = 500
+
+# UPDATE ... FROM 需要 SQLite 3.33.0
+HAS_UPDATE_FROM = sqlite3.sqlite_version_info >= (3, 33, 0)
+
+STAGING_TABLE = "bulk_update_values"
+
+
+def bulk_update_column(conn: sqlite3.Connection, column: str, updates,
+                       table: str = PAYROLL_TABLE) -> int:
+    """
+    按 rowid 批量更新一列。updates 为 (新值, rowid) 序列 (与各步骤原来的 updates 列表相同)。
+    同一 rowid 出现多次时以最后一次为准。返回更新的记录数。
+    """
+    updates = list(updates)
+    if not updates:
+        return 0
+
+    if not HAS_UPDATE_FROM:
+        total = 0
+        for i in range(0, len(updates), CHUNK_SIZE):
+            cursor = conn.executemany(
+                f"UPDATE {table} SET {column} = ? WHERE rowid = ?",
+                updates[i:i + CHUNK_SIZE]
+            )
+            total += cursor.rowcount
+        return total
+
+    conn.execute(f"DROP TABLE IF EXISTS temp.{STAGING_TABLE}")
+    conn.execute(
+        f"CREATE TEMP TABLE {STAGING_TABLE} (rid INTEGER PRIMARY KEY, value)"
+    )
+    try:
+        conn.executemany(
+            f"INSERT OR REPLACE INTO temp.{STAGING_TABLE} (rid, value) VALUES (?, ?)",
+            ((rowid, value) for value, rowid in updates)
+        )
+        cursor = conn.execute(
+            f"UPDATE {table} SET {column} = u.value "
+            f"FROM temp.{STAGING_TABLE} AS u WHERE {table}.rowid = u.rid"
+        )
+        return cursor.rowcount
+    finally:
+        conn.execute(f"DROP TABLE IF EXISTS temp.{STAGING_TABLE}")
+
+
+def bulk_delete_rowids(conn: sqlite3.Connection, rowids,
+                       table: str = PAYROLL_TABLE) -> int:
+    """按批删除指定 rowid 的记录，返回删除的记录数。"""
+    rowids = list(rowids)
+    total = 0
+    for i in range(0, len(rowids), CHUNK_SIZE):
+        chunk = rowids[i:i + CHUNK_SIZE]
+        placeholders = ",".join("?" * len(chunk))
+        cursor = conn.execute(
+            f"DELETE FROM {table} WHERE rowid IN ({placeholders})",
+            chunk
+        )
+        total += cursor.rowcount
+    return total
+
+
+# 分批读取时每次 fetchmany 的行数
+READ_CHUNK_SIZE = 5000
+
+
+def iter_rows(conn: sqlite3.Connection, columns, table: str = PAYROLL_TABLE,
+              where: str = None, params=(), chunk_size: int = READ_CHUNK_SIZE):
+    """
+    只读取需要的列，按 rowid 顺序用 fetchmany 分批逐行返回 (rowid 在第 0 列)。
+    各步骤多数只用到 日期 / 文件名 等几列，不必把整行 (15 列) 全部读入内存。
+    """
+    sql = f"SELECT rowid, {', '.join(columns)} FROM {table}"
+    if where:
+        sql += f" WHERE {where}"
+    sql += " ORDER BY rowid"
+    cursor = conn.execute(sql, params)
+    while True:
+        chunk = cursor.fetchmany(chunk_size)
+        if not chunk:
+            break
+        yield from chunk
+
+
+def count_rows(conn: sqlite3.Connection, table: str = PAYROLL_TABLE) -> int:
+    return conn.execute(f"SELECT COUNT(*) FROM {table}").fetchone()[0]
+
+
+def full_row_columns(conn: sqlite3.Connection, table: str = PAYROLL_TABLE) -> list:
+    """
+    整行记录的列名: rowid + `SELECT *` 的各列，取自 PRAGMA table_xinfo (不执行查询, 不读取数据)。
+    用 table_xinfo 而不是 table_info: 整数存储模式的生成列也出现在 `SELECT *` 中;
+    hidden = 1 的列 (虚表隐藏列) 不出现。
+    规范化存储模式下 payroll_details 视图本身有一列 rowid，这里只保留开头的一个。
+    """
+    return ['rowid'] + [
+        row[1] for row in conn.execute(f"PRAGMA table_xinfo({table})")
+        if row[6] != 1 and row[1] != 'rowid'
+    ]
+
+
+def full_row_select(conn: sqlite3.Connection, table: str = PAYROLL_TABLE) -> str:
+    """
+    读取整行记录的 SELECT 列表 (与 full_row_columns 一一对应)。
+    代替 `SELECT rowid, *`: 规范化存储模式下视图的 rowid 列会在 `*` 中再出现一次。
+    """
+    return ", ".join(f'"{c}"' if c != 'rowid' else c for c in full_row_columns(conn, table))
+
+
+def generated_columns(conn: sqlite3.Connection, table: str = PAYROLL_TABLE) -> set:
+    """
+    生成列 (table_xinfo hidden = 2/3, 如整数存储模式下的 计件数量/系数/定额/金额)。
+    这些列出现在 `SELECT *` 中，但不能 INSERT / UPDATE (写入对应的 *_x100 列)。
+    """
+    return {row[1] for row in conn.execute(f"PRAGMA table_xinfo({table})") if row[6] in (2, 3)}
+
+
+def fetch_full_rows(conn: sqlite3.Connection, rowids,
+                    table: str = PAYROLL_TABLE) -> tuple:
+    """
+    按 rowid 分批取回完整记录 (full_row_select)，只用于报告中实际展示的记录。
+    返回 (columns, {rowid: row})。
+    """
+    columns = full_row_columns(conn, table)
+    select = full_row_select(conn, table)
+    rowids = list(dict.fromkeys(rowids))
+    rows = {}
+    for i in range(0, len(rowids), CHUNK_SIZE):
+        chunk = rowids[i:i + CHUNK_SIZE]
+        placeholders = ",".join("?" * len(chunk))
+        cursor = conn.execute(
+            f"SELECT {select} FROM {table} WHERE rowid IN ({placeholders})",
+            chunk
+        )
+        for row in cursor:
+            rows[row[0]] = row
+    return columns, rows
@@ -0,0 +1,401 @@
+#!/usr/bin/env python3
+"""
+清洁工资数据库 - 单次载入的清洗引擎 (Step 0 ~ Step 10)。
+
+逐个运行 cleansing_*_step*.py 时，每一步都要全表读取一次 payroll_details，
+再逐行 UPDATE/DELETE 并提交，共 11 次全表扫描和 11 次写入。
+本脚本只读取一次全表，在内存中按顺序执行各步骤的处理函数 (直接复用各步骤
+模块中的函数，语义与逐步执行相同)，每一步都基于上一步处理后的内存数据；
+各步骤的 HTML/Excel 报告照常输出到原来的位置。
+全部步骤完成后，将最终结果与原始数据比较，得到一份合并的变更集
+(删除的 rowid + 各列被修改的值)，在一个事务内写回数据库。
+
+各步骤脚本仍可单独运行，用于排查某一步的问题。
+
+用法:
+    python cleansing_engine.py [--dry-run] [--apply CHANGESET] [--yes] [--incremental] [--workers N] [--shard YEAR]
+
+参数:
+    --dry-run  仅执行内存处理并导出各步骤报告，不写回数据库；
+               合并变更集写入 changesets/engine_plan.json.gz (见 cleansing_changeset.py)
+    --apply CHANGESET  应用 --dry-run 写出的变更集 (或撤销文件)，不重新执行各步骤
+    --yes      跳过 'yes' 确认提示 (非交互运行, 见 payroll_pipeline.py)
+    --incremental  只载入对任一步骤而言是新文件或有变化的文件 (见 cleansing_watermark.py)
+    --workers N  Step 5~9 字典中没有的日期按文件分区用 N 个进程并行解析 (0 为 CPU 核数, 默认 1)
+    --shard YEAR  只处理该年份的分片数据库 (见 payroll_shards.py)
+    无参数    提示输入 'yes' 确认后写回数据库
+"""
+
+import sqlite3
+import sys
+import argparse
+from pathlib import Path
+
+import cleansing_data_dbcs_handling_step0 as step0
+import cleansing_outliers_step1 as step1
+import cleansing_outliers_step2 as step2
+import cleansing_outliers_step3 as step3
+import cleansing_outliers_step4 as step4
+import cleansing_date_handling_step5 as step5
+import cleansing_date_handling_step6 as step6
+import cleansing_date_handling_step7 as step7
+import cleansing_misc_step8 as step8
+import cleansing_date_handling_step9 as step9
+import cleansing_none_cleanup_step10 as step10
+from payroll_shards import shard_db_path_for_year
+from cleansing_changeset import ChangeSet, apply_changeset_file, plan_path
+from cleansing_watermark import ALL_STEPS, prepare_scope, record_watermark
+from cleansing_db_utils import bulk_update_column, bulk_delete_rowids, count_rows, full_row_select
+from cleansing_calendar import load_calendar
+
+DB_PATH = Path(__file__).parent.parent / "payroll_database.db"
+PAYROLL_TABLE = "payroll_details"
+CHANGESET_STEP = "engine"
+
+# 会被各步骤修改的列 (Step 0~9 只改日期, Step 10 改 6 个目标列)
+WRITABLE_COLUMNS = ['日期'] + step10.TARGET_COLUMNS
+
+
+def apply_changes(columns: list, rows: list, updates: list = (),
+                  deletes: list = (), column: str = '日期') -> list:
+    """
+    将一步的结果应用到内存数据，返回新的记录列表 (记录保持 rowid 顺序)。
+    updates 为 (新值, rowid) 列表，deletes 为要删除的 rowid 列表。
+    """
+    new_values = {rowid: value for value, rowid in updates}
+    deleted = set(deletes)
+    if not new_values and not deleted:
+        return rows
+
+    idx = columns.index(column)
+    result = []
+    for row in rows:
+        rowid = row[0]
+        if rowid in deleted:
+            continue
+        if rowid in new_values:
+            row = row[:idx] + (new_values[rowid],) + row[idx + 1:]
+        result.append(row)
+    return result
+
+
+def run_step0(columns: list, rows: list) -> tuple:
+    updates, rows_with_changes, skipped = step0.collect_dbcs_changes(columns, rows)
+    report = step0.export_to_html(columns, rows_with_changes, step0.OUTPUT_PATH)
+    return (apply_changes(columns, rows, updates=updates),
+            f"全角转半角 {len(updates)} 条, 跳过(空值) {skipped} 条", report)
+
+
+def run_step1(columns: list, rows: list) -> tuple:
+    date_idx = columns.index('日期')
+    outliers = [row for row in rows if step1.is_outlier_date(row[date_idx])]
+    real_outliers, possible_outliers = step1.categorize_outliers(columns, outliers)
+    if outliers:
+        step1.export_to_excel(columns, real_outliers, possible_outliers, step1.OUTPUT_PATH)
+    deletes = [row[0] for row in real_outliers]
+    return (apply_changes(columns, rows, deletes=deletes),
+            f"删除 real_outliers {len(real_outliers)} 条, "
+            f"保留 possible_outliers {len(possible_outliers)} 条",
+            step1.OUTPUT_PATH if outliers else None)
+
+
+def run_step2(columns: list, rows: list) -> tuple:
+    date_idx = columns.index('日期')
+    filled_records = step2.compute_filled_records(columns, rows)
+    updates = [(source_row[date_idx], row[0]) for row, source_row in filled_records]
+    return (apply_changes(columns, rows, updates=updates),
+            f"前向填充 {len(updates)} 条", None)
+
+
+def run_step3(columns: list, rows: list) -> tuple:
+    matched = step3.find_rows_with_合计(columns, rows)
+    report = None
+    if matched:
+        report = step3.export_to_html(columns, matched, step3.OUTPUT_PATH)
+    return (apply_changes(columns, rows, deletes=[row[0] for row in matched]),
+            f"删除含'合计'的记录 {len(matched)} 条",
+            report)
+
+
+def run_step4(columns: list, rows: list) -> tuple:
+    matched = step4.find_month_date_rows(columns, rows)
+    updates, rows_with_new_date = step4.compute_month_updates(columns, matched)
+    report = None
+    if matched:
+        report = step4.export_to_html(columns, rows_with_new_date, step4.OUTPUT_PATH)
+    return (apply_changes(columns, rows, updates=updates),
+            f"月份日期转工作日 {len(updates)} 条 (共匹配 {len(matched)} 条)",
+            report)
+
+
+def run_step5(columns: list, rows: list, date_dict=None) -> tuple:
+    updates, rows_with_changes, skipped_single, skipped_complex = \
+        step5.collect_date_changes(columns, rows, date_dict)
+    report = step5.export_to_html(columns, rows_with_changes, step5.OUTPUT_PATH)
+    return (apply_changes(columns, rows, updates=updates),
+            f"展开日期 {len(updates)} 条, 复杂模式跳过 {skipped_complex} 条",
+            report)
+
+
+def run_step6(columns: list, rows: list, date_dict=None) -> tuple:
+    updates, rows_with_changes, errors = step6.collect_date_changes(columns, rows, date_dict)
+    report = step6.export_to_html(columns, rows_with_changes, step6.OUTPUT_PATH)
+    return (apply_changes(columns, rows, updates=updates),
+            f"展开复杂日期 {len(updates)} 条, 错误/警告 {len(errors)} 条",
+            report)
+
+
+def run_step7(columns: list, rows: list, date_dict=None) -> tuple:
+    updates, rows_with_changes, skipped = step7.collect_date_changes(columns, rows, date_dict)
+    report = step7.export_to_html(columns, rows_with_changes, step7.OUTPUT_PATH)
+    return (apply_changes(columns, rows, updates=updates),
+            f"处理波浪号/短横线 {len(updates)} 条", report)
+
+
+def run_step8(columns: list, rows: list, date_dict=None) -> tuple:
+    delete_rows = step8.find_garbage_rows(columns, rows)
+    update_details = step8.collect_update_details(columns, rows, date_dict, delete_rows)
+    report = step8.export_to_html(columns, delete_rows, update_details, step8.OUTPUT_PATH)
+    # 与 Step 8 一致: 先删除再更新 (要删除的记录不计入更新)
+    rows = apply_changes(columns, rows, deletes=[row[0] for row in delete_rows])
+    rows = apply_changes(columns, rows,
+                         updates=[(upd['new'], upd['rowid']) for upd in update_details])
+    return (rows,
+            f"删除非日期文本 {len(delete_rows)} 条, 更新 {len(update_details)} 条",
+            report)
+
+
+def run_step9(columns: list, rows: list, date_dict=None) -> tuple:
+    yy_m_updates, m_updates, error_rows, skipped = \
+        step9.collect_prefix_updates(columns, rows, date_dict)
+    report = step9.export_to_html(columns, yy_m_updates, m_updates, error_rows, step9.OUTPUT_PATH)
+    updates = [(upd['new'], upd['rowid']) for upd in yy_m_updates + m_updates]
+    return (apply_changes(columns, rows, updates=updates),
+            f"yy,m 前缀 {len(yy_m_updates)} 条, m 前缀 {len(m_updates)} 条, "
+            f"错误保留原值 {len(error_rows)} 条", report)
+
+
+def run_step10(columns: list, rows: list, conn: sqlite3.Connection) -> tuple:
+    stats, sanity, changes = step10.tally_placeholders(columns, rows)
+    report = step10.export_to_html(conn, stats, sanity, step10.OUTPUT_PATH)
+    for col in step10.TARGET_COLUMNS:
+        if changes[col]:
+            updates = [('', rowid) for rowid, _ in changes[col]]
+            rows = apply_changes(columns, rows, updates=updates, column=col)
+    dirty = [col for col, cnt in sanity.items() if cnt]
+    summary = f"清理占位符 {sum(s['total'] for s in stats.values())} 个"
+    if dirty:
+        summary += f" (警告: 对照列 {', '.join(dirty)} 含占位符)"
+    return rows, summary, report
+
+
+STEPS = [
+    ("Step 0 全角转半角", run_step0),
+    ("Step 1 异常日期记录", run_step1),
+    ("Step 2 前向填充", run_step2),
+    ("Step 3 合计行", run_step3),
+    ("Step 4 月份日期", run_step4),
+    ("Step 5 日期展开", run_step5),
+    ("Step 6 复杂日期", run_step6),
+    ("Step 7 波浪号/短横线", run_step7),
+    ("Step 8 杂项清理", run_step8),
+    ("Step 9 yy,m/m 前缀", run_step9),
+]
+
+
+def build_change_set(columns: list, original_rows: list, final_rows: list) -> tuple:
+    """
+    比较原始数据与最终数据，返回 (deletes, updates)。
+    deletes 为 rowid 列表，updates 为 {列名: [(新值, rowid), ...]}。
+    """
+    final_by_rowid = {row[0]: row for row in final_rows}
+    col_idx = [(col, columns.index(col)) for col in WRITABLE_COLUMNS]
+
+    deletes = []
+    updates = {col: [] for col in WRITABLE_COLUMNS}
+    for row in original_rows:
+        rowid = row[0]
+        new_row = final_by_rowid.get(rowid)
+        if new_row is None:
+            deletes.append(rowid)
+            continue
+        for col, idx in col_idx:
+            if new_row[idx] != row[idx]:
+                updates[col].append((new_row[idx], rowid))
+    return deletes, updates
+
+
+def record_change_set(changeset: ChangeSet, columns: list, original_rows: list,
+                      deletes: list, updates: dict):
+    """把合并变更集连同原值记入 ChangeSet (用于计划文件和撤销文件)。"""
+    original_by_rowid = {row[0]: row for row in original_rows}
+    for rowid in deletes:
+        changeset.add_delete(original_by_rowid[rowid])
+    for col, col_updates in updates.items():
+        idx = columns.index(col)
+        for new_value, rowid in col_updates:
+            changeset.add_update(col, rowid, original_by_rowid[rowid][idx], new_value)
+
+
+def write_change_set(conn: sqlite3.Connection, deletes: list, updates: dict,
+                     date_dicts: dict = None):
+    """在一个事务内写回合并后的变更集 (及新解析的日期字典条目)，失败则整体 rollback。"""
+    try:
+        for date_dict in (date_dicts or {}).values():
+            date_dict.save(conn)
+        bulk_delete_rowids(conn, deletes)
+        for col, col_updates in updates.items():
+            bulk_update_column(conn, col, col_updates)
+        conn.commit()
+    except Exception:
+        conn.rollback()
+        raise
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(
+        description="清洁工资数据库 - 单次载入执行 Step 0 ~ Step 10 并一次性写回"
+    )
+    parser.add_argument(
+        "--dry-run",
+        action="store_true",
+        help="仅执行内存处理并导出各步骤报告，不写回数据库"
+    )
+    parser.add_argument(
+        "--apply",
+        metavar="CHANGESET",
+        help="应用 --dry-run 写出的变更集文件 (或撤销文件)，不重新执行各步骤"
+    )
+    parser.add_argument(
+        "--yes",
+        action="store_true",
+        help="跳过 'yes' 确认提示 (供 payroll_pipeline.py 等非交互调用)"
+    )
+    parser.add_argument(
+        "--incremental",
+        action="store_true",
+        help="只载入新文件或上次清洗后有变化的文件 (按 文件名 记录的水位, 见 cleansing_watermark.py)"
+    )
+    parser.add_argument(
+        "--workers",
+        type=int,
+        default=1,
+        help="Step 5~9 并行解析日期的进程数 (0 为 CPU 核数, 默认 1 不并行, 见 cleansing_parallel.py)"
+    )
+    parser.add_argument(
+        "--shard",
+        help="只处理指定年份的分片数据库 (见 payroll_shards.py)，如 2025"
+    )
+    args = parser.parse_args(argv)
+    db_path = shard_db_path_for_year(args.shard) if args.shard else DB_PATH
+
+    if not db_path.exists():
+        print(f"错误: 数据库文件不存在: {db_path}")
+        sys.exit(1)
+
+    if args.apply:
+        sys.exit(apply_changeset_file(db_path, args.apply, CHANGESET_STEP, args.yes))
+
+    if not step4.HAS_HOLIDAYS:
+        print("警告: holidays 模块未安装，Step 4 将使用简单的周末判断（不考虑法定节假日）")
+
+    conn = sqlite3.connect(str(db_path))
+    changeset = ChangeSet.capture(conn, CHANGESET_STEP)
+    scope = prepare_scope(conn, ALL_STEPS) if args.incremental else None
+    total = count_rows(conn)
+    # Step 4 的每月第一个工作日一次性算好 (见 cleansing_calendar.py)
+    load_calendar(conn)
+
+    # 只读取一次全表 (增量模式只读取范围内的文件), 按 rowid 排序以保证各步骤看到的顺序与逐步执行时一致
+    where = f"WHERE {scope} " if scope else ""
+    cursor = conn.execute(f"SELECT {full_row_select(conn)} FROM {PAYROLL_TABLE} {where}ORDER BY rowid")
+    columns = [desc[0] for desc in cursor.description]
+    original_rows = cursor.fetchall()
+    print(f"数据库 {db_path} 共 {total} 条记录")
+    if scope:
+        print(f"本次载入 {len(original_rows)} 条记录")
+
+    # Step 5~9 共用持久化的日期字典, 每个不同日期只解析一次 (见 cleansing_date_dict.py)
+    date_dicts = {
+        run_step5: step5.load_date_dict(conn),
+        run_step6: step6.load_date_dict(conn),
+        run_step7: step7.load_date_dict(conn),
+        run_step8: step8.load_date_dict(conn),
+        run_step9: step9.load_date_dict(conn),
+    }
+
+    rows = original_rows
+    date_idx = columns.index('日期')
+    file_idx = columns.index('文件名')
+    print("\n" + "=" * 80)
+    for name, run_step in STEPS:
+        if run_step in date_dicts:
+            if args.workers != 1:
+                # 基于上一步处理后的数据, 字典中没有的日期先并行解析 (见 cleansing_parallel.py)
+                date_dicts[run_step].prefetch(
+                    ((row[date_idx], row[file_idx]) for row in rows), args.workers
+                )
+            rows, summary, report = run_step(columns, rows, date_dicts[run_step])
+            summary += f" | {date_dicts[run_step].stats_line()}"
+        else:
+            rows, summary, report = run_step(columns, rows)
+        print(f"{name}: {summary}")
+        if report:
+            print(f"    报告: {report}")
+    rows, summary, report = run_step10(columns, rows, conn)
+    print(f"Step 10 'None' 占位符: {summary}")
+    print(f"    报告: {report}")
+    print("=" * 80)
+
+    deletes, updates = build_change_set(columns, original_rows, rows)
+    updated_rowids = {rowid for col_updates in updates.values() for _, rowid in col_updates}
+    print(f"\n【合并变更集】删除 {len(deletes)} 条, 更新 {len(updated_rowids)} 条记录")
+    for col in WRITABLE_COLUMNS:
+        if updates[col]:
+            print(f"  - {col}: {len(updates[col])} 个值")
+
+    record_change_set(changeset, columns, original_rows, deletes, updates)
+
+    if args.dry_run:
+        print("\n[DRY-RUN 模式] 未写回数据库。")
+        print(f"变更集已写入: {changeset.write(plan_path(CHANGESET_STEP))} (可用 --apply 应用)")
+        conn.close()
+        return
+
+    if not deletes and not updated_rowids:
+        print("\n无需修改，直接退出。")
+        record_watermark(conn, ALL_STEPS)
+        conn.close()
+        return
+
+    confirm = "yes" if args.yes else input(
+        f"\n[确认] 即将删除 {len(deletes)} 条记录并更新 {len(updated_rowids)} 条记录。\n"
+        f"请输入 'yes' 确认: "
+    )
+    if confirm.strip().lower() != "yes":
+        print("已取消操作。")
+        conn.close()
+        sys.exit(0)
+
+    try:
+        write_change_set(conn, deletes, updates, date_dicts)
+    except Exception as e:
+        print(f"\n[错误] 写回失败, 已 rollback: {e}")
+        conn.close()
+        sys.exit(1)
+    record_watermark(conn, ALL_STEPS)
+    print(f"\n撤销文件: {changeset.write_undo(conn)}")
+
+    final = conn.execute(f"SELECT COUNT(*) FROM {PAYROLL_TABLE}").fetchone()[0]
+    expected = total - len(deletes)
+    print(f"\n已写回。数据库当前共有 {final} 条记录 (预期 {expected} 条)")
+    if final != expected:
+        print("警告: 记录数与预期不一致, 请排查。")
+        conn.close()
+        sys.exit(1)
+
+    conn.close()
+
+
+if __name__ == "__main__":
+    main()
@@ -16,10 +16,15 @@
    '10&12' → '10,12'
 
 用法:
-    python cleansing_misc_step8.py [--dry-run]
+    python cleansing_misc_step8.py [--dry-run] [--apply CHANGESET] [--yes] [--incremental] [--workers N] [--shard YEAR]
 
 参数:
     --dry-run  仅预览并导出HTML，不执行操作
+    --apply CHANGESET  应用 --dry-run 写出的变更集 (或撤销文件)，不重新扫描
+    --yes      跳过 'yes' 确认提示 (非交互运行, 见 payroll_pipeline.py)
+    --incremental  只处理新文件或上次清洗后有变化的文件 (见 cleansing_watermark.py)
+    --workers N  字典中没有的日期按文件分区用 N 个进程并行解析 (0 为 CPU 核数, 默认 1)
+    --shard YEAR  只处理该年份的分片数据库 (见 payroll_shards.py)
     无参数    执行删除和更新操作
 """
 
@@ -27,11 +32,26 @@ import sqlite3
 import sys
 import argparse
 import re
+from collections import Counter
 from pathlib import Path
 
+from payroll_shards import shard_db_path_for_year
+from cleansing_report import HtmlReport, raw
+from cleansing_changeset import ChangeSet, apply_changeset_file, plan_path
+from cleansing_watermark import prepare_scope, record_watermark
+from cleansing_db_utils import bulk_delete_rowids, iter_rows, fetch_full_rows
+from cleansing_date_dict import DateCanonDict
+from cleansing_date_grammar import is_canonical_date
+from cleansing_rules import Rule, RuleSet
+
 DB_PATH = Path(__file__).parent.parent / "payroll_database.db"
 OUTPUT_PATH = Path(__file__).parent / "misc_step8_output.html"
 PAYROLL_TABLE = "payroll_details"
+CHANGESET_STEP = "step8"
+
+# 日期字典中本步骤的名称与版本 (修改解析逻辑后版本号加 1)
+DATE_DICT_STEP = "step8"
+DATE_DICT_VERSION = 1
 
 
 def has_chinese(text: str) -> bool:
@@ -159,135 +179,132 @@ def needs_overtime_cleanup(date_val: str) -> bool:
     return bool(re.match(r'^\d+\(加班\)$', str(date_val).strip()))
 
 
-def needs_chinese_period_fix(date_val: str) -> bool:
-    """检查是否包含中文句号"""
-    return '。' in str(date_val)
+# Part 2 的日期修正规则, 按优先级单遍串联执行 (见 cleansing_rules.py)。
+# 预过滤子串不在日期中时跳过该规则, 不调用 needs_* 判断。
+MISC_RULES = RuleSet("step8", [
+    Rule("space", " ", expand_space_separated, 10, needs_space_expansion, "空格分隔 → 逗号并展开范围"),
+    Rule("rest_day", "(", expand_rest_day_range, 20, needs_rest_day_expansion, "'X-Y(Z休' 展开并去掉休息日"),
+    Rule("overtime", "加班", remove_overtime_marker, 30, needs_overtime_cleanup, "'D(加班)' → 'D'"),
+    Rule("period", "。", replace_chinese_period, 40, description="中文句号 → 逗号"),
+    Rule("ampersand", "&", replace_ampersand, 50, description="& → 逗号"),
+])
+
+# 更新类型: 改变了日期的规则中第一个属于下列类型的规则, 都不是则为 'other'
+UPDATE_TYPES = ('space', 'rest_day', 'ampersand')
 
 
-def needs_ampersand_fix(date_val: str) -> bool:
-    """检查是否包含 & 分隔符"""
-    return '&' in str(date_val)
+# 报告中更新记录的分节: (类型, 节标题, 操作说明)
+UPDATE_SECTIONS = [
+    ('space', '二、已更新的空格分隔日期记录', '空格→逗号'),
+    ('rest_day', '三、已更新的休息日标记记录', '休息日展开'),
+    ('ampersand', '四、&分隔符替换记录', raw('&rarr;逗号')),
+    ('other', '五、其他更新', '其他'),
+]
 
 
-def export_to_html(columns: list, delete_rows: list, update_details: list, output_path: Path):
-    """导出处理结果到HTML文件。"""
+def export_to_html(columns: list, delete_rows: list, update_details: list, output_path: Path) -> Path:
+    """导出处理结果到HTML文件 (流式写入, 见 cleansing_report.py)，返回实际写入的文件。"""
     # 构建列名列表（不含rowid）
     display_cols = [c for c in columns if c != 'rowid']
+    display_idx = [columns.index(c) for c in display_cols]
+    type_counts = Counter(u['type'] for u in update_details)
+
+    style = (
+        "body { font-family: sans-serif; margin: 20px; }\n"
+        "table { margin-bottom: 30px; }\n"
+        "th, td { padding: 6px; }\n"
+        ".section { font-size: 18px; font-weight: bold; margin-top: 30px; margin-bottom: 10px; }\n"
+        ".deleted { background-color: #ffcccc; }\n"
+        ".updated { background-color: #ffffcc; }\n"
+    )
+    with HtmlReport(output_path, "Step 8 - 杂项清理结果", style) as report:
+        report.write(
+            "<h1>Step 8 - 杂项清理结果</h1>\n"
+            f'<div class="section">一、已删除的非日期文本记录（{len(delete_rows)} 条）</div>\n'
+        )
+        report.table(
+            display_cols,
+            ([row[i] for i in display_idx] for row in delete_rows),
+            row_class="deleted",
+        )
+        for update_type, heading, action in UPDATE_SECTIONS:
+            report.write(f'<div class="section">{heading}（{type_counts[update_type]} 条）</div>\n')
+            report.table(
+                ['操作', '原日期', '新日期'] + display_cols,
+                ([action, upd['old'], upd['new']] + [upd['row'][i] for i in display_idx]
+                 for upd in update_details if upd['type'] == update_type),
+                row_class="updated",
+            )
+    return report.path
 
-    html = f'''<!DOCTYPE html>
-<html>
-<head>
-<meta charset="UTF-8">
-<title>Step 8 - 杂项清理结果</title>
-<style>
-body {{ font-family: sans-serif; margin: 20px; }}
-table {{ border-collapse: collapse; font-size: 12px; margin-bottom: 30px; }}
-th, td {{ border: 1px solid #ddd; padding: 6px; }}
-th {{ background-color: #4472C4; color: white; position: sticky; top: 0; }}
-tr:nth-child(even) {{ background-color: #f2f2f2; }}
-tr:hover {{ background-color: #ddd; }}
-td {{ max-width: 200px; overflow: hidden; text-overflow: ellipsis; white-space: nowrap; }}
-.section {{ font-size: 18px; font-weight: bold; margin-top: 30px; margin-bottom: 10px; }}
-.deleted {{ background-color: #ffcccc; }}
-.updated {{ background-color: #ffffcc; }}
-</style>
-</head>
-<body>
-<h1>Step 8 - 杂项清理结果</h1>
-
-<div class="section">一、已删除的非日期文本记录（{len(delete_rows)} 条）</div>
-<table>
-<tr>{"".join(f'<th>{c}</th>' for c in display_cols)}</tr>
-'''
-    for row in delete_rows:
-        display_row = [row[columns.index(c)] for c in display_cols]
-        html += '<tr class="deleted">' + ''.join(
-            f'<td>{str(v) if v is not None else ""}</td>' for v in display_row
-        ) + '</tr>'
-
-    html += '''
-</table>
-
-<div class="section">二、已更新的空格分隔日期记录（''' + str(len([u for u in update_details if u['type'] == 'space'])) + ''' 条）</div>
-<table>
-<tr><th>操作</th><th>原日期</th><th>新日期</th>''' + "".join(f'<th>{c}</th>' for c in display_cols) + '''</tr>
-'''
-    for upd in update_details:
-        if upd['type'] != 'space':
-            continue
-        row = upd['row']
-        display_row = [row[columns.index(c)] for c in display_cols]
-        html += '<tr class="updated">'
-        html += f'<td>空格→逗号</td>'
-        html += f'<td>{upd["old"]}</td>'
-        html += f'<td>{upd["new"]}</td>'
-        html += ''.join(f'<td>{str(v) if v is not None else ""}</td>' for v in display_row)
-        html += '</tr>'
-
-    html += '''
-</table>
-
-<div class="section">三、已更新的休息日标记记录（''' + str(len([u for u in update_details if u['type'] == 'rest_day'])) + ''' 条）</div>
-<table>
-<tr><th>操作</th><th>原日期</th><th>新日期</th>''' + "".join(f'<th>{c}</th>' for c in display_cols) + '''</tr>
-'''
-    for upd in update_details:
-        if upd['type'] != 'rest_day':
-            continue
-        row = upd['row']
-        display_row = [row[columns.index(c)] for c in display_cols]
-        html += '<tr class="updated">'
-        html += f'<td>休息日展开</td>'
-        html += f'<td>{upd["old"]}</td>'
-        html += f'<td>{upd["new"]}</td>'
-        html += ''.join(f'<td>{str(v) if v is not None else ""}</td>' for v in display_row)
-        html += '</tr>'
-
-    html += '''
-</table>
-
-<div class="section">四、&分隔符替换记录（''' + str(len([u for u in update_details if u['type'] == 'ampersand'])) + ''' 条）</div>
-<table>
-<tr><th>操作</th><th>原日期</th><th>新日期</th>''' + "".join(f'<th>{c}</th>' for c in display_cols) + '''</tr>
-'''
-    for upd in update_details:
-        if upd['type'] != 'ampersand':
-            continue
-        row = upd['row']
-        display_row = [row[columns.index(c)] for c in display_cols]
-        html += '<tr class="updated">'
-        html += f'<td>&rarr;逗号</td>'
-        html += f'<td>{upd["old"]}</td>'
-        html += f'<td>{upd["new"]}</td>'
-        html += ''.join(f'<td>{str(v) if v is not None else ""}</td>' for v in display_row)
-        html += '</tr>'
-
-    html += '''
-</table>
-
-<div class="section">五、其他更新（''' + str(len([u for u in update_details if u['type'] == 'other'])) + ''' 条）</div>
-<table>
-<tr><th>操作</th><th>原日期</th><th>新日期</th>''' + "".join(f'<th>{c}</th>' for c in display_cols) + '''</tr>
-'''
-    for upd in update_details:
-        if upd['type'] != 'other':
+
+def find_garbage_rows(columns: list, all_rows: list) -> list:
+    """Part 1: 找出日期列为非日期文本的记录 (需删除)。"""
+    date_idx = columns.index('日期')
+    delete_rows = []
+    for row in all_rows:
+        date_val = row[date_idx]
+        if date_val is not None and is_pure_garbage_date(str(date_val)):
+            delete_rows.append(row)
+    return delete_rows
+
+
+def canonicalize_date(date_str: str, file_name: str = None) -> tuple:
+    """
+    计算单个 (已 strip 的) 日期在 Part 2 的转换结果，供日期字典缓存。
+    返回 (新日期或None, 更新类型, None)，更新类型为 space/rest_day/ampersand/other。
+    """
+    # 已是规范格式 (升序逗号分隔的 1~31) 的日期无需再走下面的正则 (见 cleansing_date_grammar.py)
+    if is_canonical_date(date_str):
+        return None, None, None
+
+    new_date, fired = MISC_RULES.apply(date_str)
+    if new_date == date_str:
+        return None, None, None
+
+    upd_type = next((name for name in fired if name in UPDATE_TYPES), 'other')
+    return new_date, upd_type, None
+
+
+def load_date_dict(conn: sqlite3.Connection) -> DateCanonDict:
+    """载入本步骤的日期字典 (结果与文件名无关)。"""
+    return DateCanonDict.load(conn, DATE_DICT_STEP, DATE_DICT_VERSION,
+                              canonicalize_date, per_file=False)
+
+
+def collect_update_details(columns: list, all_rows: list, date_dict: DateCanonDict = None,
+                           delete_rows: list = ()) -> list:
+    """
+    Part 2: 计算需要转换的日期，不访问数据库 (cleansing_engine.py 也复用此函数)。
+    每个不同的日期只解析一次 (见 cleansing_date_dict.py)。
+    delete_rows 为 Part 1 要删除的记录: 这些记录先被删除, 不再记为更新
+    (否则变更集/撤销文件中会有对已删除记录的更新, 撤销时核对失败)。
+    返回 dict 列表: {type, old, new, row, rowid}
+    """
+    if date_dict is None:
+        date_dict = DateCanonDict(DATE_DICT_STEP, DATE_DICT_VERSION,
+                                  canonicalize_date, per_file=False)
+    date_idx = columns.index('日期')
+    rowid_idx = 0  # rowid is first column
+    deleted = {row[rowid_idx] for row in delete_rows}
+    update_details = []
+
+    for row in all_rows:
+        date_val = row[date_idx]
+        if date_val is None or str(date_val).strip() == '' or row[rowid_idx] in deleted:
             continue
-        row = upd['row']
-        display_row = [row[columns.index(c)] for c in display_cols]
-        html += '<tr class="updated">'
-        html += f'<td>其他</td>'
-        html += f'<td>{upd["old"]}</td>'
-        html += f'<td>{upd["new"]}</td>'
-        html += ''.join(f'<td>{str(v) if v is not None else ""}</td>' for v in display_row)
-        html += '</tr>'
 
-    html += '''
-</table>
-</body>
-</html>'''
+        new_date, upd_type, _ = date_dict.lookup(date_val, None)
+        if new_date is not None:
+            update_details.append({
+                'type': upd_type,
+                'old': str(date_val).strip(),
+                'new': new_date,
+                'row': row,
+                'rowid': row[rowid_idx]
+            })
 
-    with open(output_path, 'w', encoding='utf-8') as f:
-        f.write(html)
+    return update_details
 
 
 def summarize_by_file(columns: list, rows: list) -> dict:
@@ -300,7 +317,7 @@ def summarize_by_file(columns: list, rows: list) -> dict:
     return summary
 
 
-def main():
+def main(argv=None):
     parser = argparse.ArgumentParser(
         description="清洁工资数据库 Step 8 - 杂项清理"
     )
@@ -309,17 +326,48 @@ def main():
         action="store_true",
         help="仅预览并导出HTML，不执行操作"
     )
-    args = parser.parse_args()
+    parser.add_argument(
+        "--apply",
+        metavar="CHANGESET",
+        help="应用 --dry-run 写出的变更集文件 (或撤销文件)，不重新扫描"
+    )
+    parser.add_argument(
+        "--yes",
+        action="store_true",
+        help="跳过 'yes' 确认提示 (供 payroll_pipeline.py 等非交互调用)"
+    )
+    parser.add_argument(
+        "--incremental",
+        action="store_true",
+        help="只处理新文件或上次清洗后有变化的文件 (按 文件名 记录的水位, 见 cleansing_watermark.py)"
+    )
+    parser.add_argument(
+        "--workers",
+        type=int,
+        default=1,
+        help="并行解析日期的进程数 (0 为 CPU 核数, 默认 1 不并行, 见 cleansing_parallel.py)"
+    )
+    parser.add_argument(
+        "--shard",
+        help="只处理指定年份的分片数据库 (见 payroll_shards.py)，如 2025"
+    )
+    args = parser.parse_args(argv)
+    db_path = shard_db_path_for_year(args.shard) if args.shard else DB_PATH
 
-    if not DB_PATH.exists():
-        print(f"错误: 数据库文件不存在: {DB_PATH}")
+    if not db_path.exists():
+        print(f"错误: 数据库文件不存在: {db_path}")
         sys.exit(1)
 
-    conn = sqlite3.connect(str(DB_PATH))
-    cursor = conn.execute(f"SELECT rowid, * FROM {PAYROLL_TABLE}")
-    columns = [desc[0] for desc in cursor.description]
-    all_rows = cursor.fetchall()
-    date_idx = columns.index('日期')
+    if args.apply:
+        sys.exit(apply_changeset_file(db_path, args.apply, CHANGESET_STEP, args.yes))
+
+    conn = sqlite3.connect(str(db_path))
+    changeset = ChangeSet.capture(conn, CHANGESET_STEP)
+    scope = prepare_scope(conn, CHANGESET_STEP) if args.incremental else None
+    # 只读取日期、文件名列 (Part 1 / Part 2 各扫描一次, 完整记录只在导出报告时按需读取)
+    read_columns = ['日期', '文件名']
+    columns = ['rowid'] + read_columns
+    all_rows = list(iter_rows(conn, read_columns, where=scope))
     rowid_idx = 0  # rowid is first column
 
     print(f"数据库共有 {len(all_rows)} 条记录")
@@ -327,11 +375,7 @@ def main():
     # =========================================
     # Part 1: 识别并删除非日期文本记录
     # =========================================
-    delete_rows = []
-    for row in all_rows:
-        date_val = row[date_idx]
-        if date_val is not None and is_pure_garbage_date(str(date_val)):
-            delete_rows.append(row)
+    delete_rows = find_garbage_rows(columns, all_rows)
 
     print(f"\n【删除】找到 {len(delete_rows)} 条非日期文本记录")
     if delete_rows:
@@ -343,55 +387,11 @@ def main():
     # =========================================
     # Part 2: 识别并转换需要更新的记录
     # =========================================
-    update_details = []  # list of dicts: {type, old, new, row, rowid}
-
-    for row in all_rows:
-        date_val = row[date_idx]
-        if date_val is None or str(date_val).strip() == '':
-            continue
-
-        rowid = row[rowid_idx]
-        old_date = str(date_val).strip()
-        new_date = old_date
-
-        # 2a. 空格分隔日期
-        if needs_space_expansion(new_date):
-            new_date = expand_space_separated(new_date)
-
-        # 2b. 休息日标记 'X-Y(Z休'
-        if needs_rest_day_expansion(new_date):
-            new_date = expand_rest_day_range(new_date)
-
-        # 2c. 加班标记 'D(加班)'
-        if needs_overtime_cleanup(new_date):
-            new_date = remove_overtime_marker(new_date)
-
-        # 2d. 中文句号
-        if needs_chinese_period_fix(new_date):
-            new_date = replace_chinese_period(new_date)
-
-        # 2e. & 分隔符替换为逗号
-        if needs_ampersand_fix(new_date):
-            new_date = replace_ampersand(new_date)
-
-        if new_date != old_date:
-            # 确定类型
-            if needs_space_expansion(old_date):
-                upd_type = 'space'
-            elif needs_rest_day_expansion(old_date):
-                upd_type = 'rest_day'
-            elif needs_ampersand_fix(old_date):
-                upd_type = 'ampersand'
-            else:
-                upd_type = 'other'
-
-            update_details.append({
-                'type': upd_type,
-                'old': old_date,
-                'new': new_date,
-                'row': row,
-                'rowid': rowid
-            })
+    date_dict = load_date_dict(conn)
+    if args.workers != 1:
+        # 字典中没有的日期先按文件分区并行解析, 逐行处理时直接命中 (见 cleansing_parallel.py)
+        date_dict.prefetch_from_db(conn, args.workers, where=scope)
+    update_details = collect_update_details(columns, all_rows, date_dict, delete_rows)
 
     # 按类型统计
     space_count = len([u for u in update_details if u['type'] == 'space'])
@@ -400,10 +400,14 @@ def main():
     other_count = len([u for u in update_details if u['type'] == 'other'])
 
     print(f"\n【更新】共 {len(update_details)} 条记录需要更新:")
+    print(f"  - {date_dict.stats_line()}")
     print(f"  - 空格分隔日期: {space_count}")
     print(f"  - 休息日标记(X-Y(Z休): {rest_day_count}")
     print(f"  - &分隔符: {ampersand_count}")
     print(f"  - 其他(加班/句号): {other_count}")
+    if MISC_RULES.evaluated:
+        print()
+        MISC_RULES.print_stats()
 
     # 模式统计
     if update_details:
@@ -422,16 +426,29 @@ def main():
     # =========================================
     # 导出到HTML
     # =========================================
-    export_to_html(columns, delete_rows, update_details, OUTPUT_PATH)
-    print(f"\n已导出到: {OUTPUT_PATH}")
+    columns, full_rows = fetch_full_rows(
+        conn, [row[rowid_idx] for row in delete_rows] + [upd['rowid'] for upd in update_details]
+    )
+    delete_rows = [full_rows[row[rowid_idx]] for row in delete_rows]
+    for upd in update_details:
+        upd['row'] = full_rows[upd['rowid']]
+    report = export_to_html(columns, delete_rows, update_details, OUTPUT_PATH)
+    print(f"\n已导出到: {report}")
 
     # =========================================
     # 执行操作（非 --dry-run 模式）
     # =========================================
+    date_idx = columns.index('日期')
+    for row in delete_rows:
+        changeset.add_delete(row)
+    for upd in update_details:
+        changeset.add_update('日期', upd['rowid'], upd['row'][date_idx], upd['new'])
+
     if args.dry_run:
         print(f"\n[DRY-RUN 模式] 未执行任何操作。")
+        print(f"变更集已写入: {changeset.write(plan_path(CHANGESET_STEP))} (可用 --apply 应用)")
     else:
-        confirm_all = input(f"\n[确认] 即将删除 {len(delete_rows)} 条记录并更新 {len(update_details)} 条记录。\n请输入 'yes' 确认: ")
+        confirm_all = "yes" if args.yes else input(f"\n[确认] 即将删除 {len(delete_rows)} 条记录并更新 {len(update_details)} 条记录。\n请输入 'yes' 确认: ")
         if confirm_all.strip().lower() != "yes":
             print("已取消操作。")
             conn.close()
@@ -439,36 +456,29 @@ def main():
 
         # 执行删除
         if delete_rows:
-            delete_rowids = [row[rowid_idx] for row in delete_rows]
-            placeholders = ",".join("?" * len(delete_rowids))
-            conn.execute(
-                f"DELETE FROM {PAYROLL_TABLE} WHERE rowid IN ({placeholders})",
-                delete_rowids
-            )
+            bulk_delete_rowids(conn, [row[rowid_idx] for row in delete_rows])
             conn.commit()
             print(f"已删除 {len(delete_rows)} 条记录。")
 
-        # 执行更新
+        # 执行更新: 新解析的日期先写入日期字典, 再按字典联表更新
+        date_dict.save(conn)
+        if update_details:
+            date_dict.apply(conn, where=scope)
+        conn.commit()
+        record_watermark(conn, CHANGESET_STEP)
         if update_details:
-            for upd in update_details:
-                conn.execute(
-                    f"UPDATE {PAYROLL_TABLE} SET 日期 = ? WHERE rowid = ?",
-                    (upd['new'], upd['rowid'])
-                )
-            conn.commit()
             print(f"已更新 {len(update_details)} 条记录。")
 
         # 最终统计
         cursor = conn.execute(f"SELECT COUNT(*) FROM {PAYROLL_TABLE}")
         final_count = cursor.fetchone()[0]
         print(f"操作完成后数据库共有 {final_count} 条记录。")
+        print(f"撤销文件: {changeset.write_undo(conn)}")
 
         # 验证：检查是否还有残留
-        cursor = conn.execute(f"SELECT rowid, * FROM {PAYROLL_TABLE}")
-        remaining = cursor.fetchall()
         remaining_garbage = 0
-        for row in remaining:
-            date_val = row[date_idx]
+        for row in iter_rows(conn, ['日期'], where=scope):
+            date_val = row[1]
             if date_val is not None:
                 s = str(date_val).strip()
                 if has_chinese(s) and not re.match(r'^\d+-\d+\(\d+休?$', s) and not re.match(r'^\d+\(加班\)$', s):
@@ -6,8 +6,12 @@
 前提: Step 0-9 已完成,日期列已规范化;本步骤不依赖也不修改日期。
 
 占位符来源:
-  excel_processor/sheet_processor.py:523 `df[col] = df[col].astype(str)`
+  旧版 excel_processor/sheet_processor.py 的 `df[col] = df[col].astype(str)`
   把空 pandas 单元格 (Python None) 转成字符串 'None' 后写入 DB。
+  现在 load_df_to_db() 在写入前用 normalize_text_value() 把 None / NaN / 占位符
+  转为 '' (或 PAYROLL_EMPTY_TEXT=null 时为 NULL, 见 excel_processor/config.py),
+  新载入的数据不再产生占位符。本步骤只用于迁移旧数据库 (运行一次),
+  日常刷新用 --verify 只读验证 (payroll_pipeline.py 的 step10 即为 --verify)。
 
 目标列 (6 个,均为文本列):
   代码, 客户名称, 备注, 工序, 型号, 工序全名
@@ -20,14 +24,22 @@
   - '文件名' / 'sheet名' / '职员全名' / '日期'  (经核查,这些列无占位符)
   - 已存在的 '' 空串 (用户已确认不动)
 
-行为: 6 个 UPDATE 在一个事务内执行,任一失败整体 rollback。
+行为: 统计、样本和变更集在一次扫描中得到; 含占位符的列合并为一条多列 UPDATE,
+  在一个事务内执行,失败整体 rollback; 写入后用一条条件聚合查询验证残留。
   与 reconcile_excel_vs_db.py 的 normalize_value() 行为保持一致。
 
 用法:
-    python3 cleansing_none_cleanup_step10.py [--dry-run]
+    python3 cleansing_none_cleanup_step10.py [--dry-run] [--apply CHANGESET] [--yes] [--incremental] [--shard YEAR]
+    python3 cleansing_none_cleanup_step10.py --verify [--incremental] [--shard YEAR]
 
 参数:
     --dry-run  仅预览并导出HTML报告,不执行 UPDATE
+    --apply CHANGESET  应用 --dry-run 写出的变更集 (或撤销文件)，不重新扫描
+    --yes      跳过 'yes' 确认提示 (非交互运行, 见 payroll_pipeline.py)
+    --incremental  只处理新文件或上次清洗后有变化的文件 (见 cleansing_watermark.py)
+    --verify   只读验证: 6 个目标列都没有占位符时退出码 0, 否则列出个数并退出码 1
+               (说明数据库由旧版载入, 需不带 --verify 运行本步骤一次完成迁移)
+    --shard YEAR  只处理该年份的分片数据库 (见 payroll_shards.py)
     无参数    提示输入 'yes' 确认,执行 UPDATE
 
 输出:
@@ -39,9 +51,16 @@ import sys
 import argparse
 from pathlib import Path
 
+from payroll_shards import shard_db_path_for_year
+from cleansing_report import HtmlReport, ClassedRow, raw
+from cleansing_changeset import ChangeSet, apply_changeset_file, plan_path
+from cleansing_watermark import prepare_scope, record_watermark, and_scope
+from cleansing_db_utils import iter_rows, fetch_full_rows, full_row_columns
+
 DB_PATH = Path(__file__).parent.parent / "payroll_database.db"
 OUTPUT_PATH = Path(__file__).parent / "none_cleanup_step10_output.html"
 PAYROLL_TABLE = "payroll_details"
+CHANGESET_STEP = "step10"
 
 # 6 个目标列 (经 dry-run 确认含占位符的列)
 TARGET_COLUMNS = ['代码', '客户名称', '备注', '工序', '型号', '工序全名']
@@ -57,62 +76,106 @@ SANITY_COLUMNS = ['文件名', 'sheet名', '职员全名', '日期']
 SAMPLE_LIMIT = 50
 
 
-def build_placeholder_where(col: str) -> str:
-    return f"{col} IN ({PLACEHOLDER_IN})"
+def tally_placeholders(columns: list, rows) -> tuple:
+    """
+    一次遍历统计占位符，返回 (stats, sanity, changes):
+      - stats: 每个目标列的 total / per_variant / sample (最多 50 条)
+      - sanity: 4 个对照列 (预期干净) 的占位符计数, 任一 > 0 都是异常需要排查
+      - changes: {目标列: [(rowid, 原值), ...]}, 用于 UPDATE 和变更集
+    rows 需按 rowid 排序 (样本取每列最前面的记录)。
+    cleansing_engine.py 对内存中的全部记录调用; 数据库版本见 scan_placeholders()。
+    """
+    target_idx = [(col, columns.index(col)) for col in TARGET_COLUMNS]
+    sanity_idx = [(col, columns.index(col)) for col in SANITY_COLUMNS]
+    stats = {col: {'total': 0, 'per_variant': {}, 'sample': []} for col in TARGET_COLUMNS}
+    sanity = {col: 0 for col in SANITY_COLUMNS}
+    changes = {col: [] for col in TARGET_COLUMNS}
+
+    for row in rows:
+        for col, idx in target_idx:
+            value = row[idx]
+            if value in PLACEHOLDERS:
+                s = stats[col]
+                s['total'] += 1
+                s['per_variant'][value] = s['per_variant'].get(value, 0) + 1
+                if len(s['sample']) < SAMPLE_LIMIT:
+                    s['sample'].append(row)
+                changes[col].append((row[0], value))
+        for col, idx in sanity_idx:
+            if row[idx] in PLACEHOLDERS:
+                sanity[col] += 1
+    return stats, sanity, changes
+
+
+def scan_placeholders(conn, scope: str = None) -> tuple:
+    """
+    单次扫描得到 tally_placeholders() 的结果: 只流式读取任一目标列/对照列含占位符的记录
+    (rowid + 这 10 列)，样本再按 rowid 取回完整记录用于 HTML 报告。
+    原来每列一条 COUNT、每种占位符一条 COUNT、每列一条样本查询，共几十次全表扫描。
+    """
+    read_columns = TARGET_COLUMNS + SANITY_COLUMNS
+    where = and_scope(
+        " OR ".join(f"{col} IN ({PLACEHOLDER_IN})" for col in read_columns), scope
+    )
+    stats, sanity, changes = tally_placeholders(
+        ['rowid'] + read_columns, iter_rows(conn, read_columns, where=where)
+    )
+    _, full_rows = fetch_full_rows(
+        conn, [row[0] for s in stats.values() for row in s['sample']]
+    )
+    for s in stats.values():
+        s['sample'] = [full_rows[row[0]] for row in s['sample']]
+    return stats, sanity, changes
+
+
+def count_placeholders(conn, columns: list, scope: str = None) -> dict:
+    """条件聚合: 一次扫描得到各列的占位符个数 (用于写入后的残留验证)。"""
+    sums = ", ".join(f"COALESCE(SUM({col} IN ({PLACEHOLDER_IN})), 0)" for col in columns)
+    where = f" WHERE {scope}" if scope else ""
+    values = conn.execute(f"SELECT {sums} FROM {PAYROLL_TABLE}{where}").fetchone()
+    return dict(zip(columns, values))
 
 
-def collect_stats(conn) -> dict:
+def verify_no_placeholders(conn, scope: str = None) -> int:
+    """
+    --verify: 一条条件聚合查询检查目标列和对照列, 不写入数据库。
+    返回目标列的占位符总数 (0 表示已达到本步骤清理后的状态);
+    对照列本步骤不清理, 有占位符时只打印警告。
     """
-    对每个目标列:
-      - total: 占位符总数
-      - per_variant: 每种占位符值的计数
-      - sample: 最多 50 条 rowid + 全列, 用于 HTML 报告
+    counts = count_placeholders(conn, TARGET_COLUMNS + SANITY_COLUMNS, scope)
+    for col, cnt in counts.items():
+        if not cnt:
+            print(f"  ✅ {col}: 0")
+        elif col in TARGET_COLUMNS:
+            print(f"  ❌ {col}: {cnt} 个占位符")
+        else:
+            print(f"  ⚠️ {col}: {cnt} 个占位符 (对照列, 需要排查)")
+    return sum(counts[col] for col in TARGET_COLUMNS)
+
+
+def build_fused_update(columns: list, scope: str = None) -> str:
+    """把各列的 UPDATE 合并为一条: 只改占位符, 其他值原样保留。"""
+    assignments = ",\n            ".join(
+        f"{col} = CASE WHEN {col} IN ({PLACEHOLDER_IN}) THEN '' ELSE {col} END"
+        for col in columns
+    )
+    where = and_scope(" OR ".join(f"{col} IN ({PLACEHOLDER_IN})" for col in columns), scope)
+    return f"""
+        UPDATE {PAYROLL_TABLE} SET
+            {assignments}
+        WHERE {where}
     """
-    stats = {}
+
+
+def collect_changes(changeset: ChangeSet, changes: dict):
+    """把每个目标列的占位符 (rowid, 原值 -> '') 记入变更集。"""
     for col in TARGET_COLUMNS:
-        where = build_placeholder_where(col)
-
-        total = conn.execute(
-            f"SELECT COUNT(*) FROM {PAYROLL_TABLE} WHERE {where}"
-        ).fetchone()[0]
-
-        per_variant = {}
-        for p in PLACEHOLDERS:
-            cnt = conn.execute(
-                f"SELECT COUNT(*) FROM {PAYROLL_TABLE} WHERE {col} = ?", (p,)
-            ).fetchone()[0]
-            if cnt:
-                per_variant[p] = cnt
-
-        sample = []
-        if total:
-            cur = conn.execute(
-                f"SELECT rowid, * FROM {PAYROLL_TABLE} WHERE {where} LIMIT {SAMPLE_LIMIT}"
-            )
-            sample = cur.fetchall()
-
-        stats[col] = {
-            'total': total,
-            'per_variant': per_variant,
-            'sample': sample,
-        }
-    return stats
-
-
-def check_clean_columns(conn) -> dict:
-    """4 个对照列(预期干净)的占位符计数,任一 > 0 都是异常需要排查"""
-    result = {}
-    for col in SANITY_COLUMNS:
-        where = build_placeholder_where(col)
-        cnt = conn.execute(
-            f"SELECT COUNT(*) FROM {PAYROLL_TABLE} WHERE {where}"
-        ).fetchone()[0]
-        result[col] = cnt
-    return result
-
-
-def export_to_html(conn, stats: dict, sanity: dict, output_path: Path):
-    """导出处理结果到 HTML"""
+        for rowid, value in changes[col]:
+            changeset.add_update(col, rowid, value, '')
+
+
+def export_to_html(conn, stats: dict, sanity: dict, output_path: Path) -> Path:
+    """导出处理结果到 HTML (流式写入, 见 cleansing_report.py)，返回实际写入的文件"""
     total_rows = sum(s['total'] for s in stats.values())
 
     # 取一个样本的列名 (所有 sample 共享相同列结构)
@@ -120,88 +183,57 @@ def export_to_html(conn, stats: dict, sanity: dict, output_path: Path):
         (s['sample'][0] for s in stats.values() if s['sample']), None
     )
 
-    html = f'''<!DOCTYPE html>
-<html>
-<head>
-<meta charset="UTF-8">
-<title>Step 10 - 'None' 占位符清理结果</title>
-<style>
-body {{ font-family: sans-serif; margin: 20px; }}
-table {{ border-collapse: collapse; font-size: 12px; margin-bottom: 30px; }}
-th, td {{ border: 1px solid #ddd; padding: 6px; }}
-th {{ background-color: #4472C4; color: white; position: sticky; top: 0; }}
-tr:nth-child(even) {{ background-color: #f2f2f2; }}
-tr:hover {{ background-color: #ffeb99; }}
-td {{ max-width: 250px; overflow: hidden; text-overflow: ellipsis; white-space: nowrap; }}
-.section {{ font-size: 18px; font-weight: bold; margin-top: 30px; margin-bottom: 10px; }}
-.updated {{ background-color: #ffffcc; }}
-.summary {{ background-color: #e6f3ff; font-weight: bold; }}
-.zero {{ color: #999; }}
-</style>
-</head>
-<body>
-<h1>Step 10 - 'None' 占位符清理结果</h1>
-
-<div class="section">一、汇总</div>
-<table>
-<tr><th>列名</th><th>占位符总数</th><th>占位符类型分布</th></tr>
-'''
-    for col in TARGET_COLUMNS:
-        s = stats[col]
-        if s['total'] == 0:
-            dist = '<span class="zero">(无)</span>'
-        else:
-            dist = ', '.join(f"{k}={v}" for k, v in sorted(s['per_variant'].items()))
-        html += (
-            f'<tr class="{"summary" if s["total"] else "zero"}">'
-            f'<td>{col}</td>'
-            f'<td>{s["total"]}</td>'
-            f'<td>{dist}</td>'
-            f'</tr>\n'
-        )
-    html += f'''
-<tr class="summary"><td>合计</td><td>{total_rows}</td><td>-</td></tr>
-</table>
-
-<div class="section">二、对照列(预期干净,应为 0)</div>
-<table>
-<tr><th>列名</th><th>占位符计数</th><th>状态</th></tr>
-'''
-    for col, cnt in sanity.items():
-        status = '✅ 干净' if cnt == 0 else f'❌ 异常! {cnt} 个'
-        html += (
-            f'<tr class="{"zero" if cnt == 0 else "updated"}">'
-            f'<td>{col}</td><td>{cnt}</td><td>{status}</td></tr>\n'
-        )
-    html += '</table>\n'
-
-    # 每个目标列 1 个 section
-    if sample_row:
-        sample_cols = [d[0] for d in conn.execute(
-            f"SELECT rowid, * FROM {PAYROLL_TABLE} LIMIT 1"
-        ).description]
-        display_cols = [c for c in sample_cols if c != 'rowid']
+    style = """
+body { font-family: sans-serif; margin: 20px; }
+table { margin-bottom: 30px; }
+th, td { padding: 6px; }
+tr:hover { background-color: #ffeb99; }
+td { max-width: 250px; }
+.section { font-size: 18px; font-weight: bold; margin-top: 30px; margin-bottom: 10px; }
+.updated { background-color: #ffffcc; }
+.summary { background-color: #e6f3ff; font-weight: bold; }
+.zero { color: #999; }
+"""
 
+    def summary_rows():
         for col in TARGET_COLUMNS:
             s = stats[col]
-            html += f'<div class="section">{TARGET_COLUMNS.index(col)+3}、{col} 列样本 ({s["total"]} 条, 前 {min(SAMPLE_LIMIT, s["total"])} 条展示)</div>\n'
-            if not s['sample']:
-                html += '<p class="zero">(无占位符记录,无需处理)</p>\n'
-                continue
-            html += '<table>\n<tr><th>rowid</th>' + ''.join(f'<th>{c}</th>' for c in display_cols) + '</tr>\n'
-            for row in s['sample']:
-                # rowid is first (index 0)
-                cells = ''.join(
-                    f'<td>{str(v) if v is not None else ""}</td>'
-                    for v in row[1:]
+            if s['total'] == 0:
+                dist = raw('<span class="zero">(无)</span>')
+            else:
+                dist = ', '.join(f"{k}={v}" for k, v in sorted(s['per_variant'].items()))
+            yield ClassedRow([col, s['total'], dist], "summary" if s['total'] else "zero")
+        yield ClassedRow(['合计', total_rows, '-'], "summary")
+
+    def sanity_rows():
+        for col, cnt in sanity.items():
+            status = '✅ 干净' if cnt == 0 else f'❌ 异常! {cnt} 个'
+            yield ClassedRow([col, cnt, status], "zero" if cnt == 0 else "updated")
+
+    with HtmlReport(output_path, "Step 10 - 'None' 占位符清理结果", style) as report:
+        report.write("<h1>Step 10 - 'None' 占位符清理结果</h1>\n")
+        report.write('<div class="section">一、汇总</div>\n')
+        report.table(['列名', '占位符总数', '占位符类型分布'], summary_rows())
+        report.write('<div class="section">二、对照列(预期干净,应为 0)</div>\n')
+        report.table(['列名', '占位符计数', '状态'], sanity_rows())
+
+        # 每个目标列 1 个 section
+        if sample_row:
+            # 与 fetch_full_rows 取回的样本同一列序 (规范化模式下视图的 rowid 列不重复)
+            display_cols = full_row_columns(conn)[1:]
+
+            for col in TARGET_COLUMNS:
+                s = stats[col]
+                report.write(
+                    f'<div class="section">{TARGET_COLUMNS.index(col)+3}、{col} 列样本 '
+                    f'({s["total"]} 条, 前 {min(SAMPLE_LIMIT, s["total"])} 条展示)</div>\n'
                 )
-                html += f'<tr class="updated"><td>{row[0]}</td>{cells}</tr>\n'
-            html += '</table>\n'
-
-    html += '</body></html>'
-
-    with open(output_path, 'w', encoding='utf-8') as f:
-        f.write(html)
+                if not s['sample']:
+                    report.write('<p class="zero">(无占位符记录,无需处理)</p>\n')
+                    continue
+                # rowid is first (index 0)
+                report.table(['rowid'] + display_cols, s['sample'], row_class="updated")
+    return report.path
 
 
 def print_summary(stats: dict, sanity: dict):
@@ -228,7 +260,7 @@ def print_summary(stats: dict, sanity: dict):
         print("\n警告: 4 个对照列中至少 1 个有占位符,需要先排查! 脚本仍会继续但请关注。")
 
 
-def main():
+def main(argv=None):
     parser = argparse.ArgumentParser(
         description="清洁工资数据库 Step 10 - 清理 'None' 字面量占位符 (cleansing 最后一步)"
     )
@@ -237,28 +269,75 @@ def main():
         action="store_true",
         help="仅预览并导出HTML报告, 不执行 UPDATE"
     )
-    args = parser.parse_args()
+    parser.add_argument(
+        "--apply",
+        metavar="CHANGESET",
+        help="应用 --dry-run 写出的变更集文件 (或撤销文件)，不重新扫描"
+    )
+    parser.add_argument(
+        "--yes",
+        action="store_true",
+        help="跳过 'yes' 确认提示 (供 payroll_pipeline.py 等非交互调用)"
+    )
+    parser.add_argument(
+        "--incremental",
+        action="store_true",
+        help="只处理新文件或上次清洗后有变化的文件 (按 文件名 记录的水位, 见 cleansing_watermark.py)"
+    )
+    parser.add_argument(
+        "--verify",
+        action="store_true",
+        help="只读验证没有占位符残留 (载入时已归一化, 日常刷新不再需要 UPDATE)"
+    )
+    parser.add_argument(
+        "--shard",
+        help="只处理指定年份的分片数据库 (见 payroll_shards.py)，如 2025"
+    )
+    args = parser.parse_args(argv)
+    db_path = shard_db_path_for_year(args.shard) if args.shard else DB_PATH
 
-    if not DB_PATH.exists():
-        print(f"错误: 数据库文件不存在: {DB_PATH}")
+    if not db_path.exists():
+        print(f"错误: 数据库文件不存在: {db_path}")
         sys.exit(1)
 
-    conn = sqlite3.connect(str(DB_PATH))
+    if args.apply:
+        sys.exit(apply_changeset_file(db_path, args.apply, CHANGESET_STEP, args.yes))
+
+    conn = sqlite3.connect(str(db_path))
+
+    if args.verify:
+        scope = prepare_scope(conn, CHANGESET_STEP) if args.incremental else None
+        print("[验证] 检查占位符 (只读) ...")
+        residual = verify_no_placeholders(conn, scope)
+        if residual:
+            print(f"\n验证失败: 共 {residual} 个占位符。数据库由旧版载入程序写入,")
+            print("请不带 --verify 运行本步骤一次完成迁移 (清理为 '')。")
+            conn.close()
+            sys.exit(1)
+        print("\n验证通过: 无占位符, 载入时已归一化, 无需 UPDATE。")
+        record_watermark(conn, CHANGESET_STEP)
+        conn.close()
+        return
+
+    changeset = ChangeSet.capture(conn, CHANGESET_STEP)
+    scope = prepare_scope(conn, CHANGESET_STEP) if args.incremental else None
 
     # 总行数 (用于 sanity 报告)
     total = conn.execute(f"SELECT COUNT(*) FROM {PAYROLL_TABLE}").fetchone()[0]
-    print(f"数据库 {DB_PATH} 共 {total} 条记录")
+    print(f"数据库 {db_path} 共 {total} 条记录")
 
-    stats = collect_stats(conn)
-    sanity = check_clean_columns(conn)
+    stats, sanity, changes = scan_placeholders(conn, scope)
     print_summary(stats, sanity)
 
     # 导出 HTML (dry-run 和正式模式都生成,方便事后查阅)
-    export_to_html(conn, stats, sanity, OUTPUT_PATH)
-    print(f"\n已导出 HTML 报告: {OUTPUT_PATH}")
+    report = export_to_html(conn, stats, sanity, OUTPUT_PATH)
+    print(f"\n已导出 HTML 报告: {report}")
+
+    collect_changes(changeset, changes)
 
     if args.dry_run:
         print(f"\n[DRY-RUN 模式] 未执行任何 UPDATE。")
+        print(f"变更集已写入: {changeset.write(plan_path(CHANGESET_STEP))} (可用 --apply 应用)")
         conn.close()
         return
 
@@ -266,10 +345,11 @@ def main():
     total_updates = sum(s['total'] for s in stats.values())
     if total_updates == 0:
         print("\n无占位符需要清理, 直接退出。")
+        record_watermark(conn, CHANGESET_STEP)
         conn.close()
         return
 
-    confirm = input(
+    confirm = "yes" if args.yes else input(
         f"\n[确认] 即将对 {len([c for c in TARGET_COLUMNS if stats[c]['total']])} 个列 "
         f"执行 UPDATE, 共 {total_updates} 行 'None' → ''.\n"
         f"请输入 'yes' 确认: "
@@ -279,32 +359,27 @@ def main():
         conn.close()
         sys.exit(0)
 
-    # 单事务执行 6 条 UPDATE
+    # 含占位符的列合并为一条 UPDATE (单次扫描, 单事务)
     print("\n[执行] 开始 UPDATE ...")
+    dirty_columns = [col for col in TARGET_COLUMNS if stats[col]['total']]
     try:
+        cur = conn.execute(build_fused_update(dirty_columns, scope))
         for col in TARGET_COLUMNS:
             cnt = stats[col]['total']
-            if cnt == 0:
-                print(f"  {col}: 跳过 (0 行)")
-                continue
-            cur = conn.execute(
-                f"UPDATE {PAYROLL_TABLE} SET {col} = '' WHERE {build_placeholder_where(col)}"
-            )
-            print(f"  {col}: {cur.rowcount} 行已更新")
+            print(f"  {col}: {f'{cnt} 个值已更新' if cnt else '跳过 (0 行)'}")
+        print(f"  共 {cur.rowcount} 行已更新")
         conn.commit()
     except Exception as e:
         conn.rollback()
         print(f"\n[错误] UPDATE 失败, 已 rollback: {e}")
         conn.close()
         sys.exit(1)
+    record_watermark(conn, CHANGESET_STEP)
 
     # 验证残留
     print("\n[验证] 检查占位符残留 ...")
     residual = 0
-    for col in TARGET_COLUMNS:
-        cnt = conn.execute(
-            f"SELECT COUNT(*) FROM {PAYROLL_TABLE} WHERE {build_placeholder_where(col)}"
-        ).fetchone()[0]
+    for col, cnt in count_placeholders(conn, TARGET_COLUMNS, scope).items():
         residual += cnt
         if cnt:
             print(f"  ❌ {col}: 仍有 {cnt} 个占位符残留!")
@@ -320,6 +395,7 @@ def main():
     # 最终行数 (理论上应与开始时一致, 没删除/插入)
     final = conn.execute(f"SELECT COUNT(*) FROM {PAYROLL_TABLE}").fetchone()[0]
     print(f"\n数据库当前总行数: {final} (修复前 {total})")
+    print(f"撤销文件: {changeset.write_undo(conn)}")
     conn.close()
 
 
@@ -3,10 +3,14 @@
 清洁工资数据库中的异常日期记录。
 
 用法:
-    python cleansing_outliers.py [--dry-run]
+    python cleansing_outliers.py [--dry-run] [--apply CHANGESET] [--yes] [--incremental] [--shard YEAR]
 
 参数:
     --dry-run  仅列出异常记录并导出到Excel，不执行删除
+    --apply CHANGESET  应用 --dry-run 写出的变更集 (或撤销文件)，不重新扫描
+    --yes      跳过 'yes' 确认提示 (非交互运行, 见 payroll_pipeline.py)
+    --incremental  只处理新文件或上次清洗后有变化的文件 (见 cleansing_watermark.py)
+    --shard YEAR  只处理该年份的分片数据库 (见 payroll_shards.py)
     无参数    执行删除操作
 """
 
@@ -16,24 +20,49 @@ import argparse
 from pathlib import Path
 from datetime import datetime
 
-import openpyxl
-from openpyxl.styles import Font, Alignment, PatternFill
+from payroll_shards import shard_db_path_for_year
+from cleansing_xlsx import XlsxExport
+from cleansing_changeset import ChangeSet, apply_changeset_file, plan_path
+from cleansing_watermark import prepare_scope, record_watermark, and_scope
+from cleansing_db_utils import bulk_delete_rowids, full_row_select
+from excel_processor.keyword_index import keyword_index_ready, keyword_rowid_filter
 
 DB_PATH = Path(__file__).parent.parent / "payroll_database.db"
 OUTPUT_PATH = Path(__file__).parent / "outliers_to_be_deleted.xlsx"
 PAYROLL_TABLE = "payroll_details"
+CHANGESET_STEP = "step1"
 
+# 日期中出现即视为异常的关键字 (与 is_outlier_date() 一致)
+OUTLIER_KEYWORDS = ['：', '月', '加班', '半天']
 
-def get_outlier_rows(conn: sqlite3.Connection) -> tuple:
-    """获取所有异常日期记录。"""
-    cursor = conn.execute(
-        f"SELECT rowid, * FROM {PAYROLL_TABLE} WHERE 日期 IS NULL OR 日期 = '' OR 日期 GLOB '*：*' OR 日期 GLOB '*月*' OR 日期 LIKE '%加班%' OR 日期 LIKE '%半天%'"
-    )
+
+def get_outlier_rows(conn: sqlite3.Connection, scope: str = None) -> tuple:
+    """
+    获取所有异常日期记录 (scope 为增量模式的文件范围条件)。
+    启用了关键字索引 (excel_processor/keyword_index.py) 时关键字部分按索引取 rowid。
+    """
+    if keyword_index_ready(conn, OUTLIER_KEYWORDS):
+        match = f"日期 IS NULL OR 日期 = '' OR {keyword_rowid_filter(OUTLIER_KEYWORDS, ['日期'])}"
+    else:
+        match = "日期 IS NULL OR 日期 = '' OR 日期 GLOB '*：*' OR 日期 GLOB '*月*' OR 日期 LIKE '%加班%' OR 日期 LIKE '%半天%'"
+    where = and_scope(match, scope)
+    cursor = conn.execute(f"SELECT {full_row_select(conn)} FROM {PAYROLL_TABLE} WHERE {where}")
     columns = [description[0] for description in cursor.description]
     rows = cursor.fetchall()
     return columns, rows
 
 
+def is_outlier_date(date_val) -> bool:
+    """
+    与 get_outlier_rows() 的 WHERE 条件等价的内存判断 (供 cleansing_engine.py 使用)。
+    GLOB/LIKE 模式均为子串匹配，这里用 in 实现。
+    """
+    if date_val is None or date_val == '':
+        return True
+    s = str(date_val)
+    return '：' in s or '月' in s or '加班' in s or '半天' in s
+
+
 def is_row_empty(row_dict: dict, columns: list) -> bool:
     """
     判断该行是否在关键字段（工序全名、工序、计件数量、系数、定额、金额、备注、代码）上都是空值或0。
@@ -78,56 +107,22 @@ def categorize_outliers(columns: list, rows: list) -> tuple:
 
 
 def export_to_excel(columns: list, real_outliers: list, possible_outliers: list, output_path: Path):
-    """导出异常记录到Excel文件，包含两个sheet。"""
-    wb = openpyxl.Workbook()
-
-    real_fill = PatternFill(start_color="F4CCCC", end_color="F4CCCC", fill_type="solid")
-    possible_fill = PatternFill(start_color="FFF2CC", end_color="FFF2CC", fill_type="solid")
-    header_fill = PatternFill(start_color="4472C4", end_color="4472C4", fill_type="solid")
-    header_font = Font(bold=True, color="FFFFFF")
-
-    def write_sheet(ws, data, sheet_name, row_fill):
-        ws.title = sheet_name
-
-        for col_idx, col_name in enumerate(columns, start=1):
-            cell = ws.cell(row=1, column=col_idx, value=col_name)
-            cell.fill = header_fill
-            cell.font = header_font
-            cell.alignment = Alignment(horizontal="center")
-
-        for row_idx, row in enumerate(data, start=2):
-            for col_idx, value in enumerate(row, start=1):
-                cell = ws.cell(row=row_idx, column=col_idx, value=value)
-                cell.fill = row_fill
-
-        for col_idx in range(1, len(columns) + 1):
-            ws.column_dimensions[openpyxl.utils.get_column_letter(col_idx)].width = 15
-
-        ws.column_dimensions["A"].width = 8
-        ws.column_dimensions["C"].width = 12
-        ws.column_dimensions["E"].width = 20
-
-    ws1 = wb.active
-    write_sheet(ws1, real_outliers, "real_outliers", real_fill)
-
-    ws2 = wb.create_sheet(title="possible_outliers")
-    write_sheet(ws2, possible_outliers, possible_outliers and "possible_outliers" or "possible_outliers", possible_fill)
-
-    wb.save(str(output_path))
+    """导出异常记录到Excel文件，包含两个sheet (write-only 流式写入, 见 cleansing_xlsx.py)。"""
+    widths = {"A": 8, "C": 12, "E": 20}
+    with XlsxExport(output_path) as xlsx:
+        xlsx.add_fill_style("real_outlier", "F4CCCC")
+        xlsx.add_fill_style("possible_outlier", "FFF2CC")
+        xlsx.sheet("real_outliers", columns, real_outliers, row_style="real_outlier", widths=widths)
+        xlsx.sheet("possible_outliers", columns, possible_outliers, row_style="possible_outlier", widths=widths)
 
 
 def delete_outliers(conn: sqlite3.Connection, rows: list) -> int:
     """删除异常记录，返回删除的行数。"""
     if not rows:
         return 0
-    rowids = [row[0] for row in rows]
-    placeholders = ",".join("?" * len(rowids))
-    cursor = conn.execute(
-        f"DELETE FROM {PAYROLL_TABLE} WHERE rowid IN ({placeholders})",
-        rowids
-    )
+    deleted_count = bulk_delete_rowids(conn, [row[0] for row in rows])
     conn.commit()
-    return cursor.rowcount
+    return deleted_count
 
 
 def summarize_outliers(columns: list, rows: list) -> dict:
@@ -194,7 +189,7 @@ def print_summary(summary: dict):
     print("=" * 60)
 
 
-def main():
+def main(argv=None):
     parser = argparse.ArgumentParser(
         description="清洁工资数据库中的异常日期记录"
     )
@@ -203,18 +198,45 @@ def main():
         action="store_true",
         help="仅列出异常记录并导出到Excel，不执行删除"
     )
-    args = parser.parse_args()
+    parser.add_argument(
+        "--apply",
+        metavar="CHANGESET",
+        help="应用 --dry-run 写出的变更集文件 (或撤销文件)，不重新扫描"
+    )
+    parser.add_argument(
+        "--yes",
+        action="store_true",
+        help="跳过 'yes' 确认提示 (供 payroll_pipeline.py 等非交互调用)"
+    )
+    parser.add_argument(
+        "--incremental",
+        action="store_true",
+        help="只处理新文件或上次清洗后有变化的文件 (按 文件名 记录的水位, 见 cleansing_watermark.py)"
+    )
+    parser.add_argument(
+        "--shard",
+        help="只处理指定年份的分片数据库 (见 payroll_shards.py)，如 2025"
+    )
+    args = parser.parse_args(argv)
+    db_path = shard_db_path_for_year(args.shard) if args.shard else DB_PATH
 
-    if not DB_PATH.exists():
-        print(f"错误: 数据库文件不存在: {DB_PATH}")
+    if not db_path.exists():
+        print(f"错误: 数据库文件不存在: {db_path}")
         sys.exit(1)
 
-    conn = sqlite3.connect(str(DB_PATH))
+    if args.apply:
+        sys.exit(apply_changeset_file(db_path, args.apply, CHANGESET_STEP, args.yes))
+
+    conn = sqlite3.connect(str(db_path))
+    changeset = ChangeSet.capture(conn, CHANGESET_STEP)
+    scope = prepare_scope(conn, CHANGESET_STEP) if args.incremental else None
 
-    columns, rows = get_outlier_rows(conn)
+    columns, rows = get_outlier_rows(conn, scope)
 
     if not rows:
         print("未找到异常记录。")
+        if not args.dry_run:
+            record_watermark(conn, CHANGESET_STEP)
         conn.close()
         sys.exit(0)
 
@@ -232,18 +254,24 @@ def main():
         cursor = conn.execute(f"SELECT COUNT(*) FROM {PAYROLL_TABLE}")
         return cursor.fetchone()[0]
 
+    for row in real_outliers:
+        changeset.add_delete(row)
+
     if args.dry_run:
         print("\n[DRY-RUN 模式] 未执行删除操作。")
+        print(f"变更集已写入: {changeset.write(plan_path(CHANGESET_STEP))} (可用 --apply 应用)")
     else:
         before_count = count_table_records(conn)
         print(f"\n[确认删除] 数据库当前共有 {before_count} 条记录")
         print(f"[确认删除] 即将删除 {len(real_outliers)} 条 real_outliers 记录...")
-        confirm = input("请输入 'yes' 确认删除: ")
+        confirm = "yes" if args.yes else input("请输入 'yes' 确认删除: ")
         if confirm.strip().lower() == "yes":
             deleted_count = delete_outliers(conn, real_outliers)
+            record_watermark(conn, CHANGESET_STEP)
             after_count = count_table_records(conn)
             print(f"已成功删除 {deleted_count} 条记录。")
             print(f"删除后数据库共有 {after_count} 条记录。")
+            print(f"撤销文件: {changeset.write_undo(conn)}")
         else:
             print("已取消删除操作。")
 
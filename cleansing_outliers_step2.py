@@ -3,13 +3,19 @@
 清洁工资数据库中的异常日期记录 - Step 2。
 
 使用前向填充(ffill)方法，根据 文件名、sheet名、职员全名 分组，
-填充日期为空的记录。
+填充日期为空的记录。分组和填充用 SQLite 窗口函数在数据库内完成
+(按 rowid 排序的分区内取前面最后一个非空日期的行)，Python 只读取
+被填充的行和来源行，再一次批量写回。
 
 用法:
-    python cleansing_outliers_step2.py [--dry-run]
+    python cleansing_outliers_step2.py [--dry-run] [--apply CHANGESET] [--yes] [--incremental] [--shard YEAR]
 
 参数:
     --dry-run  仅预览填充结果，不执行更新
+    --apply CHANGESET  应用 --dry-run 写出的变更集 (或撤销文件)，不重新扫描
+    --yes      --apply 时跳过 'yes' 确认提示 (非交互运行)
+    --incremental  只处理新文件或上次清洗后有变化的文件 (见 cleansing_watermark.py)
+    --shard YEAR  只处理该年份的分片数据库 (见 payroll_shards.py)
     无参数    执行填充操作
 """
 
@@ -18,29 +24,96 @@ import sys
 import argparse
 from pathlib import Path
 
+from payroll_shards import shard_db_path_for_year
+from cleansing_changeset import ChangeSet, apply_changeset_file, plan_path
+from cleansing_watermark import prepare_scope, record_watermark, and_scope
+from cleansing_db_utils import bulk_update_column, iter_rows, fetch_full_rows, full_row_columns
+
 DB_PATH = Path(__file__).parent.parent / "payroll_database.db"
 PAYROLL_TABLE = "payroll_details"
 
+# 窗口函数需要 SQLite 3.25.0 (旧版本退回流式读取 + compute_filled_records)
+HAS_WINDOW_FUNCTIONS = sqlite3.sqlite_version_info >= (3, 25, 0)
+
+# str.strip() 去除的全部空白字符 (SQLite trim() 默认只去除空格)
+PY_WHITESPACE = "".join(chr(c) for c in range(0x110000) if chr(c).isspace())
+CHANGESET_STEP = "step2"
+
 
-def fill_blank_dates(conn: sqlite3.Connection, dry_run: bool = False) -> list:
+def fill_blank_dates(conn: sqlite3.Connection, dry_run: bool = False, scope: str = None) -> list:
     """
     按 文件名、sheet名、职员全名 分组，对每组内的日期空白行进行前向填充。
-    返回填充记录的列表，每项为 (filled_row, source_row)。
+    返回填充记录的列表，每项为 (filled_row, source_row) 完整记录 (填充前)。
+    scope 为增量模式的文件范围条件 (按 文件名 划分, 分组总是完整的)。
     """
-    cursor = conn.execute(f"SELECT rowid, * FROM {PAYROLL_TABLE}")
-    columns = [description[0] for description in cursor.description]
-    all_rows = cursor.fetchall()
-
-    if not all_rows:
-        print("数据库为空。")
+    if HAS_WINDOW_FUNCTIONS:
+        # 分组、填充都在 SQLite 中完成, Python 只拿到 (填充行, 来源行) 的 rowid
+        pairs = find_filled_pairs(conn, scope)
+    else:
+        # 分组和填充只需要这几列; 完整记录只为打印的填充记录按需读取
+        read_columns = ["文件名", "sheet名", "职员全名", "日期"]
+        columns = ["rowid"] + read_columns
+        all_rows = list(iter_rows(conn, read_columns, where=scope))
+        pairs = [(row[0], prev_row[0]) for row, prev_row in compute_filled_records(columns, all_rows)]
+        del all_rows
+
+    if not pairs:
         return []
 
+    columns, full_rows = fetch_full_rows(
+        conn, [rowid for pair in pairs for rowid in pair]
+    )
+
+    if not dry_run:
+        date_idx = columns.index("日期")
+        bulk_update_column(
+            conn, '日期', [(full_rows[source_rowid][date_idx], rowid) for rowid, source_rowid in pairs]
+        )
+        conn.commit()
+
+    return [(full_rows[rowid], full_rows[source_rowid]) for rowid, source_rowid in pairs]
+
+
+def find_filled_pairs(conn: sqlite3.Connection, scope: str = None) -> list:
+    """
+    用窗口函数求出需要填充的 (rowid, 来源 rowid)，顺序与 compute_filled_records() 相同:
+    - 组内按 rowid 排序，来源为该行之前最后一个日期非空的行 (即前面非空行的最大 rowid)；
+    - 日期 "为空" 与 str(日期).strip() == "" 等价 (trim 使用 Python 的空白字符集)；
+    - 各组按 (文件名, sheet名, 职员全名) 排序 (NULL 视为 '')，排序值相同的组按首行 rowid。
+    """
+    where = f"WHERE {scope}" if scope else ""
+    cursor = conn.execute(f"""
+        WITH marked AS (
+            SELECT rowid AS rid, 文件名, sheet名, 职员全名,
+                   日期 IS NULL OR trim(日期, :ws) = '' AS is_blank
+            FROM {PAYROLL_TABLE} {where}
+        ),
+        filled AS (
+            SELECT rid, 文件名, sheet名, 职员全名, is_blank,
+                   MAX(CASE WHEN is_blank THEN NULL ELSE rid END) OVER (
+                       PARTITION BY 文件名, sheet名, 职员全名 ORDER BY rid
+                       ROWS BETWEEN UNBOUNDED PRECEDING AND CURRENT ROW
+                   ) AS source_rid,
+                   MIN(rid) OVER (PARTITION BY 文件名, sheet名, 职员全名) AS group_first
+            FROM marked
+        )
+        SELECT rid, source_rid FROM filled
+        WHERE is_blank AND source_rid IS NOT NULL
+        ORDER BY IFNULL(文件名, ''), IFNULL(sheet名, ''), IFNULL(职员全名, ''), group_first, rid
+    """, {"ws": PY_WHITESPACE})
+    return cursor.fetchall()
+
+
+def compute_filled_records(columns: list, all_rows: list) -> list:
+    """
+    fill_blank_dates() 的纯内存部分，不访问数据库 (cleansing_engine.py 也复用此函数)。
+    返回 (filled_row, source_row) 列表，filled_row 的日期应设为 source_row 的日期。
+    """
     col_indices = {col: idx for idx, col in enumerate(columns)}
     filename_idx = col_indices["文件名"]
     sheetname_idx = col_indices["sheet名"]
     employeename_idx = col_indices["职员全名"]
     date_idx = col_indices["日期"]
-    rowid_idx = col_indices["rowid"]
 
     all_rows_sorted = sorted(all_rows, key=lambda r: (
         r[filename_idx] or "",
@@ -65,18 +138,9 @@ def fill_blank_dates(conn: sqlite3.Connection, dry_run: bool = False) -> list:
                     source_date = prev_row[date_idx]
                     if source_date is not None and str(source_date).strip() != "":
                         filled_records.append((row, prev_row))
-                        if not dry_run:
-                            rowid = row[rowid_idx]
-                            conn.execute(
-                                f"UPDATE {PAYROLL_TABLE} SET 日期 = ? WHERE rowid = ?",
-                                (source_date, rowid)
-                            )
             else:
                 prev_row = row
 
-    if not dry_run:
-        conn.commit()
-
     return filled_records
 
 
@@ -108,7 +172,7 @@ def print_filled_records(columns: list, filled_records: list):
     print("=" * 120)
 
 
-def main():
+def main(argv=None):
     parser = argparse.ArgumentParser(
         description="清洁工资数据库中的异常日期记录 - Step 2 (前向填充)"
     )
@@ -117,32 +181,67 @@ def main():
         action="store_true",
         help="仅预览填充结果，不执行更新"
     )
-    args = parser.parse_args()
+    parser.add_argument(
+        "--apply",
+        metavar="CHANGESET",
+        help="应用 --dry-run 写出的变更集文件 (或撤销文件)，不重新扫描"
+    )
+    parser.add_argument(
+        "--yes",
+        action="store_true",
+        help="--apply 时跳过 'yes' 确认提示 (本步骤正常运行时没有确认提示)"
+    )
+    parser.add_argument(
+        "--incremental",
+        action="store_true",
+        help="只处理新文件或上次清洗后有变化的文件 (按 文件名 记录的水位, 见 cleansing_watermark.py)"
+    )
+    parser.add_argument(
+        "--shard",
+        help="只处理指定年份的分片数据库 (见 payroll_shards.py)，如 2025"
+    )
+    args = parser.parse_args(argv)
+    db_path = shard_db_path_for_year(args.shard) if args.shard else DB_PATH
 
-    if not DB_PATH.exists():
-        print(f"错误: 数据库文件不存在: {DB_PATH}")
+    if not db_path.exists():
+        print(f"错误: 数据库文件不存在: {db_path}")
         sys.exit(1)
 
-    conn = sqlite3.connect(str(DB_PATH))
+    if args.apply:
+        sys.exit(apply_changeset_file(db_path, args.apply, CHANGESET_STEP, args.yes))
 
-    cursor = conn.execute(f"SELECT rowid, * FROM {PAYROLL_TABLE} WHERE 日期 IS NULL OR 日期 = ''")
-    columns = [description[0] for description in cursor.description]
-    rows = cursor.fetchall()
-    blank_count = len(rows)
+    conn = sqlite3.connect(str(db_path))
+    changeset = ChangeSet.capture(conn, CHANGESET_STEP)
+    scope = prepare_scope(conn, CHANGESET_STEP) if args.incremental else None
+
+    blank_where = and_scope("日期 IS NULL OR 日期 = ''", scope)
+    blank_count = conn.execute(
+        f"SELECT COUNT(*) FROM {PAYROLL_TABLE} WHERE {blank_where}"
+    ).fetchone()[0]
 
     print(f"找到 {blank_count} 条日期为空的记录。")
 
     if blank_count == 0:
+        if not args.dry_run:
+            record_watermark(conn, CHANGESET_STEP)
         conn.close()
         sys.exit(0)
 
-    filled_records = fill_blank_dates(conn, dry_run=args.dry_run)
+    filled_records = fill_blank_dates(conn, dry_run=args.dry_run, scope=scope)
     filled_count = len(filled_records)
 
+    columns = full_row_columns(conn)
+    date_idx = columns.index("日期")
+    for filled_row, source_row in filled_records:
+        changeset.add_update('日期', filled_row[0], filled_row[date_idx], source_row[date_idx])
+
     if args.dry_run:
         print(f"\n[DRY-RUN 模式] 预览: 本次可填充 {filled_count} 条记录。")
+        print(f"变更集已写入: {changeset.write(plan_path(CHANGESET_STEP))} (可用 --apply 应用)")
     else:
+        record_watermark(conn, CHANGESET_STEP)
         print(f"\n已成功填充 {filled_count} 条记录。")
+        print(f"撤销文件: {changeset.write_undo(conn)}")
 
     if filled_count > 0:
         print_filled_records(columns, filled_records)
@@ -5,10 +5,14 @@
 删除包含"合计"的汇总行，这些行是各职员的小计/合计记录，不属于个人工资明细。
 
 用法:
-    python cleansing_outliers_step3.py [--dry-run]
+    python cleansing_outliers_step3.py [--dry-run] [--apply CHANGESET] [--yes] [--incremental] [--shard YEAR]
 
 参数:
     --dry-run  仅导出到Excel，不执行删除
+    --apply CHANGESET  应用 --dry-run 写出的变更集 (或撤销文件)，不重新扫描
+    --yes      跳过 'yes' 确认提示 (非交互运行, 见 payroll_pipeline.py)
+    --incremental  只处理新文件或上次清洗后有变化的文件 (见 cleansing_watermark.py)
+    --shard YEAR  只处理该年份的分片数据库 (见 payroll_shards.py)
     无参数    执行删除操作
 """
 
@@ -21,71 +25,69 @@ from datetime import datetime
 import openpyxl
 from openpyxl.styles import Font, Alignment, PatternFill
 
+from payroll_shards import shard_db_path_for_year
+from cleansing_report import HtmlReport
+from cleansing_changeset import ChangeSet, apply_changeset_file, plan_path
+from cleansing_watermark import prepare_scope, record_watermark, and_scope
+from cleansing_db_utils import bulk_delete_rowids, full_row_columns, full_row_select
+from excel_processor.keyword_index import keyword_index_ready, keyword_rowid_filter
+
 DB_PATH = Path(__file__).parent.parent / "payroll_database.db"
 OUTPUT_PATH = Path(__file__).parent / "outliers_to_be_deleted_step3.html"
 PAYROLL_TABLE = "payroll_details"
+CHANGESET_STEP = "step3"
 
 
-def get_rows_with_合计(conn: sqlite3.Connection) -> tuple:
-    """获取所有包含'合计'的记录。"""
-    cursor = conn.execute(f"SELECT rowid, * FROM {PAYROLL_TABLE}")
-    columns = [description[0] for description in cursor.description]
-    all_rows = cursor.fetchall()
+def text_columns(columns: list) -> list:
+    """需要检查'合计'的文本列 (排除 rowid 和 4 个数值列)。"""
+    return [c for c in columns if c not in ['rowid', '计件数量', '系数', '定额', '金额']]
+
+
+def find_rows_with_合计(columns: list, all_rows: list) -> list:
+    """与 get_rows_with_合计() 的 WHERE 条件等价的内存过滤 (供 cleansing_engine.py 使用)。"""
+    text_idx = [columns.index(c) for c in text_columns(columns)]
+    return [
+        row for row in all_rows
+        if any(row[i] is not None and '合计' in str(row[i]) for i in text_idx)
+    ]
+
+
+def get_rows_with_合计(conn: sqlite3.Connection, scope: str = None) -> tuple:
+    """
+    获取所有包含'合计'的记录 (scope 为增量模式的文件范围条件)。
+    启用了关键字索引 (excel_processor/keyword_index.py) 时按索引取 rowid,
+    否则对每个文本列 LIKE '%合计%' (全表扫描)。
+    """
+    # 只需要列名 (PRAGMA table_xinfo), 不读取数据
+    columns = full_row_columns(conn)
 
-    text_cols = [c for c in columns if c not in ['rowid', '计件数量', '系数', '定额', '金额']]
-    conditions = ' OR '.join([f"{col} LIKE '%合计%'" for col in text_cols])
+    if keyword_index_ready(conn, ['合计']):
+        match = keyword_rowid_filter(['合计'])
+    else:
+        match = ' OR '.join([f"{col} LIKE '%合计%'" for col in text_columns(columns)])
+    conditions = and_scope(match, scope)
 
-    cursor = conn.execute(f"SELECT rowid, * FROM {PAYROLL_TABLE} WHERE {conditions}")
+    cursor = conn.execute(f"SELECT {full_row_select(conn)} FROM {PAYROLL_TABLE} WHERE {conditions}")
     columns = [description[0] for description in cursor.description]
     rows = cursor.fetchall()
     return columns, rows
 
 
-def export_to_html(columns: list, rows: list, output_path: Path):
-    """导出包含'合计'的记录到HTML文件。"""
-    html = f'''<!DOCTYPE html>
-<html>
-<head>
-<meta charset="UTF-8">
-<title>Outliers to be deleted - 包含合计的记录</title>
-<style>
-table {{ border-collapse: collapse; font-size: 12px; }}
-th, td {{ border: 1px solid #ddd; padding: 8px; }}
-th {{ background-color: #4472C4; color: white; position: sticky; top: 0; }}
-tr:nth-child(even) {{ background-color: #f2f2f2; }}
-tr:hover {{ background-color: #ddd; }}
-td {{ max-width: 200px; overflow: hidden; text-overflow: ellipsis; white-space: nowrap; }}
-</style>
-</head>
-<body>
-<h1>Found {len(rows)} rows containing 合计</h1>
-<table>
-<tr>{''.join(f'<th>{c}</th>' for c in columns)}</tr>
-'''
-    for row in rows:
-        html += '<tr>' + ''.join(f'<td>{str(v) if v is not None else ""}</td>' for v in row) + '</tr>'
-
-    html += '''
-</table>
-</body>
-</html>'''
-
-    with open(output_path, 'w', encoding='utf-8') as f:
-        f.write(html)
+def export_to_html(columns: list, rows: list, output_path: Path) -> Path:
+    """导出包含'合计'的记录到HTML文件 (流式写入, 见 cleansing_report.py)，返回实际写入的文件。"""
+    with HtmlReport(output_path, "Outliers to be deleted - 包含合计的记录") as report:
+        report.write(f"<h1>Found {len(rows)} rows containing 合计</h1>\n")
+        report.table(columns, rows)
+    return report.path
 
 
 def delete_rows(conn: sqlite3.Connection, rows: list) -> int:
     """删除指定记录，返回删除的行数。"""
     if not rows:
         return 0
-    rowids = [row[0] for row in rows]
-    placeholders = ",".join("?" * len(rowids))
-    cursor = conn.execute(
-        f"DELETE FROM {PAYROLL_TABLE} WHERE rowid IN ({placeholders})",
-        rowids
-    )
+    deleted_count = bulk_delete_rowids(conn, [row[0] for row in rows])
     conn.commit()
-    return cursor.rowcount
+    return deleted_count
 
 
 def summarize_by_file(columns: list, rows: list) -> dict:
@@ -98,7 +100,7 @@ def summarize_by_file(columns: list, rows: list) -> dict:
     return summary
 
 
-def main():
+def main(argv=None):
     parser = argparse.ArgumentParser(
         description="清洁工资数据库中的异常记录 - Step 3 (删除含'合计'的汇总行)"
     )
@@ -107,18 +109,45 @@ def main():
         action="store_true",
         help="仅导出到HTML，不执行删除"
     )
-    args = parser.parse_args()
+    parser.add_argument(
+        "--apply",
+        metavar="CHANGESET",
+        help="应用 --dry-run 写出的变更集文件 (或撤销文件)，不重新扫描"
+    )
+    parser.add_argument(
+        "--yes",
+        action="store_true",
+        help="跳过 'yes' 确认提示 (供 payroll_pipeline.py 等非交互调用)"
+    )
+    parser.add_argument(
+        "--incremental",
+        action="store_true",
+        help="只处理新文件或上次清洗后有变化的文件 (按 文件名 记录的水位, 见 cleansing_watermark.py)"
+    )
+    parser.add_argument(
+        "--shard",
+        help="只处理指定年份的分片数据库 (见 payroll_shards.py)，如 2025"
+    )
+    args = parser.parse_args(argv)
+    db_path = shard_db_path_for_year(args.shard) if args.shard else DB_PATH
 
-    if not DB_PATH.exists():
-        print(f"错误: 数据库文件不存在: {DB_PATH}")
+    if not db_path.exists():
+        print(f"错误: 数据库文件不存在: {db_path}")
         sys.exit(1)
 
-    conn = sqlite3.connect(str(DB_PATH))
+    if args.apply:
+        sys.exit(apply_changeset_file(db_path, args.apply, CHANGESET_STEP, args.yes))
 
-    columns, rows = get_rows_with_合计(conn)
+    conn = sqlite3.connect(str(db_path))
+    changeset = ChangeSet.capture(conn, CHANGESET_STEP)
+    scope = prepare_scope(conn, CHANGESET_STEP) if args.incremental else None
+
+    columns, rows = get_rows_with_合计(conn, scope)
 
     if not rows:
         print("未找到包含'合计'的记录。")
+        if not args.dry_run:
+            record_watermark(conn, CHANGESET_STEP)
         conn.close()
         sys.exit(0)
 
@@ -131,25 +160,31 @@ def main():
         print(f"  - {fname}: {count}")
 
     # 导出到HTML
-    export_to_html(columns, rows, OUTPUT_PATH)
-    print(f"\n已导出到: {OUTPUT_PATH}")
+    report = export_to_html(columns, rows, OUTPUT_PATH)
+    print(f"\n已导出到: {report}")
 
     def count_table_records(conn):
         cursor = conn.execute(f"SELECT COUNT(*) FROM {PAYROLL_TABLE}")
         return cursor.fetchone()[0]
 
+    for row in rows:
+        changeset.add_delete(row)
+
     if args.dry_run:
         print("\n[DRY-RUN 模式] 未执行删除操作。")
+        print(f"变更集已写入: {changeset.write(plan_path(CHANGESET_STEP))} (可用 --apply 应用)")
     else:
         before_count = count_table_records(conn)
         print(f"\n[确认删除] 数据库当前共有 {before_count} 条记录")
         print(f"[确认删除] 即将删除 {len(rows)} 条包含'合计'的记录...")
-        confirm = input("请输入 'yes' 确认删除: ")
+        confirm = "yes" if args.yes else input("请输入 'yes' 确认删除: ")
         if confirm.strip().lower() == "yes":
             deleted_count = delete_rows(conn, rows)
+            record_watermark(conn, CHANGESET_STEP)
             after_count = count_table_records(conn)
             print(f"已成功删除 {deleted_count} 条记录。")
             print(f"删除后数据库共有 {after_count} 条记录。")
+            print(f"撤销文件: {changeset.write_undo(conn)}")
         else:
             print("已取消删除操作。")
 
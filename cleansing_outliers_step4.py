@@ -4,12 +4,17 @@
 
 将郁俊海的月份日期记录（如"4月"、"三月"、"7月份"）转换为该月份的第一个工作日。
 工作日判断：周一至周五，且不是中国法定节假日。
+每月第一个工作日在运行开始时按文件年份一次性算好 (见 cleansing_calendar.py)，逐行只查字典。
 
 用法:
-    python cleansing_outliers_step4.py [--dry-run]
+    python cleansing_outliers_step4.py [--dry-run] [--apply CHANGESET] [--yes] [--incremental] [--shard YEAR]
 
 参数:
     --dry-run  仅预览，不执行更新
+    --apply CHANGESET  应用 --dry-run 写出的变更集 (或撤销文件)，不重新扫描
+    --yes      跳过 'yes' 确认提示 (非交互运行, 见 payroll_pipeline.py)
+    --incremental  只处理新文件或上次清洗后有变化的文件 (见 cleansing_watermark.py)
+    --shard YEAR  只处理该年份的分片数据库 (见 payroll_shards.py)
     无参数    执行更新操作
 """
 
@@ -18,87 +23,41 @@ import sys
 import argparse
 import re
 from pathlib import Path
-from datetime import date, timedelta
+from datetime import date
 
-try:
-    import holidays
-    HAS_HOLIDAYS = True
-except ImportError:
-    HAS_HOLIDAYS = False
+from payroll_shards import shard_db_path_for_year
+from cleansing_report import HtmlReport
+from cleansing_changeset import ChangeSet, apply_changeset_file, plan_path
+from cleansing_watermark import prepare_scope, record_watermark, and_scope
+from cleansing_db_utils import bulk_update_column, full_row_columns, full_row_select
+from cleansing_calendar import HAS_HOLIDAYS, get_calendar, load_calendar
 
 DB_PATH = Path(__file__).parent.parent / "payroll_database.db"
 OUTPUT_PATH = Path(__file__).parent / "outliers_to_be_updated_step4.html"
 PAYROLL_TABLE = "payroll_details"
+CHANGESET_STEP = "step4"
 
 
-def export_to_html(columns: list, rows_with_new_date: list, output_path: Path):
-    """导出需要更新的记录到HTML文件。"""
-    # Get all columns from payroll_details
-    html = f'''<!DOCTYPE html>
-<html>
-<head>
-<meta charset="UTF-8">
-<title>Outliers to be updated - Step 4 月份日期转工作日</title>
-<style>
-table {{ border-collapse: collapse; font-size: 12px; }}
-th, td {{ border: 1px solid #ddd; padding: 8px; }}
-th {{ background-color: #4472C4; color: white; position: sticky; top: 0; }}
-tr:nth-child(even) {{ background-color: #f2f2f2; }}
-tr:hover {{ background-color: #ddd; }}
-td {{ max-width: 200px; overflow: hidden; text-overflow: ellipsis; white-space: nowrap; }}
-</style>
-</head>
-<body>
-<h1>Step 4 - 郁俊海月份日期记录更新</h1>
-<p>共 {len(rows_with_new_date)} 条记录将被更新</p>
-<table>
-<tr><th>原日期</th><th>新日期</th><th>说明</th>''' + ''.join(f'<th>{c}</th>' for c in columns) + '''</tr>
-'''
-    for old_date, new_date_str, note, row in rows_with_new_date:
-        html += '<tr>'
-        html += f'<td>{old_date}</td>'
-        html += f'<td>{new_date_str}</td>'
-        html += f'<td>{note}</td>'
-        html += ''.join(f'<td>{str(v) if v is not None else ""}</td>' for v in row)
-        html += '</tr>'
-
-    html += '''
-</table>
-</body>
-</html>'''
-
-    with open(output_path, 'w', encoding='utf-8') as f:
-        f.write(html)
-
-
-def get_china_holidays(year: int):
-    """获取指定年份的中国法定节假日。"""
-    if not HAS_HOLIDAYS:
-        return set()
-    return holidays.China(years=year)
+def export_to_html(columns: list, rows_with_new_date: list, output_path: Path) -> Path:
+    """导出需要更新的记录到HTML文件 (流式写入, 见 cleansing_report.py)，返回实际写入的文件。"""
+    with HtmlReport(output_path, "Outliers to be updated - Step 4 月份日期转工作日") as report:
+        report.write(
+            f"<h1>Step 4 - 郁俊海月份日期记录更新</h1>\n"
+            f"<p>共 {len(rows_with_new_date)} 条记录将被更新</p>\n"
+        )
+        report.table(
+            ["原日期", "新日期", "说明"] + list(columns),
+            ([old_date, new_date_str, note, *row] for old_date, new_date_str, note, row in rows_with_new_date),
+        )
+    return report.path
 
 
 def get_first_working_day(year: int, month: int) -> date:
     """
     获取指定年月的第一个工作日。
-    工作日 = 周一至周五 且 不是法定节假日
+    工作日 = 周一至周五 且 不是法定节假日 (预计算日历查询, 见 cleansing_calendar.py)
     """
-    cn_holidays = get_china_holidays(year)
-
-    # Start from the first day of the month
-    current = date(year, month, 1)
-
-    # If it's a holiday, move to next day
-    # Keep going until we find a weekday (Mon-Fri) that's not a holiday
-    max_days = 31  # Safety limit
-
-    for _ in range(max_days):
-        # Check if it's a weekday (0=Monday, 5=Saturday, 6=Sunday)
-        if current.weekday() < 5 and current not in cn_holidays:
-            return current
-        current += timedelta(days=1)
-
-    return current  # Fallback
+    return get_calendar().first_working_day(year, month)
 
 
 def parse_month_pattern(date_str: str) -> tuple:
@@ -127,37 +86,61 @@ def parse_month_pattern(date_str: str) -> tuple:
     return None
 
 
-def get_target_date(file_name: str, date_str: str) -> str:
+def get_records_to_update_full(conn: sqlite3.Connection, scope: str = None) -> tuple:
+    """获取所有需要更新的郁俊海的月份记录的完整信息 (scope 为增量模式的文件范围条件)。"""
+    columns = full_row_columns(conn)
+
+    where = and_scope("职员全名 = '郁俊海' AND (日期 LIKE '%月' OR 日期 LIKE '%月份')", scope)
+    cursor = conn.execute(f"""
+        SELECT {full_row_select(conn)} FROM {PAYROLL_TABLE}
+        WHERE {where}
+    """)
+    rows = cursor.fetchall()
+    return columns, rows
+
+
+def find_month_date_rows(columns: list, all_rows: list) -> list:
+    """与 get_records_to_update_full() 的 WHERE 条件等价的内存过滤 (供 cleansing_engine.py 使用)。"""
+    name_idx = columns.index('职员全名')
+    date_idx = columns.index('日期')
+    return [
+        row for row in all_rows
+        if row[name_idx] == '郁俊海' and row[date_idx] is not None
+        and (str(row[date_idx]).endswith('月') or str(row[date_idx]).endswith('月份'))
+    ]
+
+
+def compute_month_updates(columns: list, rows: list) -> tuple:
     """
-    根据文件名和日期字符串计算目标日期。
-    返回格式: 该月份第一个工作日的"日"（即天数的字符串，如"3"）
+    计算每条月份记录的目标日期，不访问数据库。
+    返回 (updates, rows_with_new_date)，updates 为 (新日期, rowid) 列表，
+    rows_with_new_date 为 (原日期, 新日期, 说明, row) 列表 (用于 HTML 报告)。
     """
-    # Extract year from file name like "202504.xls"
-    year = int(file_name[:4])
+    updates = []
+    rows_with_new_date = []
+    fname_idx = columns.index('文件名')
+    date_idx = columns.index('日期')
 
-    month = parse_month_pattern(date_str)
-    if month is None:
-        return None
+    for row in rows:
+        rowid = row[0]
+        fname = row[fname_idx]
+        old_date = row[date_idx]
 
-    first_working_day = get_first_working_day(year, month)
-    return str(first_working_day.day)  # Return just the day number
+        month = parse_month_pattern(old_date)
+        if month is not None:
+            first_wd = get_first_working_day(int(fname[:4]), month)
+            new_date = str(first_wd.day)
+            note = first_wd.strftime('%Y-%m-%d') + " (first working day)"
 
+            updates.append((new_date, rowid))
+            rows_with_new_date.append((old_date, new_date, note, row))
+        else:
+            rows_with_new_date.append((old_date, "N/A", "无法解析月份", row))
 
-def get_records_to_update_full(conn: sqlite3.Connection) -> tuple:
-    """获取所有需要更新的郁俊海的月份记录的完整信息。"""
-    cursor = conn.execute(f"SELECT rowid, * FROM {PAYROLL_TABLE} WHERE 1=0")
-    columns = [desc[0] for desc in cursor.description]
+    return updates, rows_with_new_date
 
-    cursor = conn.execute(f"""
-        SELECT rowid, * FROM {PAYROLL_TABLE}
-        WHERE 职员全名 = '郁俊海'
-        AND (日期 LIKE '%月' OR 日期 LIKE '%月份')
-    """)
-    rows = cursor.fetchall()
-    return columns, rows
 
-
-def main():
+def main(argv=None):
     parser = argparse.ArgumentParser(
         description="清洁工资数据库中的异常记录 - Step 4 (月份日期转工作日)"
     )
@@ -166,22 +149,50 @@ def main():
         action="store_true",
         help="仅预览更新结果，不执行更新"
     )
-    args = parser.parse_args()
+    parser.add_argument(
+        "--apply",
+        metavar="CHANGESET",
+        help="应用 --dry-run 写出的变更集文件 (或撤销文件)，不重新扫描"
+    )
+    parser.add_argument(
+        "--yes",
+        action="store_true",
+        help="跳过 'yes' 确认提示 (供 payroll_pipeline.py 等非交互调用)"
+    )
+    parser.add_argument(
+        "--incremental",
+        action="store_true",
+        help="只处理新文件或上次清洗后有变化的文件 (按 文件名 记录的水位, 见 cleansing_watermark.py)"
+    )
+    parser.add_argument(
+        "--shard",
+        help="只处理指定年份的分片数据库 (见 payroll_shards.py)，如 2025"
+    )
+    args = parser.parse_args(argv)
+    db_path = shard_db_path_for_year(args.shard) if args.shard else DB_PATH
 
-    if not DB_PATH.exists():
-        print(f"错误: 数据库文件不存在: {DB_PATH}")
+    if not db_path.exists():
+        print(f"错误: 数据库文件不存在: {db_path}")
         sys.exit(1)
 
+    if args.apply:
+        sys.exit(apply_changeset_file(db_path, args.apply, CHANGESET_STEP, args.yes))
+
     if not HAS_HOLIDAYS:
         print("警告: holidays 模块未安装，将使用简单的周末判断（不考虑法定节假日）")
         print("      请运行: pip install holidays")
 
-    conn = sqlite3.connect(str(DB_PATH))
+    conn = sqlite3.connect(str(db_path))
+    changeset = ChangeSet.capture(conn, CHANGESET_STEP)
+    scope = prepare_scope(conn, CHANGESET_STEP) if args.incremental else None
 
-    columns, rows = get_records_to_update_full(conn)
+    columns, rows = get_records_to_update_full(conn, scope)
+    load_calendar(conn)
 
     if not rows:
         print("未找到需要更新的月份记录。")
+        if not args.dry_run:
+            record_watermark(conn, CHANGESET_STEP)
         conn.close()
         sys.exit(0)
 
@@ -189,41 +200,31 @@ def main():
     print(f"\n当前 holidays 模块: {'已安装' if HAS_HOLIDAYS else '未安装'}")
 
     # Calculate updates and prepare HTML data
-    updates = []
-    rows_with_new_date = []
+    updates, rows_with_new_date = compute_month_updates(columns, rows)
 
     print("\n" + "=" * 80)
     print(f"{'文件名':<12} {'原日期':<8} {'新日期':<12} {'说明'}")
     print("=" * 80)
 
-    for row in rows:
-        rowid = row[0]
-        fname = row[columns.index('文件名')]
-        old_date = row[columns.index('日期')]
-
-        new_date = get_target_date(fname, old_date)
-
-        if new_date:
-            year = int(fname[:4])
-            month = parse_month_pattern(old_date)
-            first_wd = get_first_working_day(year, month)
-            note = first_wd.strftime('%Y-%m-%d') + " (first working day)"
-
-            print(f"{fname:<12} {old_date:<8} {new_date:<12} {note}")
-            updates.append((new_date, rowid))
-            rows_with_new_date.append((old_date, new_date, note, row))
-        else:
-            print(f"{fname:<12} {old_date:<8} {'N/A':<12} 无法解析月份")
-            rows_with_new_date.append((old_date, "N/A", "无法解析月份", row))
+    fname_idx = columns.index('文件名')
+    for old_date, new_date, note, row in rows_with_new_date:
+        print(f"{row[fname_idx]:<12} {old_date:<8} {new_date:<12} {note}")
 
     print("=" * 80)
 
     # Export to HTML
-    export_to_html(columns, rows_with_new_date, OUTPUT_PATH)
-    print(f"\n已导出到: {OUTPUT_PATH}")
+    report = export_to_html(columns, rows_with_new_date, OUTPUT_PATH)
+    print(f"\n已导出到: {report}")
+
+    date_idx = columns.index('日期')
+    new_dates = dict((rowid, new_date) for new_date, rowid in updates)
+    for row in rows:
+        if row[0] in new_dates:
+            changeset.add_update('日期', row[0], row[date_idx], new_dates[row[0]])
 
     if args.dry_run:
         print(f"\n[DRY-RUN 模式] 预览: 本次可更新 {len(updates)} 条记录。")
+        print(f"变更集已写入: {changeset.write(plan_path(CHANGESET_STEP))} (可用 --apply 应用)")
     else:
         def count_table_records(conn):
             cursor = conn.execute(f"SELECT COUNT(*) FROM {PAYROLL_TABLE}")
@@ -233,19 +234,17 @@ def main():
         print(f"\n[确认更新] 数据库当前共有 {before_count} 条记录")
         print(f"[确认更新] 即将更新 {len(updates)} 条月份记录...")
 
-        confirm = input("请输入 'yes' 确认更新: ")
+        confirm = "yes" if args.yes else input("请输入 'yes' 确认更新: ")
         if confirm.strip().lower() == "yes":
             # Execute updates
-            for new_date, rowid in updates:
-                conn.execute(
-                    f"UPDATE {PAYROLL_TABLE} SET 日期 = ? WHERE rowid = ?",
-                    (new_date, rowid)
-                )
+            bulk_update_column(conn, '日期', updates)
             conn.commit()
+            record_watermark(conn, CHANGESET_STEP)
 
             after_count = count_table_records(conn)
             print(f"已成功更新 {len(updates)} 条记录。")
             print(f"更新后数据库共有 {after_count} 条记录。")
+            print(f"撤销文件: {changeset.write_undo(conn)}")
         else:
             print("已取消更新操作。")
 
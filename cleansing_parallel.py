@@ -0,0 +1,65 @@
+#!/usr/bin/env python3
+"""
+清洗步骤的并行解析 - 进程池按文件分区执行纯函数。
+
+Step 5 ~ Step 9 的日期解析和 validate_date_column.py 的 validate_date_string()
+只取决于日期值本身和 文件名 中的年月，可以按文件拆开并行计算:
+
+- 调用方先收集需要计算的参数 (通常是去重后的 (日期, 文件名))，按分区键
+  (文件年月 / 文件名) 分组；
+- parallel_compute() 把每个分区切成若干任务交给 ProcessPoolExecutor，
+  结果合并为 {键: 结果} 字典；
+- 逐行处理仍在主进程中按 rowid 顺序进行 (只查字典)，报告顺序不变，
+  数据库写入也仍由主进程一次完成。
+
+workers <= 1 或待计算的条目很少时直接在主进程串行计算，结果相同。
+"""
+
+import os
+from concurrent.futures import ProcessPoolExecutor
+
+# 每个任务最多计算的条目数 (分区更大时拆成多个任务)
+TASK_SIZE = 2000
+
+# 少于该条目数时不启动进程池 (启动开销大于收益)
+MIN_PARALLEL_ITEMS = 500
+
+
+def resolve_workers(workers) -> int:
+    """--workers 参数: 0 表示 CPU 核数, None / 负数按 1 处理。"""
+    if workers == 0:
+        return os.cpu_count() or 1
+    if workers is None or workers < 1:
+        return 1
+    return workers
+
+
+def _compute_task(func, items: list) -> list:
+    """在工作进程中执行: items 为 (键, 参数元组) 列表，返回 (键, 结果) 列表。"""
+    return [(key, func(*args)) for key, args in items]
+
+
+def parallel_compute(func, partitions: dict, workers: int = 1) -> dict:
+    """
+    对 partitions ({分区键: [(键, 参数元组), ...]}) 中的每一项计算 func(*参数)，
+    返回 {键: 结果}。func 必须是模块级函数 (可被 pickle)。
+    """
+    workers = resolve_workers(workers)
+    total = sum(len(items) for items in partitions.values())
+    if workers <= 1 or total < MIN_PARALLEL_ITEMS:
+        return {
+            key: func(*args)
+            for items in partitions.values()
+            for key, args in items
+        }
+
+    tasks = [
+        items[i:i + TASK_SIZE]
+        for items in partitions.values()
+        for i in range(0, len(items), TASK_SIZE)
+    ]
+    results = {}
+    with ProcessPoolExecutor(max_workers=min(workers, len(tasks))) as executor:
+        for task_results in executor.map(_compute_task, [func] * len(tasks), tasks):
+            results.update(task_results)
+    return results
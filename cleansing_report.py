@@ -0,0 +1,239 @@
+#!/usr/bin/env python3
+"""
+清洗 / 验证步骤共用的 HTML 报告写入器 - 流式写入、分页、可选 gzip。
+
+各步骤原来用 `html += ...` 在循环中拼接整份报告 (平方级复制)，最后一次写入，
+生成的单页表格动辄几 MB，浏览器打开很慢。HtmlReport 改为:
+
+- 边产生边写: 每行渲染后立即写入文件，内存占用与行数无关 (线性时间、常量内存);
+- 分页: 每个表格只有第一页 (PAGE_SIZE 行) 直接放在页面中，其余各页写入
+  <报告名>_pages/<表格>_p<N>.js (一行一个 JSON 字符串)，由页面底部的小段
+  脚本在翻页时按需加载 (<script src>，本地 file:// 打开同样可用)，
+  所以报告打开时只渲染第一页;
+- gzip: 环境变量 PAYROLL_REPORT_GZIP=1 时写成单个 <报告名>.html.gz，
+  其余各页以 <script type="application/json"> 内嵌 (不渲染, 翻页时解析)。
+
+每页行数可用环境变量 PAYROLL_REPORT_PAGE_SIZE 调整 (默认 500)。
+单元格内容统一做 HTML 转义; 需要原样输出的片段 (如 <br> 分隔的错误信息)
+用 raw() 包装。
+
+用法 (各步骤的 export_to_html):
+
+    with HtmlReport(output_path, "Step 5 - 日期处理结果") as report:
+        report.write(f"<h1>...</h1><p>共 {n} 条记录被更新</p>")
+        report.table(["原日期", "新日期"] + columns,
+                     ([old, new] + list(row) for old, new, row in rows_with_changes))
+    return report.path
+"""
+
+import gzip
+import html
+import json
+import os
+import shutil
+from collections import namedtuple
+from pathlib import Path
+
+PAGE_SIZE = int(os.environ.get("PAYROLL_REPORT_PAGE_SIZE", "500"))
+GZIP_REPORTS = os.environ.get("PAYROLL_REPORT_GZIP", "") not in ("", "0")
+
+PAGES_SUFFIX = "_pages"
+
+# 各步骤报告共用的样式 (各步骤原来各自内嵌一份); 各步骤特有的样式通过 style 参数追加
+BASE_STYLE = """
+table { border-collapse: collapse; font-size: 12px; }
+th, td { border: 1px solid #ddd; padding: 8px; }
+th { background-color: #4472C4; color: white; position: sticky; top: 0; }
+tr:nth-child(even) { background-color: #f2f2f2; }
+tr:hover { background-color: #ddd; }
+td { max-width: 200px; overflow: hidden; text-overflow: ellipsis; white-space: nowrap; }
+.pager { margin: 8px 0 24px 0; font-size: 13px; }
+.pager button { margin-right: 4px; }
+"""
+
+# 翻页脚本: 第一页在页面中，其他页从内嵌 JSON 或 _pages/*.js 按需加载
+VIEWER_SCRIPT = """
+<script>
+var reportPages = {};
+function reportPage(id, n, rows) {
+  reportPages[id + ':' + n] = rows;
+  showPage(id, n);
+}
+function showPage(id, n) {
+  var table = document.getElementById(id), pager = document.getElementById(id + '_pager');
+  var total = parseInt(pager.dataset.pages, 10);
+  if (n < 1 || n > total) return;
+  if (!reportPages[id + ':1']) reportPages[id + ':1'] = table.tBodies[0].innerHTML;
+  var rows = reportPages[id + ':' + n];
+  if (rows === undefined) {
+    var inline = document.getElementById(id + '_p' + n);
+    if (inline) {
+      rows = reportPages[id + ':' + n] = JSON.parse(inline.textContent).join('');
+    } else {
+      var script = document.createElement('script');
+      script.src = pager.dataset.dir + '/' + id + '_p' + n + '.js';
+      document.body.appendChild(script);
+      return;
+    }
+  }
+  if (Array.isArray(rows)) rows = reportPages[id + ':' + n] = rows.join('');
+  table.tBodies[0].innerHTML = rows;
+  pager.dataset.page = n;
+  pager.querySelector('span').textContent = '第 ' + n + ' / ' + total + ' 页';
+}
+function turnPage(id, delta) {
+  var pager = document.getElementById(id + '_pager');
+  showPage(id, parseInt(pager.dataset.page, 10) + delta);
+}
+</script>
+"""
+
+
+class raw(str):
+    """不做 HTML 转义的单元格内容。"""
+
+
+# 单独指定 class 的一行 (表格内各行 class 不同时使用)
+ClassedRow = namedtuple("ClassedRow", ["values", "row_class"])
+
+
+def cell(value, cell_class: str = None) -> str:
+    """一个 <td>: None 显示为空，其他值转义后输出 (raw 原样输出)。"""
+    attr = f' class="{cell_class}"' if cell_class else ""
+    if value is None:
+        return f"<td{attr}></td>"
+    if isinstance(value, raw):
+        return f"<td{attr}>{value}</td>"
+    return f"<td{attr}>{html.escape(str(value), quote=False)}</td>"
+
+
+def render_row(values, row_class: str = None, cell_classes: dict = None) -> str:
+    """一行 <tr>; cell_classes 为 {列序号: class}。"""
+    attr = f' class="{row_class}"' if row_class else ""
+    if cell_classes:
+        cells = "".join(cell(v, cell_classes.get(i)) for i, v in enumerate(values))
+    else:
+        cells = "".join(cell(v) for v in values)
+    return f"<tr{attr}>{cells}</tr>"
+
+
+def report_path(output_path: Path) -> Path:
+    """实际写入的文件 (gzip 模式下加 .gz)。"""
+    output_path = Path(output_path)
+    return output_path.with_name(output_path.name + ".gz") if GZIP_REPORTS else output_path
+
+
+class HtmlReport:
+    """流式 HTML 报告 (见模块说明)。用作上下文管理器，退出时写入页尾并关闭文件。"""
+
+    def __init__(self, output_path: Path, title: str, style: str = "",
+                 page_size: int = PAGE_SIZE, gzip_output: bool = GZIP_REPORTS):
+        output_path = Path(output_path)
+        self.gzip_output = gzip_output
+        self.path = output_path.with_name(output_path.name + ".gz") if gzip_output else output_path
+        self.page_size = max(1, page_size)
+        self.pages_dir = output_path.with_name(output_path.stem + PAGES_SUFFIX)
+        # 上次运行的分页文件全部作废
+        if self.pages_dir.is_dir():
+            shutil.rmtree(self.pages_dir)
+        self._paged = False
+        self._tables = 0
+        if gzip_output:
+            self._file = gzip.open(self.path, "wt", encoding="utf-8")
+        else:
+            self._file = open(self.path, "w", encoding="utf-8")
+        self._file.write(
+            f'<!DOCTYPE html>\n<html>\n<head>\n<meta charset="UTF-8">\n'
+            f'<title>{html.escape(title)}</title>\n'
+            f'<style>{BASE_STYLE}{style}</style>\n</head>\n<body>\n'
+        )
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        self.close()
+        return False
+
+    def write(self, fragment: str):
+        """写入一段原样输出的 HTML (标题、说明、小表格等)。"""
+        self._file.write(fragment)
+
+    def table(self, header: list, rows, row_class: str = None, cell_classes: dict = None) -> int:
+        """
+        流式写入一个表格，返回行数。header 为列名列表，rows 为可迭代的单元格值列表
+        (或 ClassedRow, 用于逐行指定 class)，cell_classes 为 {列序号: class}。
+        超过一页的行写入分页。
+        """
+        self._tables += 1
+        table_id = f"t{self._tables}"
+        self._file.write(
+            f'<table id="{table_id}">\n<thead><tr>'
+            + "".join(f"<th>{html.escape(str(c), quote=False)}</th>" for c in header)
+            + "</tr></thead>\n<tbody>\n"
+        )
+        page = 1
+        count = 0
+        page_file = None
+        for item in rows:
+            if isinstance(item, ClassedRow):
+                values, cls = item
+            else:
+                values, cls = item, row_class
+            row_html = render_row(values, cls, cell_classes)
+            if count and count % self.page_size == 0:
+                page += 1
+                if page == 2:
+                    self._file.write("</tbody>\n</table>\n")
+                page_file = self._next_page(page_file, table_id, page)
+            count += 1
+            if page == 1:
+                self._file.write(row_html + "\n")
+            else:
+                page_file.write(json.dumps(row_html, ensure_ascii=False).replace("</", "<\\/") + ",\n")
+        if page == 1:
+            self._file.write("</tbody>\n</table>\n")
+            return count
+        self._close_page(page_file)
+        self._paged = True
+        self._file.write(
+            f'<div class="pager" id="{table_id}_pager" data-page="1" data-pages="{page}" '
+            f'data-dir="{self.pages_dir.name}">'
+            f'<button onclick="showPage(\'{table_id}\', 1)">&laquo;</button>'
+            f'<button onclick="turnPage(\'{table_id}\', -1)">&lsaquo;</button>'
+            f'<span>第 1 / {page} 页</span> '
+            f'<button onclick="turnPage(\'{table_id}\', 1)">&rsaquo;</button>'
+            f'<button onclick="showPage(\'{table_id}\', {page})">&raquo;</button>'
+            f' (共 {count} 行, 每页 {self.page_size} 行)</div>\n'
+        )
+        return count
+
+    def _next_page(self, page_file, table_id: str, page: int):
+        """结束上一页, 开始第 page 页 (gzip 模式内嵌在报告中, 否则写入 _pages 目录)。"""
+        self._close_page(page_file)
+        if self.gzip_output:
+            self._file.write(f'<script type="application/json" id="{table_id}_p{page}">[\n')
+            return self._file
+        self.pages_dir.mkdir(exist_ok=True)
+        page_file = open(self.pages_dir / f"{table_id}_p{page}.js", "w", encoding="utf-8")
+        page_file.write(f'reportPage("{table_id}", {page}, [\n')
+        return page_file
+
+    def _close_page(self, page_file):
+        if page_file is None:
+            return
+        if page_file is self._file:
+            # JSON 不允许末尾逗号: 以空字符串结束 (join 后无影响)
+            self._file.write('""]</script>\n')
+        else:
+            page_file.write('""]);\n')
+            page_file.close()
+
+    def close(self):
+        if self._file is None:
+            return
+        if self._paged:
+            self._file.write(VIEWER_SCRIPT)
+        self._file.write("</body>\n</html>\n")
+        self._file.close()
+        self._file = None
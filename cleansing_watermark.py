@@ -0,0 +1,243 @@
+#!/usr/bin/env python3
+"""
+清洗水位 (按文件的脏数据跟踪) - 各清洗步骤和 cleansing_engine.py 共用。
+
+每次月度刷新只新增一两个 Excel 文件，但各步骤每次都扫描全表。这里在
+各步骤成功写入后，把每个文件当时的指纹记入数据库表 cleansing_watermark:
+
+    (步骤, 文件名) -> (记录数, 最大 rowid, 清洗时间)
+
+下次以 --incremental 运行时，只处理 "新文件或有变化的文件"，即:
+- 该步骤没有水位的文件 (新载入的文件);
+- 记录数或最大 rowid 比水位大的文件 (追加了记录，或撤销文件重新插入了记录)。
+后续步骤删除记录只会让记录数变小，不会让文件变脏。
+
+范围按 文件名 划分 (而不是按行)，因此 Step 2 的向下填充 (按 文件名 + sheet名 +
+职员全名 分组) 和 Step 4 的按文件逻辑在增量模式下看到的仍是完整的文件。
+
+batch_process.py 载入时会让水位失效: 全量重载 / staging 替换清空全部水位，
+单文件载入清除该文件的水位 (重载后 rowid 可能被复用，不能只靠指纹判断)。
+应用撤销文件后同样清空全部水位。
+
+用法:
+    python cleansing_watermark.py [--clear] [--shard YEAR]
+
+参数:
+    无参数    按步骤打印水位统计 (已记录文件数、当前需要处理的文件数)
+    --clear  清空水位 (下次 --incremental 运行时全部重新处理)
+    --shard YEAR  只处理该年份的分片数据库 (见 payroll_shards.py)
+"""
+
+import sqlite3
+import sys
+import argparse
+from datetime import datetime
+from pathlib import Path
+
+from payroll_shards import shard_db_path_for_year
+
+DB_PATH = Path(__file__).parent.parent / "payroll_database.db"
+PAYROLL_TABLE = "payroll_details"
+WATERMARK_TABLE = "cleansing_watermark"
+SCOPE_TABLE = "cleansing_scope"
+
+# 各步骤的 SELECT 加上该条件即只读取本次需要处理的文件
+SCOPE_WHERE = f"文件名 IN (SELECT file_name FROM temp.{SCOPE_TABLE})"
+
+# cleansing_engine.py 一次执行全部步骤，水位按各步骤分别记录
+ALL_STEPS = [f"step{i}" for i in range(11)]
+
+
+def ensure_watermark_table(conn: sqlite3.Connection):
+    """创建水位表 (已存在则跳过)。"""
+    conn.execute(f"""
+        CREATE TABLE IF NOT EXISTS {WATERMARK_TABLE} (
+            step TEXT NOT NULL,
+            file_name TEXT NOT NULL,
+            row_count INTEGER NOT NULL,
+            max_rowid INTEGER NOT NULL,
+            cleaned_at TEXT NOT NULL,
+            PRIMARY KEY (step, file_name)
+        )
+    """)
+
+
+def watermark_table_exists(conn: sqlite3.Connection) -> bool:
+    return conn.execute(
+        "SELECT 1 FROM sqlite_master WHERE type = 'table' AND name = ?", (WATERMARK_TABLE,)
+    ).fetchone() is not None
+
+
+def file_fingerprints(conn: sqlite3.Connection, table: str = PAYROLL_TABLE) -> dict:
+    """{文件名: (记录数, 最大 rowid)}，一条 GROUP BY 查询 (走 文件名 索引)。"""
+    return {
+        file_name: (row_count, max_rowid)
+        for file_name, row_count, max_rowid in conn.execute(
+            f"SELECT 文件名, COUNT(*), MAX(rowid) FROM {table} GROUP BY 文件名"
+        )
+    }
+
+
+def load_watermarks(conn: sqlite3.Connection, step: str) -> dict:
+    """{文件名: (记录数, 最大 rowid)}，水位表不存在时为空。"""
+    if not watermark_table_exists(conn):
+        return {}
+    return {
+        file_name: (row_count, max_rowid)
+        for file_name, row_count, max_rowid in conn.execute(
+            f"SELECT file_name, row_count, max_rowid FROM {WATERMARK_TABLE} WHERE step = ?",
+            (step,)
+        )
+    }
+
+
+def _is_dirty(fingerprint: tuple, watermark: tuple) -> bool:
+    if watermark is None:
+        return True
+    return fingerprint[0] > watermark[0] or fingerprint[1] > watermark[1]
+
+
+def dirty_files(conn: sqlite3.Connection, steps, table: str = PAYROLL_TABLE,
+                fingerprints: dict = None) -> list:
+    """对 steps 中任一步骤而言是新文件或有变化的文件 (文件名为空的记录返回 None)。"""
+    if fingerprints is None:
+        fingerprints = file_fingerprints(conn, table)
+    dirty = set()
+    for step in steps:
+        watermarks = load_watermarks(conn, step)
+        dirty.update(
+            file_name for file_name, fingerprint in fingerprints.items()
+            if _is_dirty(fingerprint, watermarks.get(file_name))
+        )
+    return sorted(dirty, key=lambda name: (name is None, name))
+
+
+def prepare_scope(conn: sqlite3.Connection, steps, table: str = PAYROLL_TABLE):
+    """
+    增量模式: 把需要处理的文件写入临时表 temp.cleansing_scope，返回 SCOPE_WHERE；
+    存在 文件名 为空的记录时无法按文件划分，返回 None (全表处理)。
+    steps 为单个步骤名或步骤名列表。
+    """
+    if isinstance(steps, str):
+        steps = [steps]
+    fingerprints = file_fingerprints(conn, table)
+    files = dirty_files(conn, steps, table, fingerprints)
+    if None in files:
+        print("增量模式: 存在 文件名 为空的记录, 改为全表处理")
+        return None
+
+    conn.execute(f"DROP TABLE IF EXISTS temp.{SCOPE_TABLE}")
+    conn.execute(f"CREATE TEMP TABLE {SCOPE_TABLE} (file_name TEXT PRIMARY KEY)")
+    conn.executemany(
+        f"INSERT INTO temp.{SCOPE_TABLE} (file_name) VALUES (?)", ((f,) for f in files)
+    )
+    rows = sum(fingerprints[f][0] for f in files)
+    print(f"增量模式: {len(files)} / {len(fingerprints)} 个文件需要处理 (共 {rows} 条记录)")
+    for file_name in files[:10]:
+        print(f"  - {file_name}")
+    if len(files) > 10:
+        print(f"  ... 还有 {len(files) - 10} 个文件")
+    return SCOPE_WHERE
+
+
+def and_scope(where: str, scope: str) -> str:
+    """把范围条件并入已有的 WHERE 条件 (两者都可能为 None)。"""
+    if not scope:
+        return where
+    if not where:
+        return scope
+    return f"({where}) AND {scope}"
+
+
+def record_watermark(conn: sqlite3.Connection, steps, table: str = PAYROLL_TABLE):
+    """
+    步骤成功完成后记录当前所有文件的指纹 (并提交)。
+    增量运行时未处理的文件本来就没有变化，重新记录不影响结果。
+    """
+    if isinstance(steps, str):
+        steps = [steps]
+    fingerprints = file_fingerprints(conn, table)
+    now = datetime.now().isoformat(timespec="seconds")
+    ensure_watermark_table(conn)
+    for step in steps:
+        conn.execute(f"DELETE FROM {WATERMARK_TABLE} WHERE step = ?", (step,))
+        conn.executemany(
+            f"INSERT INTO {WATERMARK_TABLE} "
+            f"(step, file_name, row_count, max_rowid, cleaned_at) VALUES (?, ?, ?, ?, ?)",
+            (
+                (step, file_name, row_count, max_rowid, now)
+                for file_name, (row_count, max_rowid) in fingerprints.items()
+                if file_name is not None
+            )
+        )
+    conn.commit()
+
+
+def invalidate_files(conn: sqlite3.Connection, file_names):
+    """清除这些文件在所有步骤的水位 (不提交)。"""
+    if not watermark_table_exists(conn):
+        return
+    conn.executemany(
+        f"DELETE FROM {WATERMARK_TABLE} WHERE file_name = ?", ((f,) for f in file_names)
+    )
+
+
+def clear_watermarks(conn: sqlite3.Connection):
+    """清空全部水位 (不提交)。"""
+    if watermark_table_exists(conn):
+        conn.execute(f"DELETE FROM {WATERMARK_TABLE}")
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description="清洗水位 (各步骤 --incremental 使用) - 查看统计或清空"
+    )
+    parser.add_argument(
+        "--clear",
+        action="store_true",
+        help="清空水位 (下次 --incremental 运行时全部重新处理)"
+    )
+    parser.add_argument(
+        "--shard",
+        help="只处理指定年份的分片数据库 (见 payroll_shards.py)，如 2025"
+    )
+    args = parser.parse_args()
+    db_path = shard_db_path_for_year(args.shard) if args.shard else DB_PATH
+
+    if not db_path.exists():
+        print(f"错误: 数据库文件不存在: {db_path}")
+        sys.exit(1)
+
+    conn = sqlite3.connect(str(db_path))
+    if not watermark_table_exists(conn):
+        print(f"水位表 {WATERMARK_TABLE} 不存在 (尚未有步骤成功写入)。")
+        conn.close()
+        return
+
+    if args.clear:
+        confirm = input(f"[确认] 即将清空水位表 {WATERMARK_TABLE}。\n请输入 'yes' 确认: ")
+        if confirm.strip().lower() != "yes":
+            print("已取消操作。")
+            conn.close()
+            sys.exit(0)
+        clear_watermarks(conn)
+        conn.commit()
+        print("水位已清空。")
+        conn.close()
+        return
+
+    fingerprints = file_fingerprints(conn)
+    recorded = dict(conn.execute(
+        f"SELECT step, MAX(cleaned_at) FROM {WATERMARK_TABLE} GROUP BY step"
+    ).fetchall())
+    print(f"当前共 {len(fingerprints)} 个文件")
+    print(f"{'步骤':<8} {'已记录文件':>10} {'需要处理':>8}  {'最近清洗时间'}")
+    for step in ALL_STEPS:
+        watermarks = load_watermarks(conn, step)
+        dirty = len(dirty_files(conn, [step], fingerprints=fingerprints))
+        print(f"{step:<8} {len(watermarks):>10} {dirty:>8}  {recorded.get(step, '-')}")
+    conn.close()
+
+
+if __name__ == "__main__":
+    main()
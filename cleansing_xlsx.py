@@ -0,0 +1,104 @@
+#!/usr/bin/env python3
+"""
+数据库记录导出 xlsx 的共用写入器 - openpyxl write-only 模式 + 命名样式。
+
+普通模式的 openpyxl 工作簿把每个单元格都保存在内存中，原 Step 1 还对每个数据单元格
+ws.cell(...) 后单独设置一个 PatternFill 对象，几万条异常记录时内存和保存时间都很大。
+XlsxExport 改为:
+
+- write-only 工作表: 每行 append 后即写入临时文件，内存占用与行数无关;
+- 命名样式: 表头和各类数据行的样式 (填充色/字体/对齐) 在工作簿中各注册一次 (NamedStyle)，
+  数据单元格只引用样式名，同一行的单元格共用同一个样式;
+- 列宽在写入数据前设置 (write-only 模式的要求)。
+
+用法:
+
+    with XlsxExport(output_path) as xlsx:
+        xlsx.add_fill_style("real_outlier", "F4CCCC")
+        xlsx.sheet("real_outliers", columns, rows, row_style="real_outlier",
+                   widths={"A": 8, "C": 12})
+"""
+
+from pathlib import Path
+
+import openpyxl
+from openpyxl.cell import Cell, WriteOnlyCell
+from openpyxl.styles import Font, Alignment, PatternFill, NamedStyle
+from openpyxl.utils import get_column_letter
+
+HEADER_STYLE = "payroll_header"
+DEFAULT_WIDTH = 15
+
+
+class XlsxExport:
+    """流式 xlsx 工作簿 (见模块说明)。用作上下文管理器，正常退出时保存。"""
+
+    def __init__(self, output_path: Path):
+        self.output_path = Path(output_path)
+        self.wb = openpyxl.Workbook(write_only=True)
+        self.add_style(
+            HEADER_STYLE,
+            fill=PatternFill(start_color="4472C4", end_color="4472C4", fill_type="solid"),
+            font=Font(bold=True, color="FFFFFF"),
+            alignment=Alignment(horizontal="center"),
+        )
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        if exc_type is None:
+            self.save()
+        return False
+
+    def add_style(self, name: str, fill=None, font=None, alignment=None):
+        """注册一个命名样式 (工作簿内只保存一份)。"""
+        style = NamedStyle(name=name)
+        if fill is not None:
+            style.fill = fill
+        if font is not None:
+            style.font = font
+        if alignment is not None:
+            style.alignment = alignment
+        self.wb.add_named_style(style)
+
+    def add_fill_style(self, name: str, color: str):
+        """注册只有纯色填充的命名样式 (如异常记录的底色)。"""
+        self.add_style(name, fill=PatternFill(start_color=color, end_color=color, fill_type="solid"))
+
+    def sheet(self, title: str, columns: list, rows, row_style: str = None,
+              widths: dict = None, default_width: int = DEFAULT_WIDTH) -> int:
+        """
+        追加一个工作表并流式写入 rows (可迭代的行)，返回数据行数。
+        row_style 为数据行使用的命名样式; widths 为 {列字母: 宽度}, 其余列为 default_width。
+        """
+        ws = self.wb.create_sheet(title=title)
+        for col_idx in range(1, len(columns) + 1):
+            ws.column_dimensions[get_column_letter(col_idx)].width = default_width
+        for letter, width in (widths or {}).items():
+            ws.column_dimensions[letter].width = width
+
+        header_style = self._style_array(ws, HEADER_STYLE)
+        ws.append([Cell(ws, row=1, column=1, value=name, style_array=header_style) for name in columns])
+        count = 0
+        if row_style is None:
+            for row in rows:
+                ws.append(row)
+                count += 1
+            return count
+        # 按样式名查找命名样式只做一次, 各单元格复制同一个样式索引数组
+        style_array = self._style_array(ws, row_style)
+        for row in rows:
+            ws.append([Cell(ws, row=1, column=1, value=value, style_array=style_array) for value in row])
+            count += 1
+        return count
+
+    @staticmethod
+    def _style_array(ws, style: str):
+        """命名样式 style 在工作簿中的样式索引 (单元格的 StyleArray)。"""
+        cell = WriteOnlyCell(ws)
+        cell.style = style
+        return cell._style
+
+    def save(self):
+        self.wb.save(str(self.output_path))
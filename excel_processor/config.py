@@ -13,6 +13,15 @@ expected_columns = ['职员全名', '日期','客户名称', '型号', '工序
 # Minimum number of expected columns that should be found in a valid dataframe
 COMMON_COL_COUNT = 4
 
+# Placeholder strings that stand for an empty text cell (pandas writes None / NaN
+# as 'None' / 'nan' when a column is converted with astype(str)).
+# Same list as PLACEHOLDERS in cleansing_none_cleanup_step10.py.
+TEXT_PLACEHOLDERS = ('None', 'none', 'null', 'NULL', 'nan', 'NaN')
+
+# Value stored for empty text cells at load time: '' (default, the end state that
+# cleansing step 10 used to produce) or SQL NULL when PAYROLL_EMPTY_TEXT=null.
+EMPTY_TEXT_VALUE = None if os.environ.get('PAYROLL_EMPTY_TEXT', '').lower() == 'null' else ''
+
 # Global logging configuration
 def setup_global_logging():
     """
@@ -0,0 +1,238 @@
+"""
+Schema management helpers for the payroll database.
+
+Holds the payroll_details/load_log table definitions, the optional
+integer-scaled storage variant, the managed secondary index set, and the list
+of known project queries whose plans must stay index-backed.
+"""
+
+import re
+import sqlite3
+from decimal import Decimal, ROUND_HALF_UP
+from typing import List, Tuple
+
+# Table names used by the loader
+PAYROLL_TABLE = 'payroll_details'
+LOAD_LOG_TABLE = 'load_log'
+
+# Columns and data types of the payroll_details table (and of its staging copy)
+PAYROLL_DETAILS_COLUMNS = {
+    '文件名': 'CHAR(100)',
+    'sheet名': 'CHAR(100)',
+    '职员全名': 'CHAR(20)',
+    '日期': 'CHAR(100)',
+    '客户名称': 'CHAR(60)',
+    '型号': 'CHAR(100)',
+    '工序全名': 'CHAR(100)',
+    '工序': 'CHAR(100)',
+    '计件数量': 'NUMERIC(10,2)',
+    '系数': 'NUMERIC(10,2)',
+    '定额': 'NUMERIC(10,2)',
+    '金额': 'NUMERIC(10,2)',
+    '备注': 'CHAR(100)',
+    '代码': 'CHAR(12)'
+}
+
+# Integer-scaled storage variant (opt-in, see update_database_schema.py --integer-cents):
+# each NUMERIC(10,2) column is stored as <col>_x100 INTEGER, and <col> itself becomes a
+# VIRTUAL generated column (<col>_x100 / 100.0), so every existing reader still sees the
+# decimal value under the old name while rowid-based cleansing keeps working on a real table.
+SCALED_COLUMNS = ['计件数量', '系数', '定额', '金额']
+SCALE = 100
+SCALED_SUFFIX = '_x100'
+
+
+def scaled_column(col: str) -> str:
+    return f"{col}{SCALED_SUFFIX}"
+
+
+def to_scaled_int(value) -> int:
+    """Round value to 2 decimal places (ROUND_HALF_UP) and return it as an integer count of 0.01."""
+    quantized = Decimal(str(value)).quantize(Decimal('0.01'), rounding=ROUND_HALF_UP)
+    return int(quantized * SCALE)
+
+
+def payroll_details_column_defs(scaled: bool = False) -> List[str]:
+    """Column definitions for a payroll_details-shaped table, in SELECT * order."""
+    if not scaled:
+        return [f'{col} {dtype}' for col, dtype in PAYROLL_DETAILS_COLUMNS.items()]
+    defs = []
+    for col, dtype in PAYROLL_DETAILS_COLUMNS.items():
+        if col in SCALED_COLUMNS:
+            defs.append(f'{col} {dtype} GENERATED ALWAYS AS ({scaled_column(col)} / {SCALE}.0) VIRTUAL')
+        else:
+            defs.append(f'{col} {dtype}')
+    defs.extend(f'{scaled_column(col)} INTEGER' for col in SCALED_COLUMNS)
+    return defs
+
+
+def create_payroll_details_table(conn: sqlite3.Connection, table_name: str = PAYROLL_TABLE, scaled: bool = False):
+    """
+    Create a payroll_details-shaped table if it doesn't exist.
+
+    Parameters:
+        conn (sqlite3.Connection): Open database connection
+        table_name (str): Name of the table to create (payroll_details or its staging copy)
+        scaled (bool): Use the integer-scaled storage variant
+    """
+    create_table_sql = f"""
+    CREATE TABLE IF NOT EXISTS {table_name} (
+        {', '.join(payroll_details_column_defs(scaled))}
+    )
+    """
+    conn.execute(create_table_sql)
+
+
+def create_load_log_table(conn: sqlite3.Connection, table_name: str = LOAD_LOG_TABLE):
+    """
+    Create a load_log-shaped table if it doesn't exist.
+
+    Parameters:
+        conn (sqlite3.Connection): Open database connection
+        table_name (str): Name of the table to create (load_log or its staging copy)
+    """
+    create_log_table_sql = f"""
+    CREATE TABLE IF NOT EXISTS {table_name} (
+        file_name CHAR(50),
+        sheet_name CHAR(50),
+        table_index INT,
+        discarded_columns CHAR(200),
+        discarded_cols_num INT
+    )
+    """
+    conn.execute(create_log_table_sql)
+
+
+def is_scaled_table(conn: sqlite3.Connection, table_name: str = PAYROLL_TABLE) -> bool:
+    """True if table_name uses the integer-scaled storage variant."""
+    # table_xinfo (not table_info) also lists generated columns
+    columns = {row[1] for row in conn.execute(f"PRAGMA table_xinfo({table_name})").fetchall()}
+    return scaled_column('金额') in columns
+
+
+# Managed secondary indexes: index key -> indexed columns/expression.
+# Index names are idx_<table>_<key>, so a renamed snapshot table keeps distinct names.
+PAYROLL_INDEXES = {
+    'file_sheet': '文件名, sheet名',
+    'employee': '职员全名',
+    'date': '日期',
+    'model': '型号',
+    'amount_real': 'CAST(金额 AS REAL)',
+}
+
+# Extra indexes for the integer-scaled variant
+SCALED_PAYROLL_INDEXES = {
+    'amount_x100': scaled_column('金额'),
+}
+
+# Known queries from check_payroll_database.py, reconcile_excel_vs_db.audit_db_consistency
+# and the cleansing steps. Each must be answered through an index, never a full scan.
+# (check_payroll_database.query_by_model uses 型号 LIKE '%...%'; a leading wildcard
+# can never use a b-tree index, so it is deliberately not listed.)
+KNOWN_QUERIES = [
+    ('check_payroll_database.query_by_employee',
+     f"SELECT * FROM {PAYROLL_TABLE} WHERE 职员全名 = ? LIMIT 20", ('x',)),
+    ('check_payroll_database.query_by_date',
+     f"SELECT * FROM {PAYROLL_TABLE} WHERE 日期 = ? LIMIT 20", ('x',)),
+    ('check_payroll_database.unique_employees',
+     f"SELECT COUNT(DISTINCT 职员全名) FROM {PAYROLL_TABLE}", ()),
+    ('check_payroll_database.unique_models',
+     f"SELECT COUNT(DISTINCT 型号) FROM {PAYROLL_TABLE}", ()),
+    ('reconcile.audit 装配',
+     f"SELECT COUNT(*) FROM {PAYROLL_TABLE} WHERE 职员全名 = '装配'", ()),
+    ('reconcile.audit 黄志梅/陈会清',
+     f"SELECT 职员全名, COUNT(*), SUM(CAST(金额 AS REAL)) FROM {PAYROLL_TABLE} "
+     f"WHERE 职员全名 IN ('黄志梅', '陈会清') GROUP BY 职员全名", ()),
+    ('reconcile.audit 金额=0',
+     f"SELECT COUNT(*) FROM {PAYROLL_TABLE} "
+     f"WHERE CAST(金额 AS REAL) = 0 AND CAST(计件数量 AS REAL) != 0", ()),
+    ('cleansing per file/sheet',
+     f"SELECT rowid, 日期 FROM {PAYROLL_TABLE} WHERE 文件名 = ? AND sheet名 = ?", ('x', 'y')),
+    ('cleansing per file',
+     f"SELECT rowid, 日期 FROM {PAYROLL_TABLE} WHERE 文件名 = ?", ('x',)),
+    ('cleansing_outliers_step4 郁俊海',
+     f"SELECT rowid, * FROM {PAYROLL_TABLE} "
+     f"WHERE 职员全名 = '郁俊海' AND (日期 LIKE '%月' OR 日期 LIKE '%月份')", ()),
+]
+
+# EXPLAIN QUERY PLAN detail for an unindexed table scan:
+# "SCAN payroll_details" (SQLite >= 3.36) or "SCAN TABLE payroll_details" (older).
+_FULL_SCAN_RE = re.compile(r'^SCAN (TABLE )?(\w+)$')
+
+
+def index_name(table_name: str, key: str) -> str:
+    return f"idx_{table_name}_{key}"
+
+
+def create_payroll_indexes(conn: sqlite3.Connection, table_name: str = PAYROLL_TABLE) -> List[str]:
+    """
+    Create the managed index set on a payroll_details-shaped table.
+
+    Returns:
+        List[str]: Names of the indexes (created or already present)
+    """
+    indexes = dict(PAYROLL_INDEXES)
+    if is_scaled_table(conn, table_name):
+        indexes.update(SCALED_PAYROLL_INDEXES)
+    # A dictionary-encoded fact table (see dimensions.py) stores <col>_id instead of <col>
+    table_columns = {row[1] for row in conn.execute(f"PRAGMA table_xinfo({table_name})").fetchall()}
+    names = []
+    for key, columns in indexes.items():
+        if columns not in table_columns and f"{columns}_id" in table_columns:
+            columns = f"{columns}_id"
+        name = index_name(table_name, key)
+        conn.execute(f"CREATE INDEX IF NOT EXISTS {name} ON {table_name} ({columns})")
+        names.append(name)
+    return names
+
+
+def drop_payroll_indexes(conn: sqlite3.Connection, table_name: str) -> List[str]:
+    """
+    Drop every explicit index defined on table_name (e.g. a *_prev snapshot table,
+    whose indexes still carry the live table's names after a rename).
+
+    Returns:
+        List[str]: Names of the dropped indexes
+    """
+    rows = conn.execute(
+        "SELECT name FROM sqlite_master WHERE type='index' AND tbl_name=? AND sql IS NOT NULL",
+        (table_name,)
+    ).fetchall()
+    for (name,) in rows:
+        conn.execute(f"DROP INDEX IF EXISTS {name}")
+    return [name for (name,) in rows]
+
+
+def explain_query_plan(conn: sqlite3.Connection, sql: str, params: tuple = ()) -> List[str]:
+    """Return the detail column of EXPLAIN QUERY PLAN for sql."""
+    return [row[3] for row in conn.execute(f"EXPLAIN QUERY PLAN {sql}", params).fetchall()]
+
+
+def find_full_scans(plan: List[str], table_name: str = PAYROLL_TABLE) -> List[str]:
+    """Return the plan steps that scan table_name without any index."""
+    scans = []
+    for detail in plan:
+        match = _FULL_SCAN_RE.match(detail.strip())
+        if match and match.group(2) == table_name:
+            scans.append(detail)
+    return scans
+
+
+def check_query_plans(conn: sqlite3.Connection, queries=KNOWN_QUERIES,
+                      table_name: str = PAYROLL_TABLE) -> List[Tuple[str, List[str]]]:
+    """
+    Run EXPLAIN QUERY PLAN on the known queries.
+
+    Parameters:
+        table_name (str): Table whose full scans count as regressions
+            (payroll_details_fact when payroll_details is the normalized view)
+
+    Returns:
+        List[Tuple[str, List[str]]]: (query name, plan) for every query that regressed to a full scan
+    """
+    regressions = []
+    for name, sql, params in queries:
+        plan = explain_query_plan(conn, sql, params)
+        if find_full_scans(plan, table_name):
+            regressions.append((name, plan))
+    return regressions
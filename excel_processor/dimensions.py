@@ -0,0 +1,227 @@
+"""
+Dictionary-encoded (normalized) storage mode for payroll_details.
+
+In this mode the repeated text columns 职员全名/型号/工序全名/工序/客户名称 live in
+small dimension tables (id INTEGER PRIMARY KEY, name TEXT UNIQUE), the rows
+themselves live in payroll_details_fact with integer <col>_id foreign keys, and
+payroll_details becomes a view that joins them back together:
+
+- The view exposes the fact rowid as an explicit `rowid` column, so the
+  cleansing scripts' `WHERE rowid = ?` keeps working. `SELECT rowid, *` would
+  return it twice; the scripts read whole rows through
+  cleansing_db_utils.full_row_select(), which lists it once.
+- Lookups by a dimension name with `=` are index searches (dimension name ->
+  id -> fact index), but whole-table aggregates over the view scan the fact
+  table, see update_database_schema.check_query_plans().
+- INSTEAD OF INSERT/UPDATE/DELETE triggers on the view translate writes to the
+  fact table, adding new dimension values on the fly. An INSERT that names the
+  view's rowid column keeps that rowid (change-set undo re-inserts deleted rows
+  under their old rowids); without it the fact table assigns one as usual.
+- load_df_to_db bypasses the triggers and writes the fact table directly, with
+  dimension ids resolved through an in-memory DimensionCache.
+
+Enabled/disabled with update_database_schema.py --normalize-dimensions /
+--flatten-dimensions.
+"""
+
+import sqlite3
+from typing import Dict, List, Optional
+
+try:
+    from .db_schema import PAYROLL_TABLE, PAYROLL_DETAILS_COLUMNS
+except ImportError:
+    from db_schema import PAYROLL_TABLE, PAYROLL_DETAILS_COLUMNS
+
+# Dictionary-encoded column -> dimension table
+DIMENSIONS = {
+    '职员全名': 'dim_employee',
+    '型号': 'dim_model',
+    '工序全名': 'dim_process_full',
+    '工序': 'dim_process',
+    '客户名称': 'dim_customer',
+}
+
+FACT_SUFFIX = '_fact'
+
+
+def dimension_id_column(col: str) -> str:
+    return f"{col}_id"
+
+
+def fact_table_name(view_name: str = PAYROLL_TABLE) -> str:
+    return f"{view_name}{FACT_SUFFIX}"
+
+
+def is_normalized(conn: sqlite3.Connection, view_name: str = PAYROLL_TABLE) -> bool:
+    """True if view_name is the dimension-joining view of the normalized mode."""
+    row = conn.execute(
+        "SELECT 1 FROM sqlite_master WHERE type='view' AND name=?", (view_name,)
+    ).fetchone()
+    return row is not None
+
+
+def is_fact_table(conn: sqlite3.Connection, table_name: str) -> bool:
+    """True if table_name has the fact layout (dimension id columns)."""
+    columns = {row[1] for row in conn.execute(f"PRAGMA table_info({table_name})").fetchall()}
+    return dimension_id_column('职员全名') in columns
+
+
+def fact_column_defs() -> List[str]:
+    """Column definitions of the fact table, in payroll_details column order."""
+    defs = []
+    for col, dtype in PAYROLL_DETAILS_COLUMNS.items():
+        if col in DIMENSIONS:
+            defs.append(f"{dimension_id_column(col)} INTEGER REFERENCES {DIMENSIONS[col]}(id)")
+        else:
+            defs.append(f"{col} {dtype}")
+    return defs
+
+
+def create_dimension_tables(conn: sqlite3.Connection):
+    for dim_table in DIMENSIONS.values():
+        conn.execute(f"""
+        CREATE TABLE IF NOT EXISTS {dim_table} (
+            id INTEGER PRIMARY KEY,
+            name TEXT NOT NULL UNIQUE
+        )
+        """)
+
+
+def create_fact_table(conn: sqlite3.Connection, table_name: str):
+    conn.execute(f"""
+    CREATE TABLE IF NOT EXISTS {table_name} (
+        {', '.join(fact_column_defs())}
+    )
+    """)
+
+
+def _dimension_lookup(col: str, new_or_old: str) -> str:
+    return f"(SELECT id FROM {DIMENSIONS[col]} WHERE name = {new_or_old}.{col})"
+
+
+def _dimension_upserts(new_or_old: str = 'NEW') -> str:
+    return '\n'.join(
+        f"    INSERT OR IGNORE INTO {dim_table} (name) "
+        f"SELECT {new_or_old}.{col} WHERE {new_or_old}.{col} IS NOT NULL;"
+        for col, dim_table in DIMENSIONS.items()
+    )
+
+
+def create_payroll_view(conn: sqlite3.Connection, view_name: str = PAYROLL_TABLE):
+    """Create the compatibility view over the fact table plus its write triggers."""
+    fact_table = fact_table_name(view_name)
+    select_cols = []
+    joins = []
+    for col in PAYROLL_DETAILS_COLUMNS:
+        if col in DIMENSIONS:
+            dim_table = DIMENSIONS[col]
+            select_cols.append(f"{dim_table}.name AS {col}")
+            joins.append(
+                f"LEFT JOIN {dim_table} ON {dim_table}.id = {fact_table}.{dimension_id_column(col)}"
+            )
+        else:
+            select_cols.append(f"{fact_table}.{col} AS {col}")
+    conn.execute(f"""
+    CREATE VIEW IF NOT EXISTS {view_name} AS
+    SELECT {fact_table}.rowid AS rowid, {', '.join(select_cols)}
+    FROM {fact_table}
+    {' '.join(joins)}
+    """)
+    create_view_triggers(conn, view_name)
+
+
+def create_view_triggers(conn: sqlite3.Connection, view_name: str = PAYROLL_TABLE):
+    """(Re)create the INSTEAD OF triggers of the view (replacing older versions)."""
+    fact_table = fact_table_name(view_name)
+    fact_cols = [dimension_id_column(c) if c in DIMENSIONS else c for c in PAYROLL_DETAILS_COLUMNS]
+    new_values = [_dimension_lookup(c, 'NEW') if c in DIMENSIONS else f"NEW.{c}" for c in PAYROLL_DETAILS_COLUMNS]
+    assignments = ', '.join(f"{fc} = {nv}" for fc, nv in zip(fact_cols, new_values))
+
+    for event in ('insert', 'update', 'delete'):
+        conn.execute(f"DROP TRIGGER IF EXISTS {view_name}_{event}")
+
+    # NEW.rowid is NULL unless the INSERT names the rowid column, and a NULL
+    # rowid lets the fact table assign the next one
+    conn.execute(f"""
+    CREATE TRIGGER {view_name}_insert INSTEAD OF INSERT ON {view_name}
+    BEGIN
+{_dimension_upserts()}
+        INSERT INTO {fact_table} (rowid, {', '.join(fact_cols)}) VALUES (NEW.rowid, {', '.join(new_values)});
+    END
+    """)
+    conn.execute(f"""
+    CREATE TRIGGER {view_name}_update INSTEAD OF UPDATE ON {view_name}
+    BEGIN
+{_dimension_upserts()}
+        UPDATE {fact_table} SET {assignments} WHERE rowid = OLD.rowid;
+    END
+    """)
+    conn.execute(f"""
+    CREATE TRIGGER {view_name}_delete INSTEAD OF DELETE ON {view_name}
+    BEGIN
+        DELETE FROM {fact_table} WHERE rowid = OLD.rowid;
+    END
+    """)
+
+
+class DimensionCache:
+    """
+    In-memory name -> id lookup for the dimension tables of one database.
+
+    Each dimension is read once on first use; new names are inserted and cached,
+    so encoding a dataframe costs one dict lookup per cell.
+    """
+
+    def __init__(self):
+        self._ids: Dict[str, Dict[str, int]] = {}
+
+    def _load(self, conn: sqlite3.Connection, dim_table: str) -> Dict[str, int]:
+        if dim_table not in self._ids:
+            rows = conn.execute(f"SELECT name, id FROM {dim_table}").fetchall()
+            self._ids[dim_table] = dict(rows)
+        return self._ids[dim_table]
+
+    def encode(self, conn: sqlite3.Connection, col: str, value) -> Optional[int]:
+        if value is None:
+            return None
+        dim_table = DIMENSIONS[col]
+        ids = self._load(conn, dim_table)
+        dim_id = ids.get(value)
+        if dim_id is None:
+            conn.execute(f"INSERT OR IGNORE INTO {dim_table} (name) VALUES (?)", (value,))
+            dim_id = conn.execute(f"SELECT id FROM {dim_table} WHERE name = ?", (value,)).fetchone()[0]
+            ids[value] = dim_id
+        return dim_id
+
+    def encode_values(self, conn: sqlite3.Connection, col: str, values) -> List[Optional[int]]:
+        return [self.encode(conn, col, value) for value in values]
+
+    def clear(self):
+        self._ids.clear()
+
+
+# One cache per database path, shared by every load_df_to_db call of a run
+_caches: Dict[str, DimensionCache] = {}
+
+
+def get_dimension_cache(db_path: str) -> DimensionCache:
+    if db_path not in _caches:
+        _caches[db_path] = DimensionCache()
+    return _caches[db_path]
+
+
+def view_insert_keeps_rowid(conn: sqlite3.Connection, view_name: str = PAYROLL_TABLE) -> bool:
+    """
+    True if the view's INSTEAD OF INSERT trigger passes NEW.rowid through to the
+    fact table. Views created before that get new rowids on insert; rerun
+    update_database_schema.py --normalize-dimensions to replace their triggers.
+    """
+    row = conn.execute(
+        "SELECT sql FROM sqlite_master WHERE type='trigger' AND name=?", (f"{view_name}_insert",)
+    ).fetchone()
+    return row is not None and 'NEW.rowid' in row[0]
+
+
+def detail_storage_table(conn: sqlite3.Connection, view_name: str = PAYROLL_TABLE) -> str:
+    """Name of the table that physically holds the payroll_details rows."""
+    return fact_table_name(view_name) if is_normalized(conn, view_name) else view_name
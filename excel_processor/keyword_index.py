@@ -0,0 +1,203 @@
+"""
+Optional keyword shadow index over the text columns of payroll_details.
+
+Keyword-based outlier detection (合计/小计 rows, 加班/半天 notes, '：' and
+'月' in dates) used to be `LIKE '%...%'` OR'ed over every text column, which
+is always a full table scan. This module keeps a small shadow table
+
+    payroll_keyword_hits (keyword, col, row_id)
+
+with one entry per (keyword, text column, row) where the column contains the
+keyword, so those lookups become index range scans:
+
+- The keyword list lives in payroll_keywords and defaults to KEYWORDS.
+- AFTER INSERT/UPDATE/DELETE triggers on the detail storage table keep the
+  hits in step with every write: load_df_to_db inserts, the cleansing steps'
+  UPDATEs and DELETEs, and change-set apply/undo. In the normalized mode the
+  triggers sit on payroll_details_fact and resolve dimension ids to names.
+- rebuild_keyword_index() fills the hits from scratch; batch_process.py calls
+  it after a staging swap, update_database_schema.py after a storage change.
+
+An FTS5 trigram index was considered, but the trigram tokenizer cannot match
+substrings shorter than three characters (MATCH returns nothing and LIKE falls
+back to a full scan), and every keyword here is one or two characters long.
+
+Enabled/disabled with update_database_schema.py --create-keyword-index /
+--drop-keyword-index.
+"""
+
+import sqlite3
+from typing import Iterable, List, Optional
+
+try:
+    from .db_schema import PAYROLL_TABLE, PAYROLL_DETAILS_COLUMNS, SCALED_COLUMNS
+    from .dimensions import DIMENSIONS, dimension_id_column, is_fact_table, detail_storage_table
+except ImportError:
+    from db_schema import PAYROLL_TABLE, PAYROLL_DETAILS_COLUMNS, SCALED_COLUMNS
+    from dimensions import DIMENSIONS, dimension_id_column, is_fact_table, detail_storage_table
+
+HITS_TABLE = 'payroll_keyword_hits'
+KEYWORDS_TABLE = 'payroll_keywords'
+
+# Default keywords of the cleansing steps and the reconcile audit
+KEYWORDS = ['合计', '小计', '加班', '半天', '：', '月']
+
+# Text columns covered by the index (everything except the four amount columns)
+TEXT_COLUMNS = [col for col in PAYROLL_DETAILS_COLUMNS if col not in SCALED_COLUMNS]
+
+TRIGGER_EVENTS = ('insert', 'update', 'delete')
+
+
+def trigger_name(table_name: str, event: str) -> str:
+    return f"trg_{table_name}_keyword_{event}"
+
+
+def keyword_index_exists(conn: sqlite3.Connection) -> bool:
+    """True if the keyword index has been enabled on this database."""
+    return conn.execute(
+        "SELECT 1 FROM sqlite_master WHERE type='table' AND name=?", (HITS_TABLE,)
+    ).fetchone() is not None
+
+
+def load_keywords(conn: sqlite3.Connection) -> List[str]:
+    return [row[0] for row in conn.execute(f"SELECT keyword FROM {KEYWORDS_TABLE} ORDER BY keyword")]
+
+
+def _text_value(col: str, ref: str, normalized: bool) -> str:
+    """SQL expression for the text of col in row ref (NEW/OLD or a table alias)."""
+    if normalized and col in DIMENSIONS:
+        return f"(SELECT name FROM {DIMENSIONS[col]} WHERE id = {ref}.{dimension_id_column(col)})"
+    return f"{ref}.{col}"
+
+
+def _insert_hits_sql(ref: str, rowid: str, normalized: bool) -> str:
+    """INSERT of the hits of one row (inside a trigger body)."""
+    values = ' UNION ALL '.join(
+        f"SELECT '{col}' AS col, {_text_value(col, ref, normalized)} AS value" for col in TEXT_COLUMNS
+    )
+    return (
+        f"INSERT OR IGNORE INTO {HITS_TABLE} (keyword, col, row_id) "
+        f"SELECT k.keyword, v.col, {rowid} FROM {KEYWORDS_TABLE} k, ({values}) v "
+        f"WHERE instr(v.value, k.keyword) > 0;"
+    )
+
+
+def create_keyword_tables(conn: sqlite3.Connection, keywords: Optional[Iterable[str]] = None):
+    """Create the keyword list and hits tables; keywords replaces the stored list if given."""
+    conn.execute(f"CREATE TABLE IF NOT EXISTS {KEYWORDS_TABLE} (keyword TEXT PRIMARY KEY)")
+    conn.execute(f"""
+    CREATE TABLE IF NOT EXISTS {HITS_TABLE} (
+        keyword TEXT NOT NULL,
+        col TEXT NOT NULL,
+        row_id INTEGER NOT NULL,
+        PRIMARY KEY (keyword, col, row_id)
+    ) WITHOUT ROWID
+    """)
+    conn.execute(f"CREATE INDEX IF NOT EXISTS idx_{HITS_TABLE}_row_id ON {HITS_TABLE} (row_id)")
+    if keywords is not None:
+        conn.execute(f"DELETE FROM {KEYWORDS_TABLE}")
+        conn.executemany(
+            f"INSERT OR IGNORE INTO {KEYWORDS_TABLE} (keyword) VALUES (?)", ((k,) for k in keywords)
+        )
+    elif conn.execute(f"SELECT COUNT(*) FROM {KEYWORDS_TABLE}").fetchone()[0] == 0:
+        conn.executemany(f"INSERT INTO {KEYWORDS_TABLE} (keyword) VALUES (?)", ((k,) for k in KEYWORDS))
+
+
+def create_keyword_triggers(conn: sqlite3.Connection, table_name: str):
+    """Keep the hits in step with writes to table_name (the detail storage table)."""
+    normalized = is_fact_table(conn, table_name)
+    watched = [
+        dimension_id_column(col) if normalized and col in DIMENSIONS else col for col in TEXT_COLUMNS
+    ]
+    conn.execute(f"""
+    CREATE TRIGGER IF NOT EXISTS {trigger_name(table_name, 'insert')} AFTER INSERT ON {table_name}
+    BEGIN
+        {_insert_hits_sql('NEW', 'NEW.rowid', normalized)}
+    END
+    """)
+    conn.execute(f"""
+    CREATE TRIGGER IF NOT EXISTS {trigger_name(table_name, 'update')}
+    AFTER UPDATE OF {', '.join(watched)} ON {table_name}
+    BEGIN
+        DELETE FROM {HITS_TABLE} WHERE row_id = OLD.rowid;
+        {_insert_hits_sql('NEW', 'NEW.rowid', normalized)}
+    END
+    """)
+    conn.execute(f"""
+    CREATE TRIGGER IF NOT EXISTS {trigger_name(table_name, 'delete')} AFTER DELETE ON {table_name}
+    BEGIN
+        DELETE FROM {HITS_TABLE} WHERE row_id = OLD.rowid;
+    END
+    """)
+
+
+def drop_keyword_triggers(conn: sqlite3.Connection, table_name: str):
+    for event in TRIGGER_EVENTS:
+        conn.execute(f"DROP TRIGGER IF EXISTS {trigger_name(table_name, event)}")
+
+
+def rebuild_keyword_index(conn: sqlite3.Connection, table_name: Optional[str] = None) -> int:
+    """
+    Refill the hits from table_name (default: the current detail storage table)
+    and (re)create its triggers. Does not commit.
+
+    Returns:
+        int: Number of hits
+    """
+    if table_name is None:
+        table_name = detail_storage_table(conn)
+    normalized = is_fact_table(conn, table_name)
+    conn.execute(f"DELETE FROM {HITS_TABLE}")
+    for col in TEXT_COLUMNS:
+        conn.execute(f"""
+        INSERT INTO {HITS_TABLE} (keyword, col, row_id)
+        SELECT k.keyword, '{col}', t.rowid
+        FROM {table_name} t JOIN {KEYWORDS_TABLE} k
+          ON instr({_text_value(col, 't', normalized)}, k.keyword) > 0
+        """)
+    drop_keyword_triggers(conn, table_name)
+    create_keyword_triggers(conn, table_name)
+    return conn.execute(f"SELECT COUNT(*) FROM {HITS_TABLE}").fetchone()[0]
+
+
+def refresh_keyword_index(conn: sqlite3.Connection, table_name: Optional[str] = None) -> Optional[int]:
+    """Rebuild the index if it is enabled (after the storage table was replaced). Does not commit."""
+    if not keyword_index_exists(conn):
+        return None
+    return rebuild_keyword_index(conn, table_name)
+
+
+def drop_keyword_index(conn: sqlite3.Connection, table_name: Optional[str] = None):
+    """Remove the triggers and the shadow tables. Does not commit."""
+    if table_name is None:
+        table_name = detail_storage_table(conn)
+    drop_keyword_triggers(conn, table_name)
+    conn.execute(f"DROP TABLE IF EXISTS {HITS_TABLE}")
+    conn.execute(f"DROP TABLE IF EXISTS {KEYWORDS_TABLE}")
+
+
+def keyword_index_ready(conn: sqlite3.Connection, keywords: Iterable[str],
+                        view_name: str = PAYROLL_TABLE) -> bool:
+    """True if the index is enabled, maintained on the live table and covers every keyword."""
+    if not keyword_index_exists(conn):
+        return False
+    table_name = detail_storage_table(conn, view_name)
+    has_trigger = conn.execute(
+        "SELECT 1 FROM sqlite_master WHERE type='trigger' AND name=?",
+        (trigger_name(table_name, 'insert'),)
+    ).fetchone() is not None
+    return has_trigger and set(keywords) <= set(load_keywords(conn))
+
+
+def keyword_rowid_filter(keywords: Iterable[str], columns: Optional[Iterable[str]] = None) -> str:
+    """
+    WHERE condition on payroll_details selecting the rows whose text columns
+    (or only the given columns) contain any of the keywords, answered from the index.
+    Equivalent to OR'ing `col LIKE '%keyword%'` (the keywords contain no LIKE wildcards).
+    """
+    keyword_list = ', '.join(f"'{k}'" for k in keywords)
+    condition = f"keyword IN ({keyword_list})"
+    if columns is not None:
+        column_list = ', '.join(f"'{c}'" for c in columns)
+        condition += f" AND col IN ({column_list})"
+    return f"rowid IN (SELECT row_id FROM {HITS_TABLE} WHERE {condition})"
@@ -5,13 +5,23 @@ import pandas as pd
 import sqlite3
 import logging
 from decimal import Decimal, ROUND_HALF_UP
-from typing import List
+from typing import List, Optional
 try:
     from .special_logic import special_logic_preprocess_df
-    from .config import expected_columns, COMMON_COL_COUNT, setup_global_logging
+    from .config import expected_columns, COMMON_COL_COUNT, setup_global_logging, TEXT_PLACEHOLDERS, EMPTY_TEXT_VALUE
+    from .db_schema import (
+        PAYROLL_TABLE, LOAD_LOG_TABLE, PAYROLL_DETAILS_COLUMNS, SCALED_COLUMNS,
+        create_payroll_details_table, create_load_log_table, is_scaled_table, to_scaled_int, scaled_column,
+    )
+    from .dimensions import DIMENSIONS, is_normalized, is_fact_table, fact_table_name, dimension_id_column, get_dimension_cache
 except ImportError:
     from special_logic import special_logic_preprocess_df
-    from config import expected_columns, COMMON_COL_COUNT, setup_global_logging
+    from config import expected_columns, COMMON_COL_COUNT, setup_global_logging, TEXT_PLACEHOLDERS, EMPTY_TEXT_VALUE
+    from db_schema import (
+        PAYROLL_TABLE, LOAD_LOG_TABLE, PAYROLL_DETAILS_COLUMNS, SCALED_COLUMNS,
+        create_payroll_details_table, create_load_log_table, is_scaled_table, to_scaled_int, scaled_column,
+    )
+    from dimensions import DIMENSIONS, is_normalized, is_fact_table, fact_table_name, dimension_id_column, get_dimension_cache
 
 # Set up logging using global configuration
 setup_global_logging()
@@ -329,7 +339,24 @@ def _validate_and_fix_dataframe_columns(df):
 
 
 
-def load_df_to_db(df: pd.DataFrame, file_name: str, sheet_name: str, table_index: int = 0) -> str:
+def normalize_text_value(value):
+    """
+    String normalization for CHAR columns before insert.
+
+    None / NaN cells and placeholder strings ('None', 'nan', ...) become
+    EMPTY_TEXT_VALUE ('' or NULL, see config.py); any other value is str().
+    A plain astype(str) would store the literal 'None' instead.
+    """
+    if value is None or (not isinstance(value, str) and pd.isna(value)):
+        return EMPTY_TEXT_VALUE
+    text = str(value)
+    if text in TEXT_PLACEHOLDERS:
+        return EMPTY_TEXT_VALUE
+    return text
+
+
+def load_df_to_db(df: pd.DataFrame, file_name: str, sheet_name: str, table_index: int = 0,
+                  table_name: str = PAYROLL_TABLE, log_table_name: str = LOAD_LOG_TABLE) -> Optional[int]:
     """
     Load a dataframe to SQLite database with the specified table structure.
     
@@ -338,9 +365,12 @@ def load_df_to_db(df: pd.DataFrame, file_name: str, sheet_name: str, table_index
         file_name (str): The name of the Excel file
         sheet_name (str): The name of the sheet being processed
         table_index (int): The index of the table being processed (e.g., 1 for 表一)
+        table_name (str): Target detail table (payroll_details, or a staging table during a rebuild)
+        log_table_name (str): Target log table (load_log, or a staging table during a rebuild)
         
     Returns:
-        str: Success message or error message
+        Optional[int]: Number of rows loaded, or None if the dataframe could not be
+            loaded (the error is logged)
     """
     try:
         # 在函数开始时，移除df.columns中的所有空格和sheet_name中的空格
@@ -376,22 +406,7 @@ def load_df_to_db(df: pd.DataFrame, file_name: str, sheet_name: str, table_index
         df, sheet_name, file_name = special_logic_preprocess_df(df, sheet_name, file_name, table_index)
         
         # Define the expected columns and their data types
-        expected_columns = {
-            '文件名': 'CHAR(100)',
-            'sheet名': 'CHAR(100)',
-            '职员全名': 'CHAR(20)',
-            '日期': 'CHAR(100)', 
-            '客户名称': 'CHAR(60)',
-            '型号': 'CHAR(100)',
-            '工序全名': 'CHAR(100)',
-            '工序': 'CHAR(100)',
-            '计件数量': 'NUMERIC(10,2)',
-            '系数': 'NUMERIC(10,2)',
-            '定额': 'NUMERIC(10,2)',
-            '金额': 'NUMERIC(10,2)',
-            '备注': 'CHAR(100)',
-            '代码': 'CHAR(12)'
-        }
+        expected_columns = PAYROLL_DETAILS_COLUMNS
         
         # Filter dataframe to only include columns that exist in expected columns
         valid_columns = [col for col in df.columns if col in expected_columns.keys()]
@@ -411,21 +426,12 @@ def load_df_to_db(df: pd.DataFrame, file_name: str, sheet_name: str, table_index
             conn = sqlite3.connect(os.environ.get("SQLITE_DB_PATH"))
             
             # Create load_log table if it doesn't exist
-            create_log_table_sql = """
-            CREATE TABLE IF NOT EXISTS load_log (
-                file_name CHAR(50),
-                sheet_name CHAR(50),
-                table_index INT,
-                discarded_columns CHAR(200),
-                discarded_cols_num INT
-            )
-            """
-            conn.execute(create_log_table_sql)
+            create_load_log_table(conn, log_table_name)
             
             # Insert log record
             discarded_columns_str = ', '.join(discarded_columns)
-            insert_log_sql = """
-            INSERT INTO load_log (file_name, sheet_name, table_index, discarded_columns, discarded_cols_num)
+            insert_log_sql = f"""
+            INSERT INTO {log_table_name} (file_name, sheet_name, table_index, discarded_columns, discarded_cols_num)
             VALUES (?, ?, ?, ?, ?)
             """
             conn.execute(insert_log_sql, (file_name, sheet_name, table_index, discarded_columns_str, discarded_cols_num))
@@ -449,21 +455,25 @@ def load_df_to_db(df: pd.DataFrame, file_name: str, sheet_name: str, table_index
                 logger.info("3################################################################################################")
         
         if not valid_columns:
-            return "Error: No valid columns found in DataFrame that match expected columns"
+            logger.error(f"File: {file_name}, Sheet: {sheet_name}, Table: {table_index}, "
+                         f"Result: Error: No valid columns found in DataFrame that match expected columns")
+            return None
         
         # Create a filtered dataframe with only valid columns
         df = df[valid_columns]
         
         # Connect to SQLite database using the configured path
-        conn = sqlite3.connect(os.environ.get("SQLITE_DB_PATH"))
+        db_path = os.environ.get("SQLITE_DB_PATH")
+        conn = sqlite3.connect(db_path)
+        
+        # Normalized storage: payroll_details is a view, rows go to its fact table
+        if is_normalized(conn, table_name):
+            table_name = fact_table_name(table_name)
         
         # Create table if it doesn't exist with the superset of columns
-        create_table_sql = f"""
-        CREATE TABLE IF NOT EXISTS payroll_details (
-            {', '.join([f'{col} {dtype}' for col, dtype in expected_columns.items()])}
-        )
-        """
-        conn.execute(create_table_sql)
+        create_payroll_details_table(conn, table_name)
+        scaled = is_scaled_table(conn, table_name)
+        normalized = is_fact_table(conn, table_name)
         
         # Prepare the dataframe for insertion
         # Create a copy of the dataframe to avoid SettingWithCopyWarning
@@ -520,10 +530,26 @@ def load_df_to_db(df: pd.DataFrame, file_name: str, sheet_name: str, table_index
                         return s
                     df[col] = df[col].apply(process_date)
                 else:
-                    df[col] = df[col].astype(str)
+                    df[col] = df[col].apply(normalize_text_value).astype(object)
+        
+        # Integer-scaled storage: write <col>_x100 integers, the decimal columns are generated
+        if scaled:
+            for col in SCALED_COLUMNS:
+                df[scaled_column(col)] = df[col].apply(to_scaled_int)
+            df = df.drop(columns=SCALED_COLUMNS)
+        
+        # Normalized storage: replace the text columns by their dimension ids
+        if normalized:
+            cache = get_dimension_cache(db_path)
+            for col in DIMENSIONS:
+                df[dimension_id_column(col)] = cache.encode_values(conn, col, df[col].tolist())
+            df = df.drop(columns=list(DIMENSIONS))
+            # Commit new dimension values now so cached ids stay valid even if to_sql fails
+            conn.commit()
         
         # Insert data into database (append mode)
-        df.to_sql('payroll_details', conn, if_exists='append', index=False)
+        df.to_sql(table_name, conn, if_exists='append', index=False)
+        conn.commit()
         
         # Close connection
         conn.close()
@@ -532,11 +558,11 @@ def load_df_to_db(df: pd.DataFrame, file_name: str, sheet_name: str, table_index
         success_message = f"Successfully loaded {len(df)} rows to database"
         logger.info(f"File: {file_name}, Sheet: {sheet_name}, Table: {table_index}, Result: {success_message}")
         
-        return success_message
+        return len(df)
         
     except Exception as e:
         # Log the error to log.txt
         error_message = f"Error loading data to database: {str(e)}"
         logger.error(f"File: {file_name}, Sheet: {sheet_name}, Table: {table_index}, Result: {error_message}")
         
-        return error_message
+        return None
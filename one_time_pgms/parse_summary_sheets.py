@@ -7,7 +7,9 @@ parse_summary_sheets.py — 一次性脚本：解析 Excel"汇总"sheet 入库
 - ❌ 禁止对 payroll_details / load_log / quota / column_seq 任何写操作
 - ❌ 禁止 DROP/ALTER 任何表
 
-执行前自动备份 DB 到 ../payroll_database.db.backup_YYYYMMDD_HHMMSS
+执行前对白名单内可写的表 (WRITE_TABLES) 做逻辑快照 (payroll_snapshots.py,
+只保存这些表, 不再整库复制), 自动只保留最近几份; 回滚:
+    python payroll_snapshots.py restore <快照文件>
 通过 SQL 写白名单包装函数 safe_execute() 强制只允许白名单写操作。
 通过 PRAGMA query_only 在跑完建表后切到只读模式。
 
@@ -17,10 +19,8 @@ import argparse
 import json
 import os
 import re
-import shutil
 import sqlite3
 import sys
-import time
 from collections import OrderedDict
 from decimal import Decimal
 from pathlib import Path
@@ -180,6 +180,10 @@ def normalize_row(raw_row, file_name, sheet_name, row_idx, header_row=None):
     }
 
 
+# 本脚本允许写入的表 (safe_execute 白名单, 也是执行前快照的范围)
+WRITE_TABLES = ["payroll_summary"]
+
+
 def safe_execute(conn, sql, params=None, allow_write=False):
     """SQL 白名单包装：只允许 SELECT 和白名单写操作"""
     sql_stripped = " ".join(sql.strip().split()).upper()  # 合并空白 + 大写
@@ -188,11 +192,13 @@ def safe_execute(conn, sql, params=None, allow_write=False):
         return cur
     if not allow_write:
         raise PermissionError(f"❌ 拒绝非白名单写操作: {sql_stripped[:80]}")
-    # 白名单写：CREATE TABLE payroll_summary / INSERT INTO payroll_summary
-    allowed_patterns = [
-        r"^CREATE\s+TABLE\s+IF\s+NOT\s+EXISTS\s+PAYROLL_SUMMARY",
-        r"^INSERT\s+INTO\s+PAYROLL_SUMMARY",
-    ]
+    # 白名单写：CREATE TABLE / INSERT INTO WRITE_TABLES (即 payroll_summary)
+    allowed_patterns = []
+    for table in WRITE_TABLES:
+        allowed_patterns += [
+            rf"^CREATE\s+TABLE\s+IF\s+NOT\s+EXISTS\s+{table.upper()}\b",
+            rf"^INSERT\s+INTO\s+{table.upper()}\b",
+        ]
     if not any(re.match(p, sql_stripped) for p in allowed_patterns):
         raise PermissionError(f"❌ 拒绝非白名单写操作: {sql_stripped[:80]}")
     cur = conn.execute(sql, params or ())
@@ -200,14 +206,15 @@ def safe_execute(conn, sql, params=None, allow_write=False):
 
 
 def backup_db():
-    """备份 DB 到 .backup_YYYYMMDD_HHMMSS"""
+    """执行前快照: 只保存 WRITE_TABLES (逻辑快照, 见 payroll_snapshots.py)"""
     if not DB_PATH.exists():
         print(f"⚠️ DB 不存在: {DB_PATH}")
         return None
-    ts = time.strftime("%Y%m%d_%H%M%S")
-    backup_path = DB_PATH.parent / f"payroll_database.db.backup_{ts}"
-    shutil.copy2(DB_PATH, backup_path)
-    print(f"✅ DB 已备份: {backup_path}")
+    sys.path.insert(0, str(PROJECT_ROOT))
+    from payroll_snapshots import logical_snapshot
+
+    backup_path = logical_snapshot(DB_PATH, WRITE_TABLES, label="parse_summary_sheets")
+    print(f"✅ DB 已快照 ({', '.join(WRITE_TABLES)}): {backup_path}")
     return backup_path
 
 
@@ -407,7 +407,14 @@ def audit_db_consistency(conn):
         })
 
     # 4. 小计行残留（"袁崇雷合计"/"姜浩合计"等）
-    cur = conn.execute("SELECT 职员全名, COUNT(*) FROM payroll_details WHERE 职员全名 LIKE '%合计%' OR 职员全名 LIKE '%小计%' GROUP BY 职员全名")
+    #    启用了关键字索引 (excel_processor/keyword_index.py) 时按索引取 rowid，不扫描全表
+    sys.path.insert(0, str(PROJECT_ROOT))
+    from excel_processor.keyword_index import keyword_index_ready, keyword_rowid_filter
+    if keyword_index_ready(conn, ['合计', '小计']):
+        match = keyword_rowid_filter(['合计', '小计'], ['职员全名'])
+    else:
+        match = "职员全名 LIKE '%合计%' OR 职员全名 LIKE '%小计%'"
+    cur = conn.execute(f"SELECT 职员全名, COUNT(*) FROM payroll_details WHERE {match} GROUP BY 职员全名")
     rows = cur.fetchall()
     if rows:
         total = sum(c for _, c in rows)
@@ -0,0 +1,257 @@
+#!/usr/bin/env python3
+"""
+Before/after diff of two payroll databases, computed in SQL.
+
+Verifying a cleansing step or a special-logic change used to mean writing a
+one-off script such as one_time_pgms/build_l20_report.py. Those scripts open
+two connections to hardcoded paths and pull the rows into Python to compare
+them. This command ATTACHes both database files (read-only) to one in-memory
+connection, so each comparison is a single query and no rows are
+materialized in Python:
+
+- per group (文件名, sheet名 by default): row count and SUM(金额) in both
+  databases and their deltas. Only the groups that differ are listed.
+- row level: rows added (new EXCEPT old) and removed (old EXCEPT new) over a
+  chosen column subset. EXCEPT compares sets, so a row that occurs twice on one
+  side and once on the other is not reported. The group deltas still show it.
+
+The report is written with cleansing_report.HtmlReport, so it is streamed and
+paginated (see PAYROLL_REPORT_PAGE_SIZE / PAYROLL_REPORT_GZIP).
+
+The old database can be any file, or the name of a full snapshot in
+SNAPSHOT_DIR (see payroll_snapshots.py). A logical snapshot works too if it
+contains the compared table.
+
+Usage:
+    python payroll_diff.py OLD_DB [--new NEW_DB | --shard YEAR] [--table T]
+                           [--columns C ...] [--group-by C ...] [--amount-column C]
+                           [--where SQL] [--limit N] [--output PATH]
+"""
+
+import sys
+import html
+import sqlite3
+import argparse
+from pathlib import Path
+
+from cleansing_report import HtmlReport
+from payroll_shards import shard_db_path_for_year
+from payroll_snapshots import SNAPSHOT_DIR
+
+DB_PATH = Path(__file__).parent.parent / "payroll_database.db"
+OUTPUT_PATH = Path(__file__).parent / "db_diff_report.html"
+
+PAYROLL_TABLE = "payroll_details"
+GROUP_COLUMNS = ["文件名", "sheet名"]
+AMOUNT_COLUMN = "金额"
+
+OLD = "old"
+NEW = "new"
+
+REPORT_STYLE = """
+.num { text-align: right; font-family: Consolas, monospace; }
+.summary td { white-space: normal; }
+"""
+
+
+def _quote(column: str) -> str:
+    return '"' + column.replace('"', '""') + '"'
+
+
+def connect_pair(old_path: Path, new_path: Path) -> sqlite3.Connection:
+    """In-memory connection with old_path attached as `old` and new_path as `new`, both read-only."""
+    conn = sqlite3.connect("file::memory:", uri=True)
+    for schema, path in ((OLD, old_path), (NEW, new_path)):
+        conn.execute(f"ATTACH DATABASE ? AS {schema}", (f"file:{Path(path).resolve()}?mode=ro",))
+    return conn
+
+
+def table_columns(conn: sqlite3.Connection, schema: str, table: str) -> list:
+    """Columns of schema.table as in `SELECT *` (hidden virtual-table columns excluded)."""
+    return [row[1] for row in conn.execute(f"PRAGMA {schema}.table_xinfo({_quote(table)})") if row[6] != 1]
+
+
+def compared_columns(conn: sqlite3.Connection, table: str, columns: list = None) -> list:
+    """
+    Columns compared at row level: the requested ones, or every column present in
+    both databases (in the order of the new one).
+    """
+    old_columns = table_columns(conn, OLD, table)
+    new_columns = table_columns(conn, NEW, table)
+    if not old_columns or not new_columns:
+        missing = OLD if not old_columns else NEW
+        raise ValueError(f"table {table} not found in the {missing} database")
+    if columns:
+        unknown = [c for c in columns if c not in old_columns or c not in new_columns]
+        if unknown:
+            raise ValueError(f"columns not in both databases: {', '.join(unknown)}")
+        return list(columns)
+    return [c for c in new_columns if c in old_columns]
+
+
+def _filtered(schema: str, table: str, where: str = None) -> str:
+    sql = f"{schema}.{_quote(table)}"
+    if where:
+        return f"(SELECT * FROM {sql} WHERE {where})"
+    return sql
+
+
+def group_deltas_sql(table: str, group_by: list, amount_column: str, where: str = None) -> str:
+    """
+    (group columns..., old rows, new rows, row delta, old amount, new amount, amount delta)
+    of every group whose row count or amount differs. Groups present on one side
+    only count as 0 rows / 0 amount on the other.
+    """
+    keys = ", ".join(_quote(c) for c in group_by)
+    amount = f"ROUND(SUM(CAST({_quote(amount_column)} AS REAL)), 2)"
+    join_on = " AND ".join(f"{{side}}.{_quote(c)} IS k.{_quote(c)}" for c in group_by)
+    return f"""
+        WITH o AS (SELECT {keys}, COUNT(*) AS n, {amount} AS amount
+                   FROM {_filtered(OLD, table, where)} GROUP BY {keys}),
+             n AS (SELECT {keys}, COUNT(*) AS n, {amount} AS amount
+                   FROM {_filtered(NEW, table, where)} GROUP BY {keys}),
+             k AS (SELECT {keys} FROM o UNION SELECT {keys} FROM n)
+        SELECT {", ".join(f"k.{_quote(c)}" for c in group_by)},
+               IFNULL(o.n, 0), IFNULL(n.n, 0), IFNULL(n.n, 0) - IFNULL(o.n, 0),
+               IFNULL(o.amount, 0), IFNULL(n.amount, 0),
+               ROUND(IFNULL(n.amount, 0) - IFNULL(o.amount, 0), 2)
+        FROM k
+        LEFT JOIN o ON {join_on.format(side="o")}
+        LEFT JOIN n ON {join_on.format(side="n")}
+        WHERE o.n IS NOT n.n OR o.amount IS NOT n.amount
+        ORDER BY {", ".join(f"k.{_quote(c)}" for c in group_by)}
+    """
+
+
+def except_sql(table: str, columns: list, first: str, second: str, where: str = None) -> str:
+    """Distinct rows (over columns) of first.table that are not in second.table."""
+    column_list = ", ".join(_quote(c) for c in columns)
+    return (
+        f"SELECT {column_list} FROM {_filtered(first, table, where)} "
+        f"EXCEPT SELECT {column_list} FROM {_filtered(second, table, where)}"
+    )
+
+
+def diff_totals(conn: sqlite3.Connection, table: str, amount_column: str, where: str = None) -> dict:
+    """{schema: (rows, amount)} for the whole (filtered) table on both sides."""
+    return {
+        schema: conn.execute(
+            f"SELECT COUNT(*), ROUND(SUM(CAST({_quote(amount_column)} AS REAL)), 2) "
+            f"FROM {_filtered(schema, table, where)}"
+        ).fetchone()
+        for schema in (OLD, NEW)
+    }
+
+
+def count_sql(sql: str) -> str:
+    return f"SELECT COUNT(*) FROM ({sql})"
+
+
+def export_to_html(conn: sqlite3.Connection, old_path: Path, new_path: Path, table: str,
+                   columns: list, group_by: list, amount_column: str, where: str = None,
+                   limit: int = None, output_path: Path = OUTPUT_PATH):
+    """
+    Write the diff report. Returns (report path, {'groups', 'added', 'removed'} counts).
+    The row sets are counted in full; with limit only the first `limit` rows of each are listed.
+    """
+    totals = diff_totals(conn, table, amount_column, where)
+    added_sql = except_sql(table, columns, NEW, OLD, where)
+    removed_sql = except_sql(table, columns, OLD, NEW, where)
+    counts = {
+        "added": conn.execute(count_sql(added_sql)).fetchone()[0],
+        "removed": conn.execute(count_sql(removed_sql)).fetchone()[0],
+    }
+    order_by = " ORDER BY " + ", ".join(str(i) for i in range(1, len(columns) + 1))
+    limit_sql = f" LIMIT {int(limit)}" if limit is not None else ""
+
+    with HtmlReport(output_path, f"DB diff - {table}", style=REPORT_STYLE) as report:
+        report.write(f"<h1>DB diff - {table}</h1>\n")
+        summary = [
+            ["old", str(old_path), f"{totals[OLD][0]:,}", totals[OLD][1]],
+            ["new", str(new_path), f"{totals[NEW][0]:,}", totals[NEW][1]],
+        ]
+        report.write('<div class="summary">\n')
+        report.table(["", "database", "rows", f"SUM({amount_column})"], summary)
+        report.write("</div>\n")
+        report.write(
+            f"<p>Filter: {html.escape(where or '(none)')}<br>"
+            f"Row-level columns: {html.escape(', '.join(columns))}</p>\n"
+        )
+
+        report.write(f"<h2>Groups with a different row count or amount ({', '.join(group_by)})</h2>\n")
+        counts["groups"] = report.table(
+            group_by + ["old rows", "new rows", "Δ rows",
+                        f"old {amount_column}", f"new {amount_column}", f"Δ {amount_column}"],
+            conn.execute(group_deltas_sql(table, group_by, amount_column, where)),
+            cell_classes={len(group_by) + i: "num" for i in range(6)},
+        )
+
+        for title, sql, key in (("Added rows (new EXCEPT old)", added_sql, "added"),
+                                ("Removed rows (old EXCEPT new)", removed_sql, "removed")):
+            shown = min(counts[key], limit) if limit is not None else counts[key]
+            report.write(f"<h2>{title}: {counts[key]:,}</h2>\n")
+            if shown < counts[key]:
+                report.write(f"<p>Only the first {shown:,} are listed (--limit).</p>\n")
+            report.table(columns, conn.execute(sql + order_by + limit_sql))
+
+    return report.path, counts
+
+
+def resolve_database(name: str) -> Path:
+    """A database file path, or the name of a snapshot in SNAPSHOT_DIR."""
+    path = Path(name)
+    if not path.exists() and (SNAPSHOT_DIR / name).exists():
+        path = SNAPSHOT_DIR / name
+    return path
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Before/after diff of two payroll databases (in SQL)")
+    parser.add_argument("old", help="Old database file, or a snapshot name (see payroll_snapshots.py list)")
+    parser.add_argument("--new", help=f"New database file (default {DB_PATH})")
+    parser.add_argument("--shard", help="Use this year shard database as the new database")
+    parser.add_argument("--table", default=PAYROLL_TABLE, help=f"Compared table (default {PAYROLL_TABLE})")
+    parser.add_argument("--columns", nargs="+",
+                        help="Columns compared at row level (default: all columns in both databases)")
+    parser.add_argument("--group-by", nargs="+", default=GROUP_COLUMNS,
+                        help=f"Group columns for the count/amount deltas (default {' '.join(GROUP_COLUMNS)})")
+    parser.add_argument("--amount-column", default=AMOUNT_COLUMN,
+                        help=f"Column summed per group (default {AMOUNT_COLUMN})")
+    parser.add_argument("--where", help="SQL condition applied to both databases, e.g. \"sheet名 = '装配喷漆'\"")
+    parser.add_argument("--limit", type=int, help="List at most N added / removed rows (counts stay exact)")
+    parser.add_argument("--output", type=Path, default=OUTPUT_PATH, help=f"Report path (default {OUTPUT_PATH.name})")
+    args = parser.parse_args()
+
+    old_path = resolve_database(args.old)
+    if args.shard:
+        new_path = shard_db_path_for_year(args.shard)
+    else:
+        new_path = Path(args.new) if args.new else DB_PATH
+    for path in (old_path, new_path):
+        if not path.exists():
+            print(f"Error: database not found: {path}")
+            sys.exit(1)
+
+    conn = connect_pair(old_path, new_path)
+    try:
+        try:
+            columns = compared_columns(conn, args.table, args.columns)
+        except ValueError as e:
+            print(f"Error: {e}")
+            sys.exit(1)
+        print(f"Comparing {args.table}: {old_path} -> {new_path}")
+        path, counts = export_to_html(
+            conn, old_path, new_path, args.table, columns, args.group_by,
+            args.amount_column, args.where, args.limit, args.output,
+        )
+    finally:
+        conn.close()
+
+    print(f"  groups with differences: {counts['groups']:,}")
+    print(f"  rows added:   {counts['added']:,}")
+    print(f"  rows removed: {counts['removed']:,}")
+    print(f"Report written: {path}")
+
+
+if __name__ == "__main__":
+    main()
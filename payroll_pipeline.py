@@ -0,0 +1,395 @@
+#!/usr/bin/env python3
+"""
+Non-interactive payroll refresh pipeline with per-stage checkpoints.
+
+Runs the same stages as sqlite_payroll_details_refresh.sh (batch_process ingest,
+then cleansing steps 0-10), but calls each stage's main() as a function in this
+process with --yes, so no `yes yes |` pipe is needed. The start, end, duration
+and outcome of every stage are recorded in the pipeline_runs table of the
+payroll database. A failed run can be resumed from the stage that failed
+without repeating the ingest and the steps that already completed. The run's
+options (--staging, --keep-snapshot, --incremental, --workers, --to) are stored
+with it in pipeline_run_options and reapplied by --resume; giving a different
+value on --resume is refused (except --to, which may be changed).
+
+Usage:
+    python payroll_pipeline.py [--from STAGE] [--to STAGE] [--shard YEAR]
+                               [--staging [--keep-snapshot]] [--incremental]
+                               [--workers N]
+    python payroll_pipeline.py --resume [--to STAGE] [--shard YEAR]
+    python payroll_pipeline.py --status [--shard YEAR]
+    python payroll_pipeline.py --list
+
+Stages: ingest, step0 ... step10 (see --list). --staging / --keep-snapshot are
+passed to the ingest stage; --incremental is passed to the cleansing steps so
+they only process files that are new or changed since their last run (see
+cleansing_watermark.py); --workers N parses the dates of steps 5-9 in a pool of
+N processes (see cleansing_parallel.py); --shard YEAR runs every stage against that year's
+shard database (see payroll_shards.py).
+
+Stage step10 only verifies (read-only) that no 'None' placeholders are left:
+load_df_to_db normalizes empty text cells at ingest, so the step 10 UPDATE pass
+is no longer part of a refresh. If the check fails the database was loaded by the
+old loader; run cleansing_none_cleanup_step10.py once without --verify to migrate.
+"""
+
+import os
+import sys
+import json
+import time
+import sqlite3
+import argparse
+import importlib
+import traceback
+from datetime import datetime
+from pathlib import Path
+
+from payroll_shards import shard_db_path_for_year
+
+DB_PATH = Path(__file__).parent.parent / "payroll_database.db"
+RUN_TABLE = "pipeline_runs"
+RUN_OPTIONS_TABLE = "pipeline_run_options"
+
+# Options stored with a run and reapplied by --resume: option -> argparse default
+RUN_OPTIONS = {
+    "staging": False,
+    "keep_snapshot": False,
+    "incremental": False,
+    "workers": 1,
+    "to_stage": None,
+}
+
+# Stored options that --resume may override (e.g. stop earlier or go further)
+RESUME_OVERRIDABLE = {"to_stage"}
+
+# (stage name, module whose main() runs the stage, description)
+STAGES = [
+    ("ingest", "batch_process", "load all Excel files into payroll_details"),
+    ("step0", "cleansing_data_dbcs_handling_step0", "全角转半角"),
+    ("step1", "cleansing_outliers_step1", "delete rows with blank values only"),
+    ("step2", "cleansing_outliers_step2", "fill the date value"),
+    ("step3", "cleansing_outliers_step3", "delete the rows contains '合计'"),
+    ("step4", "cleansing_outliers_step4", "update the 4月 5月"),
+    ("step5", "cleansing_date_handling_step5", "update the date values"),
+    ("step6", "cleansing_date_handling_step6", "complex/mixed date patterns"),
+    ("step7", "cleansing_date_handling_step7", "remaining ~ handling"),
+    ("step8", "cleansing_misc_step8", "misc remaining issues"),
+    ("step9", "cleansing_date_handling_step9", "yy,m / m prefix patterns"),
+    ("step10", "cleansing_none_cleanup_step10", "verify no literal 'None' placeholders"),
+]
+STAGE_NAMES = [name for name, _, _ in STAGES]
+
+# Cleansing steps without a confirmation prompt (no --yes option)
+NO_PROMPT_STAGES = {"step2"}
+
+# Cleansing steps run read-only with --verify (no prompt, no UPDATE)
+VERIFY_STAGES = {"step10"}
+
+# Cleansing steps accepting --workers (date parsing in a process pool)
+PARALLEL_STAGES = {"step5", "step6", "step7", "step8", "step9"}
+
+
+class StageFailed(Exception):
+    pass
+
+
+def ensure_run_table(conn: sqlite3.Connection):
+    conn.execute(f"""
+        CREATE TABLE IF NOT EXISTS {RUN_TABLE} (
+            run_id INTEGER NOT NULL,
+            stage TEXT NOT NULL,
+            status TEXT NOT NULL,
+            started_at TEXT,
+            finished_at TEXT,
+            seconds REAL,
+            message TEXT,
+            PRIMARY KEY (run_id, stage)
+        )
+    """)
+    conn.execute(f"""
+        CREATE TABLE IF NOT EXISTS {RUN_OPTIONS_TABLE} (
+            run_id INTEGER PRIMARY KEY,
+            options TEXT NOT NULL
+        )
+    """)
+
+
+def _connect(db_path: Path) -> sqlite3.Connection:
+    conn = sqlite3.connect(str(db_path))
+    ensure_run_table(conn)
+    return conn
+
+
+def last_run(db_path: Path):
+    """(run_id, {stage: status}) of the most recent run, or (None, {})."""
+    conn = _connect(db_path)
+    run_id = conn.execute(f"SELECT MAX(run_id) FROM {RUN_TABLE}").fetchone()[0]
+    statuses = {}
+    if run_id is not None:
+        statuses = dict(conn.execute(
+            f"SELECT stage, status FROM {RUN_TABLE} WHERE run_id = ?", (run_id,)
+        ).fetchall())
+    conn.close()
+    return run_id, statuses
+
+
+def save_run_options(db_path: Path, run_id: int, args):
+    """Store the RUN_OPTIONS of a new run (as JSON)."""
+    options = {name: getattr(args, name) for name in RUN_OPTIONS}
+    conn = _connect(db_path)
+    conn.execute(
+        f"INSERT OR REPLACE INTO {RUN_OPTIONS_TABLE} (run_id, options) VALUES (?, ?)",
+        (run_id, json.dumps(options)),
+    )
+    conn.commit()
+    conn.close()
+
+
+def load_run_options(db_path: Path, run_id: int):
+    """The stored options of run_id, or None for runs recorded before options were stored."""
+    conn = _connect(db_path)
+    row = conn.execute(
+        f"SELECT options FROM {RUN_OPTIONS_TABLE} WHERE run_id = ?", (run_id,)
+    ).fetchone()
+    conn.close()
+    return json.loads(row[0]) if row else None
+
+
+def apply_run_options(args, stored: dict):
+    """
+    Reapply a resumed run's options to args. An option given on the command line
+    (i.e. not at its default) must match the stored value, except RESUME_OVERRIDABLE.
+    """
+    conflicts = []
+    for name, default in RUN_OPTIONS.items():
+        if name not in stored:
+            continue
+        given = getattr(args, name)
+        if given != default and given != stored[name]:
+            if name in RESUME_OVERRIDABLE:
+                continue
+            conflicts.append(f"--{name.replace('_', '-')} {given} (run: {stored[name]})")
+            continue
+        setattr(args, name, stored[name] if given == default else given)
+    if conflicts:
+        raise StageFailed("options differ from the resumed run: " + ", ".join(conflicts))
+
+
+def record_stage(db_path: Path, run_id: int, stage: str, status: str,
+                 seconds: float = None, message: str = None):
+    """Checkpoint one stage. Uses its own short-lived connection so no lock is held while stages run."""
+    now = datetime.now().isoformat(timespec="seconds")
+    conn = _connect(db_path)
+    if status == "running":
+        conn.execute(
+            f"INSERT OR REPLACE INTO {RUN_TABLE} (run_id, stage, status, started_at) VALUES (?, ?, ?, ?)",
+            (run_id, stage, status, now),
+        )
+    else:
+        conn.execute(
+            f"UPDATE {RUN_TABLE} SET status = ?, finished_at = ?, seconds = ?, message = ? "
+            f"WHERE run_id = ? AND stage = ?",
+            (status, now, seconds, message, run_id, stage),
+        )
+    conn.commit()
+    conn.close()
+
+
+def run_ingest(args):
+    """Stage 'ingest': same as `python batch_process.py [--staging] [--shard YEAR]`."""
+    import batch_process
+    from payroll_shards import resolve_shard_key, update_catalog_entry
+
+    lock_fd = batch_process.acquire_batch_lock()
+    try:
+        ok = batch_process.batch_process_main(
+            staging=args.staging, keep_snapshot=args.keep_snapshot, shard=args.shard
+        )
+    finally:
+        lock_fd.close()
+    if ok is False:
+        raise StageFailed("staging tables failed verification, live tables left untouched")
+    if args.shard:
+        update_catalog_entry(resolve_shard_key(args.shard))
+
+
+def run_cleansing_step(stage: str, module_name: str, args):
+    """Stage 'stepN': the step script's main() with --yes or --verify (and --incremental, --workers, --shard)."""
+    module = importlib.import_module(module_name)
+    if stage in VERIFY_STAGES:
+        argv = ["--verify"]
+    else:
+        argv = [] if stage in NO_PROMPT_STAGES else ["--yes"]
+    if args.incremental:
+        argv.append("--incremental")
+    if args.workers != 1 and stage in PARALLEL_STAGES:
+        argv += ["--workers", str(args.workers)]
+    if args.shard:
+        argv += ["--shard", args.shard]
+    try:
+        module.main(argv)
+    except SystemExit as e:
+        # The step scripts exit 0 when there is nothing to do
+        if e.code not in (None, 0):
+            raise StageFailed(f"{module_name} exited with status {e.code}")
+
+
+def select_stages(args, db_path: Path):
+    """
+    Return (run_id, stage names to run) from --from/--to/--resume. With --resume
+    the run's stored options are reapplied to args first (see apply_run_options).
+    """
+    run_id, statuses = last_run(db_path)
+    if args.resume:
+        if run_id is None:
+            raise StageFailed("no previous run to resume")
+        stored = load_run_options(db_path, run_id)
+        if stored is None:
+            print(f"Warning: run {run_id} has no stored options, resuming with the ones given now")
+        else:
+            apply_run_options(args, stored)
+
+    start = STAGE_NAMES.index(args.from_stage) if args.from_stage else 0
+    end = STAGE_NAMES.index(args.to_stage) if args.to_stage else len(STAGE_NAMES) - 1
+
+    if args.resume:
+        done = [i for i, name in enumerate(STAGE_NAMES) if statuses.get(name) == "done"]
+        started = [i for i, name in enumerate(STAGE_NAMES) if name in statuses]
+        if not started:
+            raise StageFailed(f"run {run_id} has no recorded stages")
+        # continue after the last completed stage, or retry the first recorded one
+        start = max(done) + 1 if done else min(started)
+        return run_id, STAGE_NAMES[start:end + 1]
+
+    return (run_id or 0) + 1, STAGE_NAMES[start:end + 1]
+
+
+def print_status(db_path: Path):
+    conn = _connect(db_path)
+    run_id = conn.execute(f"SELECT MAX(run_id) FROM {RUN_TABLE}").fetchone()[0]
+    if run_id is None:
+        print("No pipeline runs recorded.")
+        conn.close()
+        return
+    print(f"Run {run_id} ({db_path}):")
+    print(f"  {'stage':<8} {'status':<8} {'started':<20} {'seconds':>9}  message")
+    rows = {row[0]: row for row in conn.execute(
+        f"SELECT stage, status, started_at, seconds, message FROM {RUN_TABLE} WHERE run_id = ?",
+        (run_id,),
+    )}
+    conn.close()
+    for name in STAGE_NAMES:
+        if name not in rows:
+            print(f"  {name:<8} {'-':<8}")
+            continue
+        _, status, started_at, seconds, message = rows[name]
+        secs = f"{seconds:.1f}" if seconds is not None else ""
+        print(f"  {name:<8} {status:<8} {started_at or '':<20} {secs:>9}  {message or ''}")
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description="Run the payroll refresh pipeline (ingest + cleansing steps 0-10) with checkpoints"
+    )
+    parser.add_argument("--from", dest="from_stage", choices=STAGE_NAMES, help="First stage to run")
+    parser.add_argument("--to", dest="to_stage", choices=STAGE_NAMES, help="Last stage to run")
+    parser.add_argument(
+        "--resume",
+        action="store_true",
+        help="Continue the last run after its last completed stage, with the run's options",
+    )
+    parser.add_argument("--status", action="store_true", help="Show the stages of the last run")
+    parser.add_argument("--list", action="store_true", help="List the stage names")
+    parser.add_argument(
+        "--staging",
+        action="store_true",
+        help="Ingest stage: full rebuild into staging tables, swapped in atomically",
+    )
+    parser.add_argument(
+        "--keep-snapshot",
+        action="store_true",
+        help="Ingest stage: with --staging, keep the replaced tables for rollback",
+    )
+    parser.add_argument(
+        "--incremental",
+        action="store_true",
+        help="Cleansing steps: only process files that are new or changed since the step last ran",
+    )
+    parser.add_argument(
+        "--workers",
+        type=int,
+        default=1,
+        help="Steps 5-9: processes for date parsing (0 = CPU count, default 1 = serial)",
+    )
+    parser.add_argument(
+        "--shard",
+        help="Run every stage against this year shard database (e.g. 2025), see payroll_shards.py",
+    )
+    args = parser.parse_args()
+
+    if args.list:
+        for name, module_name, description in STAGES:
+            print(f"  {name:<8} {module_name:<36} {description}")
+        return
+    if args.resume and args.from_stage:
+        parser.error("--resume and --from cannot be combined")
+
+    if args.shard:
+        db_path = shard_db_path_for_year(args.shard)
+        os.environ["SQLITE_DB_PATH"] = str(db_path)
+    else:
+        db_path = DB_PATH
+        # batch_process.py connects to SQLITE_DB_PATH, the cleansing steps to DB_PATH
+        os.environ.setdefault("SQLITE_DB_PATH", str(DB_PATH))
+
+    if args.status:
+        print_status(db_path)
+        return
+
+    try:
+        run_id, stages = select_stages(args, db_path)
+    except StageFailed as e:
+        print(f"Error: {e}")
+        sys.exit(1)
+    if not stages:
+        print("Nothing to run.")
+        return
+
+    if not args.resume:
+        save_run_options(db_path, run_id, args)
+    print(f"Pipeline run {run_id}: {', '.join(stages)}")
+    if args.resume:
+        options = {name: getattr(args, name) for name in RUN_OPTIONS}
+        print(f"Resumed options: {options}")
+    modules = {name: module_name for name, module_name, _ in STAGES}
+    pipeline_start = time.perf_counter()
+    for stage in stages:
+        print("\n" + "=" * 80)
+        print(f"[{stage}] {modules[stage]}")
+        print("=" * 80)
+        record_stage(db_path, run_id, stage, "running")
+        start = time.perf_counter()
+        try:
+            if stage == "ingest":
+                run_ingest(args)
+            else:
+                run_cleansing_step(stage, modules[stage], args)
+        except (Exception, SystemExit) as e:
+            seconds = time.perf_counter() - start
+            message = str(e) if isinstance(e, StageFailed) else f"{type(e).__name__}: {e}"
+            record_stage(db_path, run_id, stage, "failed", seconds, message)
+            if not isinstance(e, (StageFailed, SystemExit)):
+                traceback.print_exc()
+            print(f"\n[{stage}] FAILED after {seconds:.1f}s: {message}")
+            print("Fix the problem and rerun with: python payroll_pipeline.py --resume"
+                  + (f" --shard {args.shard}" if args.shard else ""))
+            sys.exit(1)
+        seconds = time.perf_counter() - start
+        record_stage(db_path, run_id, stage, "done", seconds)
+        print(f"\n[{stage}] done in {seconds:.1f}s")
+
+    print(f"\nPipeline run {run_id} completed in {time.perf_counter() - pipeline_start:.1f}s")
+
+
+if __name__ == "__main__":
+    main()
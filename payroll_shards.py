@@ -0,0 +1,460 @@
+#!/usr/bin/env python3
+"""
+Optional year-sharded layout of the payroll database.
+
+Each shard is a standalone SQLite file (payroll_shards/payroll_<key>.db) holding
+the payroll_details and load_log rows of its years, keyed by the YYYY prefix of
+文件名 (file_name in load_log). The shard key is the first year of the shard.
+payroll_catalog.db records the shards; connect_catalog() ATTACHes them and
+exposes TEMP union views under the existing table names, so read-only tools can
+query all years at once.
+
+Per-shard work opens the shard file directly. There payroll_details is a real
+table and the rowid-based cleansing steps work unchanged:
+    python batch_process.py --shard 2025
+    python cleansing_outliers_step1.py --shard 2025
+--shard takes any year: with multi-year shards, 2025 selects the shard whose
+range contains it (e.g. payroll_2024.db for 2024-2025), see shard_db_path_for_year().
+
+Usage:
+    python payroll_shards.py split [--years-per-shard N] [--source PATH] [--dry-run]
+    python payroll_shards.py list
+    python payroll_shards.py check
+
+SQLite builds allow at most 10 attached databases by default (MAX_ATTACHED).
+Without --years-per-shard, split uses the smallest number of years per shard
+that keeps the shard count within that limit, so connect_catalog() can still
+attach every shard.
+"""
+
+import os
+import sys
+import sqlite3
+import argparse
+from datetime import datetime
+from pathlib import Path
+
+from excel_processor.db_schema import (
+    PAYROLL_TABLE, LOAD_LOG_TABLE, PAYROLL_DETAILS_COLUMNS,
+    create_payroll_details_table, create_load_log_table, create_payroll_indexes,
+)
+
+DB_PATH = Path(__file__).parent.parent / "payroll_database.db"
+SHARD_DIR = Path(os.environ.get("PAYROLL_SHARD_DIR", DB_PATH.parent / "payroll_shards"))
+CATALOG_PATH = SHARD_DIR / "payroll_catalog.db"
+CATALOG_TABLE = "shard_catalog"
+
+# Sharded table -> column holding the Excel file name
+SHARDED_TABLES = {
+    PAYROLL_TABLE: "文件名",
+    LOAD_LOG_TABLE: "file_name",
+}
+
+# Shard for rows whose file name has no YYYY prefix
+UNKNOWN_SHARD = "unknown"
+
+
+def file_year(file_name):
+    """
+    Year from the YYYY prefix of a payroll file name, e.g. '202506.xls' -> 2025
+    """
+    if file_name and len(file_name) >= 4:
+        try:
+            return int(file_name[:4])
+        except ValueError:
+            return None
+    return None
+
+
+def shard_db_path(shard_key) -> Path:
+    """Path of the shard database file for shard_key (e.g. 2025 or '2025')."""
+    return SHARD_DIR / f"payroll_{shard_key}.db"
+
+
+def _connect_catalog_db() -> sqlite3.Connection:
+    SHARD_DIR.mkdir(parents=True, exist_ok=True)
+    conn = sqlite3.connect(str(CATALOG_PATH))
+    conn.execute(f"""
+    CREATE TABLE IF NOT EXISTS {CATALOG_TABLE} (
+        shard_key TEXT PRIMARY KEY,
+        first_year INT,
+        last_year INT,
+        db_file TEXT,
+        row_count INT,
+        updated_at TEXT
+    )
+    """)
+    return conn
+
+
+def read_catalog() -> list:
+    """
+    Returns:
+        list: (shard_key, first_year, last_year, db_file, row_count, updated_at) ordered by shard_key
+    """
+    if not CATALOG_PATH.exists():
+        return []
+    conn = _connect_catalog_db()
+    rows = conn.execute(f"SELECT * FROM {CATALOG_TABLE} ORDER BY shard_key").fetchall()
+    conn.close()
+    return rows
+
+
+def shard_key_for_year(year, catalog=None) -> str:
+    """Catalog shard whose year range contains year; a new one-year shard otherwise."""
+    if year is None:
+        return UNKNOWN_SHARD
+    for shard_key, first_year, last_year, *_ in (catalog if catalog is not None else read_catalog()):
+        if first_year is not None and first_year <= year <= last_year:
+            return shard_key
+    return str(year)
+
+
+def resolve_shard_key(shard) -> str:
+    """
+    Catalog shard key for a user-supplied --shard value: a year (or the key of a
+    multi-year shard, which is its first year) maps to the shard whose range
+    contains it; 'unknown' stays as is.
+    """
+    shard = str(shard)
+    if shard == UNKNOWN_SHARD:
+        return shard
+    try:
+        year = int(shard)
+    except ValueError:
+        raise ValueError(f"invalid shard {shard!r}: expected a year or '{UNKNOWN_SHARD}'")
+    return shard_key_for_year(year)
+
+
+def shard_db_path_for_year(shard) -> Path:
+    """Shard database file for a --shard value (see resolve_shard_key)."""
+    return shard_db_path(resolve_shard_key(shard))
+
+
+def shard_file_filter(excel_files: list, shard) -> list:
+    """Excel files whose rows belong to the shard of a --shard value (see resolve_shard_key)."""
+    catalog = read_catalog()
+    shard_key = resolve_shard_key(shard)
+    return [f for f in excel_files if shard_key_for_year(file_year(f), catalog) == shard_key]
+
+
+def update_catalog_entry(shard_key: str):
+    """
+    Register shard_key (if new) and refresh its row count. A new one-year shard
+    must not fall inside the range of a registered shard (raises ValueError).
+    """
+    shard_key = str(shard_key)
+    year = None if shard_key == UNKNOWN_SHARD else int(shard_key)
+    for key, first_year, last_year, *_ in read_catalog():
+        if key == shard_key or year is None or first_year is None:
+            continue
+        if first_year <= year <= last_year:
+            raise ValueError(
+                f"shard {shard_key} overlaps shard {key} ({first_year}-{last_year}); "
+                f"use --shard {key} (or any year in its range)"
+            )
+    path = shard_db_path(shard_key)
+    shard_conn = sqlite3.connect(str(path))
+    row_count = shard_conn.execute(f"SELECT COUNT(*) FROM {PAYROLL_TABLE}").fetchone()[0]
+    shard_conn.close()
+
+    conn = _connect_catalog_db()
+    conn.execute(f"""
+    INSERT INTO {CATALOG_TABLE} (shard_key, first_year, last_year, db_file, row_count, updated_at)
+    VALUES (?, ?, ?, ?, ?, ?)
+    ON CONFLICT(shard_key) DO UPDATE SET row_count = excluded.row_count, updated_at = excluded.updated_at
+    """, (shard_key, year, year, path.name, row_count, datetime.now().isoformat(timespec="seconds")))
+    conn.commit()
+    conn.close()
+
+
+def connect_catalog(shard_keys=None) -> sqlite3.Connection:
+    """
+    Open the catalog with every shard (or only shard_keys) attached and TEMP
+    UNION ALL views named payroll_details / load_log over them.
+
+    The union views are read-only and carry no rowid; cleansing steps must
+    target a single shard instead.
+    """
+    catalog = read_catalog()
+    if shard_keys is not None:
+        wanted = {str(k) for k in shard_keys}
+        catalog = [entry for entry in catalog if entry[0] in wanted]
+    if not catalog:
+        raise FileNotFoundError(f"No shards registered in {CATALOG_PATH}")
+
+    conn = _connect_catalog_db()
+    limit = conn.getlimit(sqlite3.SQLITE_LIMIT_ATTACHED)
+    if len(catalog) > limit:
+        conn.close()
+        raise ValueError(
+            f"{len(catalog)} shards exceed SQLite's attach limit of {limit}; "
+            f"pass shard_keys or re-split with a larger --years-per-shard"
+        )
+
+    schemas = []
+    for shard_key, _, _, db_file, *_ in catalog:
+        schema = f"shard_{shard_key}"
+        conn.execute("ATTACH DATABASE ? AS " + schema, (str(SHARD_DIR / db_file),))
+        schemas.append(schema)
+
+    for table_name in SHARDED_TABLES:
+        union_sql = "\nUNION ALL\n".join(f"SELECT * FROM {schema}.{table_name}" for schema in schemas)
+        conn.execute(f"CREATE TEMP VIEW {table_name} AS {union_sql}")
+    return conn
+
+
+def attach_limit() -> int:
+    """SQLITE_LIMIT_ATTACHED of this SQLite build (10 unless compiled otherwise)."""
+    conn = sqlite3.connect(":memory:")
+    try:
+        return conn.getlimit(sqlite3.SQLITE_LIMIT_ATTACHED)
+    finally:
+        conn.close()
+
+
+def _source_files(src: sqlite3.Connection):
+    """([(文件名, row count), ...], [load_log file names]) of the source database."""
+    file_rows = src.execute(f"SELECT 文件名, COUNT(*) FROM {PAYROLL_TABLE} GROUP BY 文件名").fetchall()
+    log_files = []
+    if src.execute("SELECT 1 FROM sqlite_master WHERE name=?", (LOAD_LOG_TABLE,)).fetchone():
+        log_files = [row[0] for row in src.execute(f"SELECT DISTINCT file_name FROM {LOAD_LOG_TABLE}")]
+    return file_rows, log_files
+
+
+def _plan_shards(file_rows: list, log_files: list, years_per_shard: int) -> dict:
+    """
+    Group the source file names into shards.
+
+    Returns:
+        dict: shard_key -> {'first_year', 'last_year', 'files': {table: set}, 'rows': int}
+    """
+    years = [file_year(name) for name, _ in file_rows] + [file_year(name) for name in log_files]
+    known_years = [year for year in years if year is not None]
+    base_year = min(known_years) if known_years else 0
+
+    def key_of(name):
+        year = file_year(name)
+        if year is None:
+            return UNKNOWN_SHARD, None, None
+        first_year = base_year + (year - base_year) // years_per_shard * years_per_shard
+        return str(first_year), first_year, first_year + years_per_shard - 1
+
+    plan = {}
+
+    def shard_of(name):
+        shard_key, first_year, last_year = key_of(name)
+        if shard_key not in plan:
+            plan[shard_key] = {
+                "first_year": first_year,
+                "last_year": last_year,
+                "files": {table_name: set() for table_name in SHARDED_TABLES},
+                "rows": 0,
+            }
+        return plan[shard_key]
+
+    for name, count in file_rows:
+        shard = shard_of(name)
+        shard["files"][PAYROLL_TABLE].add(name)
+        shard["rows"] += count
+    for name in log_files:
+        shard_of(name)["files"][LOAD_LOG_TABLE].add(name)
+    return plan
+
+
+def _auto_plan(file_rows: list, log_files: list, limit: int):
+    """
+    Smallest years_per_shard whose plan fits within limit shards.
+
+    Returns:
+        tuple: (years_per_shard, plan)
+    """
+    years_per_shard = 1
+    while True:
+        plan = _plan_shards(file_rows, log_files, years_per_shard)
+        # Stop once every dated file is in one shard (only for a tiny limit)
+        if len(plan) <= limit or len(plan) <= 1 + (UNKNOWN_SHARD in plan):
+            return years_per_shard, plan
+        years_per_shard += 1
+
+
+def _copy_shard(shard_key: str, shard: dict, source: Path) -> int:
+    """Rebuild one shard file from the source database. Returns its row count."""
+    path = shard_db_path(shard_key)
+    conn = sqlite3.connect(str(path))
+    conn.execute("ATTACH DATABASE ? AS src", (str(source),))
+    for table_name in SHARDED_TABLES:
+        conn.execute(f"DROP TABLE IF EXISTS main.{table_name}")
+    create_payroll_details_table(conn)
+    create_load_log_table(conn)
+
+    columns = ", ".join(PAYROLL_DETAILS_COLUMNS)
+    for table_name, file_column in SHARDED_TABLES.items():
+        conn.execute("DROP TABLE IF EXISTS temp.shard_files")
+        conn.execute("CREATE TEMP TABLE shard_files (file_name TEXT PRIMARY KEY)")
+        conn.executemany(
+            "INSERT INTO temp.shard_files VALUES (?)",
+            [(name,) for name in shard["files"][table_name] if name is not None],
+        )
+        condition = f"{file_column} IN (SELECT file_name FROM temp.shard_files)"
+        if None in shard["files"][table_name]:
+            condition += f" OR {file_column} IS NULL"
+        if table_name == PAYROLL_TABLE:
+            # Keep the monolith's rowids so report rowids stay traceable
+            conn.execute(f"""
+            INSERT INTO main.{table_name} (rowid, {columns})
+            SELECT rowid, {columns} FROM src.{table_name} WHERE {condition}
+            """)
+        elif shard["files"][table_name]:
+            conn.execute(f"INSERT INTO main.{table_name} SELECT * FROM src.{table_name} WHERE {condition}")
+
+    create_payroll_indexes(conn)
+    row_count = conn.execute(f"SELECT COUNT(*) FROM main.{PAYROLL_TABLE}").fetchone()[0]
+    conn.commit()
+    conn.execute("DETACH DATABASE src")
+    conn.close()
+    return row_count
+
+
+def split_database(source: Path, years_per_shard: int = None, dry_run: bool = False) -> bool:
+    """
+    Split the source database into shard files and register them in the
+    catalog. The source database is not modified. Without years_per_shard the
+    smallest span that fits within SQLite's attach limit is used.
+    """
+    if not source.exists():
+        print(f"Error: source database does not exist: {source}")
+        return False
+
+    src = sqlite3.connect(str(source))
+    source_rows = src.execute(f"SELECT COUNT(*) FROM {PAYROLL_TABLE}").fetchone()[0]
+    file_rows, log_files = _source_files(src)
+    src.close()
+    limit = attach_limit()
+    if years_per_shard is None:
+        years_per_shard, plan = _auto_plan(file_rows, log_files, limit)
+    else:
+        plan = _plan_shards(file_rows, log_files, years_per_shard)
+
+    print(f"Source: {source} ({source_rows} rows)")
+    print(f"Years per shard: {years_per_shard}")
+    print(f"Shard directory: {SHARD_DIR}")
+    for shard_key, shard in sorted(plan.items()):
+        exists = " (exists, will be rebuilt)" if shard_db_path(shard_key).exists() else ""
+        print(f"  {shard_db_path(shard_key).name}: {len(shard['files'][PAYROLL_TABLE])} files, "
+              f"{shard['rows']} rows{exists}")
+
+    if len(plan) > limit:
+        print(f"Warning: {len(plan)} shards exceed SQLite's attach limit of {limit}, "
+              f"connect_catalog() will need an explicit shard list (see --years-per-shard)")
+
+    if dry_run:
+        print("\n[DRY-RUN] No shard files written")
+        return True
+
+    if any(shard_db_path(shard_key).exists() for shard_key in plan):
+        confirm = input("\nExisting shard files will be rebuilt. Type 'yes' to continue: ")
+        if confirm.strip().lower() != "yes":
+            print("Cancelled")
+            return False
+
+    SHARD_DIR.mkdir(parents=True, exist_ok=True)
+    conn = _connect_catalog_db()
+    conn.execute(f"DELETE FROM {CATALOG_TABLE}")
+    total_rows = 0
+    for shard_key, shard in sorted(plan.items()):
+        row_count = _copy_shard(shard_key, shard, source)
+        if row_count != shard["rows"]:
+            print(f"Error: shard {shard_key} has {row_count} rows, expected {shard['rows']}")
+            conn.close()
+            return False
+        total_rows += row_count
+        conn.execute(
+            f"INSERT INTO {CATALOG_TABLE} VALUES (?, ?, ?, ?, ?, ?)",
+            (shard_key, shard["first_year"], shard["last_year"], shard_db_path(shard_key).name,
+             row_count, datetime.now().isoformat(timespec="seconds")),
+        )
+        print(f"  ✓ {shard_db_path(shard_key).name}: {row_count} rows")
+
+    if total_rows != source_rows:
+        print(f"Error: shards hold {total_rows} rows, source has {source_rows}; catalog not updated")
+        conn.rollback()
+        conn.close()
+        return False
+    conn.commit()
+    conn.close()
+    print(f"\nSplit completed: {len(plan)} shards, {total_rows} rows")
+    return True
+
+
+def list_shards():
+    catalog = read_catalog()
+    if not catalog:
+        print(f"No shards registered in {CATALOG_PATH}")
+        return
+    print(f"{'shard':<10} {'years':<12} {'rows':>10}  {'updated':<20} file")
+    for shard_key, first_year, last_year, db_file, row_count, updated_at in catalog:
+        years = f"{first_year}-{last_year}" if first_year is not None else "-"
+        print(f"{shard_key:<10} {years:<12} {row_count:>10}  {updated_at:<20} {db_file}")
+
+
+def check_shards() -> bool:
+    """Compare each shard's actual row count with the catalog and the union view."""
+    catalog = read_catalog()
+    ok = True
+    for shard_key, _, _, db_file, row_count, _ in catalog:
+        path = SHARD_DIR / db_file
+        if not path.exists():
+            print(f"  ✗ {db_file}: missing")
+            ok = False
+            continue
+        conn = sqlite3.connect(str(path))
+        actual = conn.execute(f"SELECT COUNT(*) FROM {PAYROLL_TABLE}").fetchone()[0]
+        conn.close()
+        mark = "✓" if actual == row_count else "✗"
+        ok = ok and actual == row_count
+        print(f"  {mark} {db_file}: {actual} rows (catalog {row_count})")
+
+    if ok and catalog:
+        try:
+            conn = connect_catalog()
+        except ValueError as e:
+            print(f"  ✗ Union view {PAYROLL_TABLE}: {e}")
+            return False
+        union_rows = conn.execute(f"SELECT COUNT(*) FROM {PAYROLL_TABLE}").fetchone()[0]
+        conn.close()
+        print(f"Union view {PAYROLL_TABLE}: {union_rows} rows")
+    return ok
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Year-sharded payroll database layout")
+    subparsers = parser.add_subparsers(dest="command", required=True)
+
+    split_parser = subparsers.add_parser("split", help="Split the monolithic database into year shards")
+    split_parser.add_argument("--source", type=Path, default=DB_PATH,
+                              help=f"Database to split (default: {DB_PATH})")
+    split_parser.add_argument("--years-per-shard", type=int,
+                              help="Years per shard file (default: the smallest that keeps the shard "
+                                   "count within SQLite's attach limit)")
+    split_parser.add_argument("--dry-run", action="store_true",
+                              help="Only show the shard plan")
+
+    subparsers.add_parser("list", help="List registered shards")
+    subparsers.add_parser("check", help="Verify shard row counts against the catalog")
+
+    args = parser.parse_args()
+
+    if args.command == "split":
+        if args.years_per_shard is not None and args.years_per_shard < 1:
+            parser.error("--years-per-shard must be >= 1")
+        success = split_database(args.source, args.years_per_shard, args.dry_run)
+        sys.exit(0 if success else 1)
+    elif args.command == "list":
+        list_shards()
+    elif args.command == "check":
+        sys.exit(0 if check_shards() else 1)
+
+
+if __name__ == "__main__":
+    main()
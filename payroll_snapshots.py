@@ -0,0 +1,381 @@
+#!/usr/bin/env python3
+"""
+Pre-run snapshots of the payroll database, with automatic retention.
+
+Scripts used to protect a run by copying the whole payroll_database.db file
+(hundreds of MB) to a timestamped backup, which blocks the run while the file
+is copied and keeps every copy forever. This module offers two kinds of
+snapshot, both written to SNAPSHOT_DIR:
+
+- full:    a consistent copy of the whole database made with the SQLite online
+           backup API (sqlite3.Connection.backup), PAGES_PER_STEP pages at a
+           time with progress output. Other connections can keep reading (and
+           writing) while it runs.
+- logical: only the tables a script is allowed to modify (e.g. the write
+           whitelist of one_time_pgms/parse_summary_sheets.py), with their
+           schema, indexes and triggers. Tables that do not exist yet are recorded as
+           absent, so restoring drops them again. The cost is proportional to
+           what the script can touch, not to the database size.
+
+Every snapshot records its kind, source and tables in a snapshot_manifest
+table inside the snapshot file. A full restore drops that table from the
+restored database again, so the manifest never ends up in live data. A
+snapshot that fails halfway is deleted. After each new snapshot the oldest ones with
+the same label are pruned so that at most KEEP remain (PAYROLL_SNAPSHOT_KEEP).
+
+Usage:
+    python payroll_snapshots.py create [--label LABEL] [--tables T ...] [--keep N] [--shard YEAR]
+    python payroll_snapshots.py list
+    python payroll_snapshots.py prune [--label LABEL] [--keep N]
+    python payroll_snapshots.py restore SNAPSHOT [--shard YEAR] [--yes]
+"""
+
+import os
+import sys
+import sqlite3
+import argparse
+from datetime import datetime
+from pathlib import Path
+
+from payroll_shards import shard_db_path_for_year
+from excel_processor.keyword_index import HITS_TABLE, refresh_keyword_index, trigger_name
+
+DB_PATH = Path(__file__).parent.parent / "payroll_database.db"
+SNAPSHOT_DIR = Path(os.environ.get("PAYROLL_SNAPSHOT_DIR", DB_PATH.parent / "payroll_snapshots"))
+MANIFEST_TABLE = "snapshot_manifest"
+
+# Snapshots kept per label after pruning
+KEEP = int(os.environ.get("PAYROLL_SNAPSHOT_KEEP", "5"))
+
+# Pages copied per step of the online backup (4096-byte pages: ~16 MB per step)
+PAGES_PER_STEP = 4096
+
+FULL = "full"
+LOGICAL = "logical"
+
+
+def snapshot_path(db_path: Path, label: str, kind: str) -> Path:
+    timestamp = datetime.now().strftime("%Y%m%d_%H%M%S_%f")
+    return SNAPSHOT_DIR / f"{Path(db_path).stem}_{label}_{kind}_{timestamp}.db"
+
+
+def _write_manifest(conn: sqlite3.Connection, kind: str, db_path: Path, label: str, tables: dict):
+    """tables: {table name: row count, or None if the table did not exist}"""
+    # A database restored from a full snapshot by an older version of
+    # restore_snapshot still contains that snapshot's manifest
+    conn.execute(f"DROP TABLE IF EXISTS {MANIFEST_TABLE}")
+    conn.execute(f"""
+        CREATE TABLE {MANIFEST_TABLE} (
+            table_name TEXT,
+            existed INTEGER NOT NULL,
+            row_count INTEGER,
+            kind TEXT NOT NULL,
+            source TEXT NOT NULL,
+            label TEXT NOT NULL,
+            created_at TEXT NOT NULL
+        )
+    """)
+    created_at = datetime.now().isoformat(timespec="seconds")
+    entries = tables.items() if tables else [(None, None)]
+    conn.executemany(
+        f"INSERT INTO {MANIFEST_TABLE} VALUES (?, ?, ?, ?, ?, ?, ?)",
+        [(name, count is not None, count, kind, str(db_path), label, created_at) for name, count in entries],
+    )
+    conn.commit()
+
+
+def is_snapshot(path: Path) -> bool:
+    """True if path is an SQLite file with a snapshot_manifest table (other files are ignored)."""
+    try:
+        conn = sqlite3.connect(f"file:{path}?mode=ro", uri=True)
+    except sqlite3.Error:
+        return False
+    try:
+        return conn.execute(
+            "SELECT 1 FROM sqlite_master WHERE type = 'table' AND name = ?", (MANIFEST_TABLE,)
+        ).fetchone() is not None
+    except sqlite3.DatabaseError:
+        return False
+    finally:
+        conn.close()
+
+
+def read_manifest(snapshot: Path) -> list:
+    """[(table_name, existed, row_count, kind, source, label, created_at), ...]"""
+    conn = sqlite3.connect(f"file:{snapshot}?mode=ro", uri=True)
+    try:
+        return conn.execute(f"SELECT * FROM {MANIFEST_TABLE}").fetchall()
+    finally:
+        conn.close()
+
+
+def _print_progress(status, remaining, total):
+    done = total - remaining
+    print(f"\r  backup: {done}/{total} pages ({done * 100 // max(total, 1)}%)", end="", flush=True)
+
+
+def _discard(target: Path):
+    """Delete a snapshot file that could not be completed."""
+    if target.exists():
+        target.unlink()
+        print(f"Incomplete snapshot deleted: {target}")
+
+
+def full_snapshot(db_path: Path, label: str = "manual", pages: int = PAGES_PER_STEP,
+                  progress=_print_progress, keep: int = KEEP) -> Path:
+    """Copy the whole database with the online backup API. Returns the snapshot file."""
+    SNAPSHOT_DIR.mkdir(parents=True, exist_ok=True)
+    target = snapshot_path(db_path, label, FULL)
+    source = sqlite3.connect(str(db_path))
+    dest = sqlite3.connect(str(target))
+    try:
+        source.backup(dest, pages=pages, progress=progress)
+        if progress is not None:
+            print()
+        _write_manifest(dest, FULL, db_path, label, {})
+    except BaseException:
+        dest.close()
+        source.close()
+        _discard(target)
+        raise
+    dest.close()
+    source.close()
+    prune_snapshots(label, keep)
+    return target
+
+
+def _table_sql(conn: sqlite3.Connection, schema: str, table: str):
+    """
+    (CREATE TABLE sql, [CREATE INDEX sql, ...], [CREATE TRIGGER sql, ...]) of
+    schema.table, or (None, [], []) if it does not exist.
+    """
+    row = conn.execute(
+        f"SELECT sql FROM {schema}.sqlite_master WHERE type = 'table' AND name = ?", (table,)
+    ).fetchone()
+    if row is None:
+        return None, [], []
+    indexes, triggers = [], []
+    for kind, sql in conn.execute(
+        f"SELECT type, sql FROM {schema}.sqlite_master "
+        f"WHERE type IN ('index', 'trigger') AND tbl_name = ? AND sql IS NOT NULL ORDER BY rowid",
+        (table,),
+    ):
+        (indexes if kind == "index" else triggers).append(sql)
+    return row[0], indexes, triggers
+
+
+def _recreate_table(conn: sqlite3.Connection, source: str, target: str, table: str):
+    """
+    Create table in target from its definition in source and copy the rows,
+    then the indexes and the triggers. The triggers are created last so they
+    do not fire for the copied rows.
+    """
+    create_sql, indexes, triggers = _table_sql(conn, source, table)
+    conn.execute(create_sql)
+    _copy_table(conn, source, target, table)
+    for sql in indexes + triggers:
+        conn.execute(sql)
+
+
+def _copy_table(conn: sqlite3.Connection, source: str, target: str, table: str):
+    """Copy the rows of source.table into target.table (same schema), keeping rowids."""
+    columns = [row[1] for row in conn.execute(f"PRAGMA {source}.table_xinfo({table})") if row[6] == 0]
+    column_list = ", ".join(f'"{c}"' for c in columns)
+    create_sql = _table_sql(conn, source, table)[0]
+    if "WITHOUT ROWID" not in create_sql.upper():
+        column_list = "rowid, " + column_list
+    conn.execute(
+        f'INSERT INTO {target}."{table}" ({column_list}) SELECT {column_list} FROM {source}."{table}"'
+    )
+
+
+def logical_snapshot(db_path: Path, tables: list, label: str = "manual", keep: int = KEEP) -> Path:
+    """Save only the given tables (schema, indexes, triggers and rows). Returns the snapshot file."""
+    SNAPSHOT_DIR.mkdir(parents=True, exist_ok=True)
+    target = snapshot_path(db_path, label, LOGICAL)
+    conn = sqlite3.connect(str(target))
+    try:
+        conn.execute("ATTACH DATABASE ? AS src", (str(db_path),))
+        saved = {}
+        for table in tables:
+            if _table_sql(conn, "src", table)[0] is None:
+                saved[table] = None
+                continue
+            _recreate_table(conn, "src", "main", table)
+            saved[table] = conn.execute(f'SELECT COUNT(*) FROM main."{table}"').fetchone()[0]
+        conn.commit()
+        conn.execute("DETACH DATABASE src")
+        _write_manifest(conn, LOGICAL, db_path, label, saved)
+    except BaseException:
+        conn.close()
+        _discard(target)
+        raise
+    conn.close()
+    prune_snapshots(label, keep)
+    return target
+
+
+def list_snapshots(label: str = None) -> list:
+    """
+    Snapshot files in SNAPSHOT_DIR (optionally of one label), oldest first.
+    Other .db files in the directory (without a manifest) are skipped.
+    """
+    if not SNAPSHOT_DIR.exists():
+        return []
+    pattern = f"*_{label}_*.db" if label else "*.db"
+    paths = [p for p in SNAPSHOT_DIR.glob(pattern) if is_snapshot(p)]
+    return sorted(paths, key=lambda p: p.stat().st_mtime)
+
+
+def prune_snapshots(label: str, keep: int = KEEP) -> list:
+    """
+    Delete all but the newest `keep` snapshots of label (the newest one is always
+    kept, so a snapshot just taken survives keep < 1). Returns the deleted files.
+    """
+    snapshots = [p for p in list_snapshots(label) if read_manifest(p)[0][5] == label]
+    removed = snapshots[:-max(keep, 1)]
+    for path in removed:
+        path.unlink()
+    return removed
+
+
+def _has_keyword_triggers(conn: sqlite3.Connection, table: str) -> bool:
+    return conn.execute(
+        "SELECT 1 FROM main.sqlite_master WHERE type = 'trigger' AND name = ?", (trigger_name(table, "insert"),)
+    ).fetchone() is not None
+
+
+def restore_snapshot(snapshot: Path, db_path: Path):
+    """
+    Restore db_path from a snapshot: a full snapshot replaces every page of the
+    database (online backup in the other direction), a logical snapshot replaces
+    only its tables (and drops the ones that did not exist when it was taken),
+    with their indexes and triggers. If a restored table carries the keyword
+    index triggers, the keyword hits are rebuilt from the restored rows.
+    """
+    manifest = read_manifest(snapshot)
+    kind = manifest[0][3]
+    if kind == FULL:
+        source = sqlite3.connect(str(snapshot))
+        dest = sqlite3.connect(str(db_path))
+        try:
+            source.backup(dest, pages=PAGES_PER_STEP, progress=_print_progress)
+            print()
+            dest.execute(f"DROP TABLE IF EXISTS {MANIFEST_TABLE}")
+            dest.commit()
+        finally:
+            dest.close()
+            source.close()
+        return
+
+    conn = sqlite3.connect(str(db_path), isolation_level=None)
+    try:
+        conn.execute("ATTACH DATABASE ? AS snap", (str(snapshot),))
+        conn.execute("BEGIN IMMEDIATE")
+        restored = [table for table, existed, *_ in manifest if existed]
+        for table, existed, *_ in manifest:
+            conn.execute(f'DROP TABLE IF EXISTS main."{table}"')
+            if existed:
+                _recreate_table(conn, "snap", "main", table)
+        # DROP TABLE does not fire the delete triggers, and the restored rows were
+        # copied before the triggers existed: the hits no longer match the rows
+        # unless the hits table was restored from the same snapshot
+        if HITS_TABLE not in restored:
+            for table in restored:
+                if _has_keyword_triggers(conn, table):
+                    refresh_keyword_index(conn, table)
+        conn.execute("COMMIT")
+        conn.execute("DETACH DATABASE snap")
+    except Exception:
+        if conn.in_transaction:
+            conn.execute("ROLLBACK")
+        raise
+    finally:
+        conn.close()
+
+
+def print_snapshots():
+    snapshots = list_snapshots()
+    if not snapshots:
+        print(f"No snapshots in {SNAPSHOT_DIR}")
+        return
+    print(f"  {'snapshot':<60} {'kind':<8} {'size MB':>8}  tables")
+    for path in snapshots:
+        manifest = read_manifest(path)
+        kind = manifest[0][3]
+        tables = ", ".join(
+            f"{name} ({count})" if existed else f"{name} (absent)"
+            for name, existed, count, *_ in manifest if name is not None
+        ) or "all"
+        print(f"  {path.name:<60} {kind:<8} {path.stat().st_size / 1e6:>8.1f}  {tables}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Snapshots of the payroll database")
+    sub = parser.add_subparsers(dest="command", required=True)
+
+    create = sub.add_parser("create", help="Take a snapshot (full unless --tables is given)")
+    create.add_argument("--label", default="manual", help="Snapshot label, retention is per label")
+    create.add_argument("--tables", nargs="+", help="Logical snapshot of only these tables")
+    create.add_argument("--keep", type=int, default=KEEP, help=f"Snapshots kept per label (default {KEEP})")
+    create.add_argument("--shard", help="Snapshot this year shard database (see payroll_shards.py)")
+
+    sub.add_parser("list", help="List the snapshots")
+
+    prune = sub.add_parser("prune", help="Delete old snapshots of a label")
+    prune.add_argument("--label", default="manual")
+    prune.add_argument("--keep", type=int, default=KEEP)
+
+    restore = sub.add_parser("restore", help="Restore the database from a snapshot")
+    restore.add_argument("snapshot", help="Snapshot file (see list)")
+    restore.add_argument("--shard", help="Restore into this year shard database")
+    restore.add_argument("--yes", action="store_true", help="Skip the confirmation prompt")
+
+    args = parser.parse_args()
+    if getattr(args, "keep", KEEP) < 1:
+        parser.error("--keep must be >= 1")
+
+    if args.command == "list":
+        print_snapshots()
+        return
+    if args.command == "prune":
+        for path in prune_snapshots(args.label, args.keep):
+            print(f"Deleted {path}")
+        return
+
+    db_path = shard_db_path_for_year(args.shard) if args.shard else DB_PATH
+    if not db_path.exists():
+        print(f"Error: database not found: {db_path}")
+        sys.exit(1)
+
+    if args.command == "create":
+        if args.tables:
+            path = logical_snapshot(db_path, args.tables, args.label, args.keep)
+        else:
+            path = full_snapshot(db_path, args.label, keep=args.keep)
+        print(f"Snapshot written: {path}")
+        return
+
+    snapshot = Path(args.snapshot)
+    if not snapshot.exists():
+        snapshot = SNAPSHOT_DIR / args.snapshot
+    if not snapshot.exists():
+        print(f"Error: snapshot not found: {args.snapshot}")
+        sys.exit(1)
+    if not is_snapshot(snapshot):
+        print(f"Error: not a snapshot (no {MANIFEST_TABLE} table): {snapshot}")
+        sys.exit(1)
+    manifest = read_manifest(snapshot)
+    tables = [name for name, *_ in manifest if name is not None]
+    print(f"Restore {db_path} from {snapshot.name} ({manifest[0][3]}: {', '.join(tables) or 'all tables'})")
+    if not args.yes:
+        confirm = input("Type 'yes' to continue: ")
+        if confirm.strip().lower() != "yes":
+            print("Cancelled.")
+            return
+    restore_snapshot(snapshot, db_path)
+    print("Restored.")
+
+
+if __name__ == "__main__":
+    main()
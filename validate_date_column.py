@@ -9,24 +9,44 @@
 4. 结合文件名（YYYYMM格式）验证日期是否在对应月份的有效范围内
    - 如 2017/04 月份不能有日期值 31（四月只有30天）
 
+验证按不同的 (日期, 文件名) 进行，结果保存在数据库的 date_validation 表
+(以 (文件名, 日期) 为键)。再次运行时只验证表中没有的 (日期, 文件名)
+(新载入或清洗后改变的日期)，已不存在的从表中删除; 统计按每个 (日期, 文件名) 的
+记录数汇总，错误记录和 HTML 报告直接从表中联表读取。
+验证规则修改后把 VALIDATION_VERSION 加 1，旧结果自动失效。
+
 用法:
-    python validate_date_column.py [--show-errors] [--export-html]
+    python validate_date_column.py [--show-errors] [--export-html] [--workers N] [--revalidate] [--shard YEAR]
 
 参数:
     --show-errors  显示所有错误详情
     --export-html  导出错误到HTML报告
+    --workers N    按文件分区用 N 个进程并行验证不同的 (日期, 文件名) (0 为 CPU 核数, 默认 1)
+    --revalidate   清空 date_validation 表, 重新验证全部
+    --shard YEAR   只处理该年份的分片数据库 (见 payroll_shards.py)
 """
 
 import sqlite3
 import sys
 import argparse
+import json
 import re
+from html import escape
 from pathlib import Path
 from datetime import date
-import calendar
+
+from payroll_shards import shard_db_path_for_year
+from cleansing_report import HtmlReport, raw
+from cleansing_date_grammar import is_canonical_date, classify_date_value
+from cleansing_parallel import parallel_compute
+from cleansing_calendar import get_calendar, load_calendar
 
 DB_PATH = Path(__file__).parent.parent / "payroll_database.db"
 PAYROLL_TABLE = "payroll_details"
+VALIDATION_TABLE = "date_validation"
+
+# 验证规则 (validate_date_string) 修改后加 1, date_validation 中的旧结果自动失效
+VALIDATION_VERSION = 1
 
 
 def parse_file_year_month(file_name: str) -> tuple:
@@ -44,8 +64,8 @@ def parse_file_year_month(file_name: str) -> tuple:
 
 
 def get_days_in_month(year: int, month: int) -> int:
-    """获取指定年月的天数"""
-    return calendar.monthrange(year, month)[1]
+    """获取指定年月的天数 (预计算日历查询, 见 cleansing_calendar.py)"""
+    return get_calendar().days_in_month(year, month)
 
 
 def validate_date_string(date_str: str, file_name: str) -> tuple:
@@ -66,6 +86,13 @@ def validate_date_string(date_str: str, file_name: str) -> tuple:
         return False, errors, parsed_dates
     
     s = str(date_str).strip()
+
+    # 快速路径: 规范格式 (升序逗号分隔的 1~31) 只需再检查月份天数 (见 cleansing_date_grammar.py)
+    if is_canonical_date(s):
+        days = [int(part) for part in s.split(',')]
+        year, month = parse_file_year_month(file_name)
+        if year is None or month is None or days[-1] <= get_days_in_month(year, month):
+            return True, errors, days
     
     # 规则1: 逗号分隔格式（可选，如果没有逗号则必须是单个日期）
     # 分割并解析每个日期
@@ -118,59 +145,130 @@ def validate_date_string(date_str: str, file_name: str) -> tuple:
     return len(errors) == 0, errors, parsed_dates
 
 
-def validate_all_records(conn: sqlite3.Connection) -> dict:
+def ensure_validation_table(conn: sqlite3.Connection):
+    """创建验证结果表 (已存在则跳过)。"""
+    conn.execute(f"""
+        CREATE TABLE IF NOT EXISTS {VALIDATION_TABLE} (
+            file_name TEXT NOT NULL,
+            date_value TEXT NOT NULL,
+            version INTEGER NOT NULL,
+            status TEXT NOT NULL,
+            parsed_dates TEXT,
+            errors TEXT,
+            kind TEXT,
+            PRIMARY KEY (file_name, date_value)
+        ) WITHOUT ROWID
+    """)
+
+
+def validate_pair(date_val: str, file_name: str) -> tuple:
     """
-    验证所有记录的日期列。
-    
+    一个 (日期, 文件名) 的验证结果，即 date_validation 表的一行:
+    (status, 解析后的日期 JSON, 错误信息 JSON, 分类)。status 为 'valid' / 'invalid' / 'empty'。
+    """
+    if str(date_val).strip() == '':
+        return 'empty', None, None, None
+    is_valid, errors, parsed_dates = validate_date_string(date_val, file_name)
+    if is_valid:
+        return 'valid', None, None, None
+    year, month = parse_file_year_month(file_name)
+    return ('invalid', json.dumps(parsed_dates), json.dumps(errors, ensure_ascii=False),
+            classify_date_value(date_val, year, month))
+
+
+def refresh_validation(conn: sqlite3.Connection, workers: int = 1) -> tuple:
+    """
+    按 (日期, 文件名) 更新 date_validation 表并返回 (各 (日期, 文件名) 的记录数, 新验证的个数)。
+
+    全表只做一次 GROUP BY; 表中已有 (当前版本) 的 (日期, 文件名) 不再验证，
+    数据库中已不存在的从表中删除。workers 不为 1 时按文件名分区并行验证 (见 cleansing_parallel.py)。
+    """
+    ensure_validation_table(conn)
+    counts = conn.execute(
+        f"SELECT 日期, 文件名, COUNT(*) FROM {PAYROLL_TABLE} GROUP BY 日期, 文件名"
+    ).fetchall()
+    cached = set(conn.execute(
+        f"SELECT date_value, file_name FROM {VALIDATION_TABLE} WHERE version = ?", (VALIDATION_VERSION,)
+    ))
+
+    partitions = {}
+    for date_val, file_name, _ in counts:
+        if date_val is not None and (date_val, file_name) not in cached:
+            partitions.setdefault(file_name, []).append(((date_val, file_name), (date_val, file_name)))
+    pending = sum(len(items) for items in partitions.values())
+    if pending:
+        # 各 (年, 月) 的天数一次性算好, 在并行验证之前 (工作进程继承预计算结果)
+        load_calendar(conn)
+        results = parallel_compute(validate_pair, partitions, workers)
+        conn.executemany(
+            f"INSERT OR REPLACE INTO {VALIDATION_TABLE} "
+            f"(file_name, date_value, version, status, parsed_dates, errors, kind) "
+            f"VALUES (?, ?, ?, ?, ?, ?, ?)",
+            ((file_name, date_val, VALIDATION_VERSION, *result)
+             for (date_val, file_name), result in results.items()),
+        )
+
+    present = {(date_val, file_name) for date_val, file_name, _ in counts}
+    stale = [key for key in cached if key not in present]
+    conn.executemany(
+        f"DELETE FROM {VALIDATION_TABLE} WHERE date_value = ? AND file_name = ?", stale
+    )
+    conn.execute(
+        f"DELETE FROM {VALIDATION_TABLE} WHERE version != ?", (VALIDATION_VERSION,)
+    )
+    conn.commit()
+    return counts, pending
+
+
+def iter_error_records(conn: sqlite3.Connection):
+    """逐条读取无效记录 (date_validation 中 status = 'invalid' 的 (日期, 文件名) 联表 payroll_details)。"""
+    cursor = conn.execute(f"""
+        SELECT p.rowid, p.文件名, p.职员全名, p.日期, v.parsed_dates, v.errors, v.kind
+        FROM {VALIDATION_TABLE} v
+        JOIN {PAYROLL_TABLE} p ON p.日期 = v.date_value AND p.文件名 = v.file_name
+        WHERE v.status = 'invalid'
+        ORDER BY p.rowid
+    """)
+    for rowid, file_name, worker_name, date_val, parsed_dates, errors, kind in cursor:
+        yield {
+            'rowid': rowid,
+            'filename': file_name,
+            'worker_name': worker_name,
+            'date_value': str(date_val),
+            'parsed_dates': json.loads(parsed_dates),
+            'errors': json.loads(errors),
+            'kind': kind,
+        }
+
+
+def validate_all_records(conn: sqlite3.Connection, workers: int = 1) -> dict:
+    """
+    验证所有记录的日期列。只验证 date_validation 表中还没有的 (日期, 文件名)，
+    统计按 (日期, 文件名) 的记录数汇总，错误记录从表中联表读取。
+
     Returns:
-        dict: 验证结果，包含统计信息和错误记录
+        dict: 验证结果，包含统计信息、错误记录和本次新验证的 (日期, 文件名) 个数
     """
-    cursor = conn.execute(f"SELECT rowid, * FROM {PAYROLL_TABLE}")
-    columns = [desc[0] for desc in cursor.description]
-    all_rows = cursor.fetchall()
-    
-    date_idx = columns.index('日期')
-    filename_idx = columns.index('文件名')
-    worker_idx = columns.index('职员全名')
-    rowid_idx = 0
+    counts, pending = refresh_validation(conn, workers)
+    status = dict(
+        ((date_val, file_name), value) for file_name, date_val, value in
+        conn.execute(f"SELECT file_name, date_value, status FROM {VALIDATION_TABLE}")
+    )
 
     stats = {
-        'total': len(all_rows),
+        'total': 0,
         'valid': 0,
         'invalid': 0,
         'empty': 0,
     }
+    for date_val, file_name, count in counts:
+        stats['total'] += count
+        stats[status.get((date_val, file_name), 'empty')] += count
 
-    error_records = []
-
-    for row in all_rows:
-        rowid = row[rowid_idx]
-        date_val = row[date_idx]
-        file_name = row[filename_idx]
-        worker_name = row[worker_idx]
-
-        if date_val is None or str(date_val).strip() == '':
-            stats['empty'] += 1
-            continue
-
-        is_valid, errors, parsed_dates = validate_date_string(date_val, file_name)
-
-        if is_valid:
-            stats['valid'] += 1
-        else:
-            stats['invalid'] += 1
-            error_records.append({
-                'rowid': rowid,
-                'filename': file_name,
-                'worker_name': worker_name,
-                'date_value': str(date_val),
-                'parsed_dates': parsed_dates,
-                'errors': errors
-            })
-    
     return {
         'stats': stats,
-        'errors': error_records
+        'errors': list(iter_error_records(conn)),
+        'validated': pending,
     }
 
 
@@ -202,6 +300,14 @@ def print_summary(result: dict):
         print("\n错误类型统计：")
         for err_type, count in sorted(error_types.items(), key=lambda x: x[1], reverse=True):
             print(f"  - {err_type}: {count}条")
+
+        # 按统一解析器的分类统计 (见 cleansing_date_grammar.py), 便于判断由哪一步清洗处理
+        kinds = {}
+        for err in errors:
+            kinds[err['kind']] = kinds.get(err['kind'], 0) + 1
+        print("\n按日期格式分类统计：")
+        for kind, count in sorted(kinds.items(), key=lambda x: x[1], reverse=True):
+            print(f"  - {kind}: {count}条")
         
         # 显示前20条错误
         print("\n错误记录详情（前20条）：")
@@ -221,72 +327,38 @@ def print_summary(result: dict):
     print("=" * 80)
 
 
-def export_to_html(result: dict, output_path: Path):
-    """导出错误记录到HTML"""
-    errors = result['errors']
+def export_to_html(conn: sqlite3.Connection, result: dict, output_path: Path) -> Path:
+    """导出错误记录到HTML (直接从 date_validation 表流式读取和写入, 见 cleansing_report.py)，返回实际写入的文件"""
     stats = result['stats']
-    
-    html = '''<!DOCTYPE html>
-<html>
-<head>
-<meta charset="UTF-8">
-<title>日期列验证结果</title>
-<style>
+
+    style = """
 body { font-family: sans-serif; margin: 20px; }
-table { border-collapse: collapse; font-size: 12px; margin-bottom: 30px; }
-th, td { border: 1px solid #ddd; padding: 6px; }
-th { background-color: #4472C4; color: white; position: sticky; top: 0; }
-tr:nth-child(even) { background-color: #f2f2f2; }
-tr:hover { background-color: #ddd; }
-td { max-width: 300px; overflow: hidden; text-overflow: ellipsis; white-space: nowrap; }
+table { margin-bottom: 30px; }
+th, td { padding: 6px; }
+td { max-width: 300px; }
 .error { color: red; }
 .summary { background-color: #f0f0f0; padding: 10px; margin-bottom: 20px; }
-</style>
-</head>
-<body>
-<h1>日期列验证结果</h1>
+"""
+    with HtmlReport(output_path, "日期列验证结果", style) as report:
+        report.write(f'''<h1>日期列验证结果</h1>
 <div class="summary">
-<p><strong>总记录数:</strong> ''' + str(stats['total']) + '''</p>
-<p><strong>有效记录:</strong> ''' + str(stats['valid']) + '''</p>
-<p><strong>无效记录:</strong> ''' + str(stats['invalid']) + '''</p>
-<p><strong>空值记录:</strong> ''' + str(stats['empty']) + '''</p>
+<p><strong>总记录数:</strong> {stats['total']}</p>
+<p><strong>有效记录:</strong> {stats['valid']}</p>
+<p><strong>无效记录:</strong> {stats['invalid']}</p>
+<p><strong>空值记录:</strong> {stats['empty']}</p>
 </div>
-'''
-    
-    if errors:
-        html += f'<h2>错误记录（共 {len(errors)} 条）</h2>'
-        html += '''
-<table>
-<tr>
-    <th>ROWID</th>
-    <th>文件名</th>
-    <th>职员全名</th>
-    <th>日期值</th>
-    <th>解析后的日期</th>
-    <th>错误信息</th>
-</tr>
-'''
-        for err in errors:
-            worker = err['worker_name'] if err['worker_name'] is not None else ''
-            html += f'''<tr>
-    <td>{err['rowid']}</td>
-    <td>{err['filename']}</td>
-    <td>{worker}</td>
-    <td>{err['date_value']}</td>
-    <td>{err['parsed_dates']}</td>
-    <td class="error">{'<br>'.join(err['errors'])}</td>
-</tr>
-'''
-        html += '</table>'
-    else:
-        html += '<p style="color: green; font-size: 18px;">✓ 所有日期记录验证通过！</p>'
-    
-    html += '''
-</body>
-</html>'''
-    
-    with open(output_path, 'w', encoding='utf-8') as f:
-        f.write(html)
+''')
+        if stats['invalid']:
+            report.write(f'<h2>错误记录（共 {stats["invalid"]} 条）</h2>\n')
+            report.table(
+                ['ROWID', '文件名', '职员全名', '日期值', '解析后的日期', '错误信息'],
+                ([err['rowid'], err['filename'], err['worker_name'], err['date_value'], err['parsed_dates'],
+                  raw('<br>'.join(escape(e) for e in err['errors']))] for err in iter_error_records(conn)),
+                cell_classes={5: 'error'},
+            )
+        else:
+            report.write('<p style="color: green; font-size: 18px;">✓ 所有日期记录验证通过！</p>\n')
+    return report.path
 
 
 def main():
@@ -303,17 +375,36 @@ def main():
         action="store_true",
         help="导出错误到HTML报告"
     )
+    parser.add_argument(
+        "--workers",
+        type=int,
+        default=1,
+        help="并行验证的进程数 (0 为 CPU 核数, 默认 1 不并行, 见 cleansing_parallel.py)"
+    )
+    parser.add_argument(
+        "--revalidate",
+        action="store_true",
+        help="清空 date_validation 表, 重新验证全部 (日期, 文件名)"
+    )
+    parser.add_argument(
+        "--shard",
+        help="只处理指定年份的分片数据库 (见 payroll_shards.py)，如 2025"
+    )
     args = parser.parse_args()
+    db_path = shard_db_path_for_year(args.shard) if args.shard else DB_PATH
     
-    if not DB_PATH.exists():
-        print(f"错误: 数据库文件不存在: {DB_PATH}")
+    if not db_path.exists():
+        print(f"错误: 数据库文件不存在: {db_path}")
         sys.exit(1)
     
-    conn = sqlite3.connect(str(DB_PATH))
+    conn = sqlite3.connect(str(db_path))
     
     print("开始验证日期列...")
-    
-    result = validate_all_records(conn)
+
+    if args.revalidate:
+        conn.execute(f"DROP TABLE IF EXISTS {VALIDATION_TABLE}")
+    result = validate_all_records(conn, args.workers)
+    print(f"本次验证 {result['validated']} 个新的 (日期, 文件名), 其余取自 {VALIDATION_TABLE} 表")
     
     print_summary(result)
     
@@ -331,8 +422,8 @@ def main():
     
     if args.export_html:
         output_path = Path(__file__).parent / "date_validation_output.html"
-        export_to_html(result, output_path)
-        print(f"\n已导出到: {output_path}")
+        report = export_to_html(conn, result, output_path)
+        print(f"\n已导出到: {report}")
     
     conn.close()
     